@@ -1,110 +1,4372 @@
 # Security.py - ФИКС СТАТИСТИКИ
-import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext, simpledialog, filedialog
+import time
+_STARTUP_T0 = time.perf_counter()  # Для замера времени до первого окна
+
 import os
-import psutil
-import platform
+import sys
 from datetime import datetime
-import csv
+import threading
+import queue
+import json
+import re
+import fnmatch
+import itertools
+from collections import namedtuple, OrderedDict, Counter, deque
+from array import array
+import heapq
+import struct
+from dataclasses import dataclass, field
+
+# Тяжёлые модули (psutil, sqlite3, hashlib, mmap, csv, platform, statistics,
+# concurrent.futures) импортируются там, где нужны, чтобы не платить за
+# них при запуске окна и консольных команд, которым они не нужны
+
+# tkinter импортируется только в графическом режиме (см. load_tk),
+# чтобы консольный режим запускался без него
+tk = ttk = messagebox = scrolledtext = simpledialog = filedialog = None
+
+def load_tk():
+    """Импорт tkinter для графического режима"""
+    global tk, ttk, messagebox, scrolledtext, simpledialog, filedialog
+    import tkinter as tk
+    from tkinter import ttk, messagebox, scrolledtext, simpledialog, filedialog
+
+# ==================== ЗАПИСИ ====================
+
+# Шаблоны причин: текст собирается только при показе или экспорте
+THREAT_REASONS = {
+    'RULE': 'Правило {detail}',
+    'HASH': 'Совпадение с сигнатурой {detail}',
+    'PATTERN': 'Байтовая сигнатура {detail} по смещению {offset}',
+    'PARTIAL': 'Совпадение частичного отпечатка (начало и конец файла) {detail}',
+}
+
+# Уровни правил совпадают с цветами интерфейса, от самого опасного
+RULE_SEVERITIES = ('critical', 'high', 'medium', 'low')
+SEVERITY_ORDER = {severity: rank for rank, severity in enumerate(RULE_SEVERITIES)}
+
+# Уровень угроз, у которых он не задан правилом
+THREAT_SEVERITIES = {'HASH': 'critical', 'PARTIAL': 'high', 'PATTERN': 'high'}
+
+def format_addr(addr):
+    """Адрес (ip, port) в виде строки ip:port"""
+    return f"{addr[0]}:{addr[1]}" if addr else ''
+
+@dataclass(slots=True)
+class ThreatRecord:
+    """Найденная угроза (компактная запись, причина форматируется лениво)"""
+    file: str
+    type: str
+    detail: str
+    offset: int = None
+    severity: str = None  # Уровень сработавшего правила
+    timestamp: float = field(default_factory=time.time)
+    
+    @property
+    def reason(self):
+        return THREAT_REASONS.get(self.type, '{detail}').format(detail=self.detail, offset=self.offset)
+    
+    @property
+    def level(self):
+        return self.severity or THREAT_SEVERITIES.get(self.type, 'medium')
+    
+    @property
+    def time(self):
+        return datetime.fromtimestamp(self.timestamp)
+    
+    def as_dict(self):
+        """Словарь для экспорта и JSON-вывода"""
+        return {
+            'file': self.file,
+            'type': self.type,
+            'reason': self.reason,
+            'detail': self.detail,
+            'offset': self.offset,
+            'severity': self.level,
+            'timestamp': self.time.isoformat(timespec='seconds')
+        }
+
+@dataclass(slots=True)
+class ProcessRecord:
+    """Снимок процесса"""
+    pid: int
+    name: str
+    cpu: float
+    memory: float
+    rss: int = 0
+    rss_delta: int = 0  # Изменение RSS с прошлого замера, байт
+    ppid: int = None
+    exe: str = ''
+    cmdline: str = ''
+    exe_sha256: bytes = None
+    threat: str = None  # Имя сигнатуры, если исполняемый файл есть в базе
+    rule: str = None  # Самое опасное сработавшее правило (RuleSet)
+    severity: str = None
+    
+    def as_dict(self):
+        return {
+            'pid': self.pid,
+            'name': self.name,
+            'cpu': self.cpu,
+            'memory': self.memory,
+            'rss': self.rss,
+            'rss_delta': self.rss_delta,
+            'ppid': self.ppid,
+            'exe': self.exe,
+            'cmdline': self.cmdline,
+            'exe_sha256': self.exe_sha256.hex() if self.exe_sha256 else None,
+            'threat': self.threat,
+            'rule': self.rule,
+            'severity': self.severity
+        }
+
+@dataclass(slots=True)
+class ConnectionRecord:
+    """Сетевое соединение; адреса хранятся кортежами (ip, port) из psutil"""
+    pid: int
+    laddr: tuple
+    raddr: tuple
+    status: str
+    process: str = ''  # Имя процесса-владельца (из снимка процессов)
+    hostname: str = None  # Обратный DNS удалённого адреса, если уже известен
+    blocked: str = None  # Запись блок-листа, под которую попал удалённый адрес
+    rule: str = None  # Самое опасное сработавшее правило (RuleSet)
+    severity: str = None
+    
+    @property
+    def local(self):
+        return format_addr(self.laddr)
+    
+    @property
+    def remote(self):
+        return format_addr(self.raddr)
+    
+    @property
+    def key(self):
+        return (self.pid, tuple(self.laddr or ()), tuple(self.raddr or ()), self.status)
+    
+    def as_dict(self):
+        return {
+            'pid': self.pid,
+            'process': self.process,
+            'local': self.local,
+            'remote': self.remote,
+            'hostname': self.hostname,
+            'status': self.status,
+            'blocked': self.blocked,
+            'rule': self.rule,
+            'severity': self.severity
+        }
+
+def measure_record_memory(count=10000):
+    """Память на одну запись угрозы: словарь со строками против ThreatRecord (байт)"""
+    import tracemalloc
+    
+    def build_dicts():
+        return [{
+            'file': f'/data/file_{i}.exe',
+            'type': 'RULE',
+            'reason': 'Правило suspicious-extension',
+            'timestamp': datetime.now()
+        } for i in range(count)]
+    
+    def build_records():
+        return [ThreatRecord(f'/data/file_{i}.exe', 'RULE', 'suspicious-extension', severity='medium') for i in range(count)]
+    
+    result = {}
+    for name, build in (('dict', build_dicts), ('record', build_records)):
+        tracemalloc.start()
+        rows = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del rows
+        result[name] = size / count
+    return result
 
 # ==================== БАЗОВЫЕ КОМПОНЕНТЫ ====================
 
+DATA_DIR = os.path.join(os.path.expanduser('~'), '.security_monitor')
+DOWNLOADS_DIR = os.path.join(os.path.expanduser('~'), 'Downloads')
+
+# Куда компоненты сообщают об ошибках: окно направляет их в журнал событий,
+# консольный режим - строкой JSON (emit), иначе они идут в stderr
+_error_handler = None
+
+def set_error_handler(handler):
+    """Установка получателя ошибок handler(текст), None - stderr"""
+    global _error_handler
+    _error_handler = handler
+
+def report_error(message):
+    """Сообщение об ошибке компонента (можно звать из любого потока)"""
+    handler = _error_handler
+    if handler is None:
+        sys.stderr.write(message + "\n")
+    else:
+        handler(message)
+
+class _NullContext:
+    """Пустой контекст для выключенных таймеров и профилирования"""
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+_NULL_CONTEXT = _NullContext()
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'started')
+    
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.metrics.add_time(self.name, time.perf_counter() - self.started)
+        return False
+
+class _Profile:
+    __slots__ = ('metrics', 'operation', 'profiler')
+    
+    def __init__(self, metrics, operation):
+        self.metrics = metrics
+        self.operation = operation
+        self.profiler = None
+    
+    def __enter__(self):
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return self  # Уже профилируется в другом потоке (Python 3.12+)
+        self.profiler = profiler
+        return self
+    
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.metrics.add_profile(self.operation, self.profiler)
+        return False
+
+PROFILE_OPERATIONS = ('scan_job', 'scan', 'processes', 'connections', 'render')
+
+class Instrumentation:
+    """Таймеры и счётчики горячих участков, профилирование по операциям.
+    
+    По умолчанию выключено: timer() возвращает общий пустой контекст, а
+    циклы обхода проверяют enabled один раз на каталог, так что без
+    включения расходы - проверка флага. cProfile включается отдельно для
+    каждой операции из PROFILE_OPERATIONS.
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.timers = {}  # имя -> [вызовов, всего с, максимум с]
+        self.counters = Counter()
+        self.profiled = set()
+        self.profiles = {}  # операция -> pstats.Stats
+        self.started = time.time()
+        self._lock = threading.Lock()
+    
+    def count(self, name, value=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += value
+    
+    def add_time(self, name, seconds, calls=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [calls, seconds, seconds]
+                return
+            timer[0] += calls
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+    
+    def take(self):
+        """Счётчики и таймеры со сбросом (передача из процесса пула сканирования)"""
+        with self._lock:
+            counters, timers = self.counters, self.timers
+            self.counters, self.timers = Counter(), {}
+        return counters, timers
+    
+    def merge(self, counters, timers):
+        """Добавление замеров, снятых в другом процессе (см. take)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters.update(counters)
+            for name, (calls, total, peak) in timers.items():
+                timer = self.timers.get(name)
+                if timer is None:
+                    self.timers[name] = [calls, total, peak]
+                    continue
+                timer[0] += calls
+                timer[1] += total
+                if peak > timer[2]:
+                    timer[2] = peak
+    
+    def timer(self, name):
+        """Контекст замера времени участка"""
+        return _Timer(self, name) if self.enabled else _NULL_CONTEXT
+    
+    def profile(self, operation):
+        """Контекст cProfile, если профилирование операции включено"""
+        return _Profile(self, operation) if operation in self.profiled else _NULL_CONTEXT
+    
+    def set_profiling(self, operation, enabled):
+        if enabled:
+            self.profiled.add(operation)
+        else:
+            self.profiled.discard(operation)
+    
+    def add_profile(self, operation, profiler):
+        import pstats
+        with self._lock:
+            stats = self.profiles.get(operation)
+            if stats is None:
+                self.profiles[operation] = pstats.Stats(profiler)
+            else:
+                stats.add(profiler)
+    
+    def profile_report(self, operation, limit=30, sort='cumulative'):
+        """Текстовый отчёт pstats по накопленному профилю операции"""
+        import io
+        with self._lock:
+            stats = self.profiles.get(operation)
+            if stats is None:
+                return f"Профиль операции {operation} пуст"
+            out = io.StringIO()
+            stats.stream = out
+            stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+    
+    def reset(self):
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+            self.profiles.clear()
+            self.started = time.time()
+    
+    def snapshot(self):
+        """Все метрики словарём (для JSON и таблицы)"""
+        with self._lock:
+            timers = {
+                name: {
+                    'calls': calls,
+                    'total_ms': round(total * 1000, 3),
+                    'avg_ms': round(total / calls * 1000, 4) if calls else 0.0,
+                    'max_ms': round(peak * 1000, 3)
+                }
+                for name, (calls, total, peak) in sorted(self.timers.items())
+            }
+            counters = dict(sorted(self.counters.items()))
+        return {
+            'enabled': self.enabled,
+            'seconds': round(time.time() - self.started, 1),
+            'timers': timers,
+            'counters': counters
+        }
+    
+    def to_prometheus(self, prefix='security_monitor'):
+        """Метрики в текстовом формате Prometheus"""
+        with self._lock:
+            timers = sorted(self.timers.items())
+            counters = sorted(self.counters.items())
+        lines = [
+            f"# HELP {prefix}_operation_seconds Время горячих участков",
+            f"# TYPE {prefix}_operation_seconds summary"
+        ]
+        for name, (calls, total, _) in timers:
+            lines.append(f'{prefix}_operation_seconds_sum{{operation="{name}"}} {total:.6f}')
+            lines.append(f'{prefix}_operation_seconds_count{{operation="{name}"}} {calls}')
+        lines.append(f"# TYPE {prefix}_operation_seconds_max gauge")
+        for name, (_, _, peak) in timers:
+            lines.append(f'{prefix}_operation_seconds_max{{operation="{name}"}} {peak:.6f}')
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, value in counters:
+            lines.append(f'{prefix}_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+    
+    def dump(self, path):
+        """Сохранение в файл: .prom - Prometheus, иначе JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+METRICS = Instrumentation()
+
+FileEntry = namedtuple('FileEntry', ['path', 'name', 'size', 'mtime_ns', 'inode', 'dev'])
+
+class FileWalker:
+    """Обход дерева каталогов через os.scandir.
+    
+    Тип записи берётся из DirEntry без stat, а размер, mtime и inode -
+    из кэшированного DirEntry.stat() (на Windows он бесплатный, на Linux
+    это один вызов вместо exists + getsize). Каталоги обходятся стеком,
+    поэтому память не растёт с глубиной и размером дерева.
+    
+    symlinks: 'skip' - игнорировать ссылки, 'files' - учитывать ссылки на
+    файлы, но не заходить в ссылки на каталоги (как os.walk),
+    'follow' - следовать всем ссылкам с защитой от циклов.
+    """
+    
+    SYMLINK_POLICIES = ('skip', 'files', 'follow')
+    
+    def __init__(self, exclude=None, max_depth=None, symlinks='files', one_filesystem=False):
+        if symlinks not in self.SYMLINK_POLICIES:
+            raise ValueError(f"Неизвестная политика ссылок: {symlinks}")
+        self.exclude = list(exclude or [])
+        self.max_depth = max_depth
+        self.symlinks = symlinks
+        self.one_filesystem = one_filesystem
+        
+        # Все шаблоны исключений собираются в одно регулярное выражение
+        self._exclude_re = None
+        if self.exclude:
+            self._exclude_re = re.compile('|'.join(
+                fnmatch.translate(os.path.normcase(pattern)) for pattern in self.exclude
+            ))
+    
+    def is_excluded(self, name, path):
+        if self._exclude_re is None:
+            return False
+        match = self._exclude_re.match
+        return bool(match(os.path.normcase(name)) or match(os.path.normcase(path)))
+    
+    @staticmethod
+    def entry_for(path):
+        """Запись FileEntry для отдельного файла"""
+        st = os.stat(path)
+        return FileEntry(path, os.path.basename(path), st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev)
+    
+    def iter_dirs(self, root, cancel_event=None):
+        """Генератор (каталог, [FileEntry]) - по одному на каталог"""
+        try:
+            root_st = os.stat(root)
+        except OSError:
+            return
+        root_dev = root_st.st_dev
+        
+        follow_dirs = self.symlinks == 'follow'
+        follow_files = self.symlinks != 'skip'
+        skip_links = self.symlinks == 'skip'
+        check_dirs = self.one_filesystem or follow_dirs
+        excluded = self.is_excluded if self._exclude_re is not None else None
+        max_depth = self.max_depth
+        visited = {(root_st.st_dev, root_st.st_ino)}
+        stack = [(root, 0)]
+        timed = METRICS.enabled
+        perf_counter = time.perf_counter
+        
+        while stack:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            directory, depth = stack.pop()
+            descend = max_depth is None or depth < max_depth
+            files = []
+            if timed:
+                dir_started = perf_counter()
+                stat_seconds = 0.0
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if skip_links and entry.is_symlink():
+                                continue
+                            
+                            if entry.is_dir(follow_symlinks=follow_dirs):
+                                if not descend or (excluded and excluded(entry.name, entry.path)):
+                                    continue
+                                if check_dirs:
+                                    st = entry.stat(follow_symlinks=follow_dirs)
+                                    # На Windows DirEntry.stat() не заполняет st_dev/st_ino
+                                    if not st.st_dev:
+                                        st = os.stat(entry.path)
+                                    if self.one_filesystem and st.st_dev != root_dev:
+                                        continue
+                                    if follow_dirs:
+                                        key = (st.st_dev, st.st_ino)
+                                        if key in visited:
+                                            continue
+                                        visited.add(key)
+                                stack.append((entry.path, depth + 1))
+                            
+                            elif entry.is_file(follow_symlinks=follow_files):
+                                if excluded and excluded(entry.name, entry.path):
+                                    continue
+                                if timed:
+                                    stat_started = perf_counter()
+                                    st = entry.stat(follow_symlinks=follow_files)
+                                    stat_seconds += perf_counter() - stat_started
+                                else:
+                                    st = entry.stat(follow_symlinks=follow_files)
+                                files.append(FileEntry(
+                                    entry.path, entry.name, st.st_size, st.st_mtime_ns,
+                                    st.st_ino or entry.inode(), st.st_dev
+                                ))
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            
+            if timed:
+                METRICS.add_time('walk.scandir', perf_counter() - dir_started - stat_seconds)
+                if files:
+                    METRICS.add_time('walk.stat', stat_seconds, calls=len(files))
+                METRICS.count('walk.dirs')
+                METRICS.count('walk.files', len(files))
+            yield directory, files
+    
+    def walk(self, root, cancel_event=None):
+        """Генератор FileEntry по всем файлам дерева"""
+        for directory, files in self.iter_dirs(root, cancel_event):
+            yield from files
+
+class ScanIndex:
+    """Постоянный индекс просканированных файлов (SQLite).
+    
+    Для каждого файла хранятся размер, mtime_ns, inode, SHA-256, найденные
+    байтовые сигнатуры и угрозы внутри архива, поэтому повторный запуск проверяет только новые и
+    изменённые файлы, а у неизменённых результаты берутся из индекса без
+    повторного чтения.
+    Записи читаются сразу на весь каталог (у большого каталога, который
+    проверяется частями, - только имена текущей части), а пишутся пачками. Каталог
+    хранится абсолютным путём: относительные корни (".") из разных рабочих
+    каталогов не смешиваются.
+    """
+    
+    SCHEMA_VERSION = 5
+    FLUSH_EVERY = 1000
+    LOOKUP_CHUNK = 500  # Имён в одном запросе (старые SQLite ограничивают 999 параметрами)
+    
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(DATA_DIR, 'scan_index.db')
+        folder = os.path.dirname(self.db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._pending = []
+        import sqlite3
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        
+        # Индекс - это кэш, поэтому при смене схемы его проще пересоздать
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            self._conn.execute('DROP TABLE IF EXISTS files')
+            self._conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                sha256 BLOB,
+                patterns TEXT,
+                rules_id TEXT,
+                archive TEXT,
+                PRIMARY KEY (dir, name)
+            ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+    
+    def lookup_dir(self, directory):
+        """Все записи каталога: {имя: (size, mtime_ns, inode, sha256, patterns, rules_id, archive)}"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT name, size, mtime_ns, inode, sha256, patterns, rules_id, archive FROM files WHERE dir = ?',
+                (directory,)
+            ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+    
+    def lookup_names(self, directory, names):
+        """Записи только перечисленных файлов каталога (для части большого каталога)"""
+        directory = os.path.abspath(directory)
+        names = list(names)
+        rows = []
+        with self._lock:
+            for i in range(0, len(names), self.LOOKUP_CHUNK):
+                chunk = names[i:i + self.LOOKUP_CHUNK]
+                rows.extend(self._conn.execute(
+                    'SELECT name, size, mtime_ns, inode, sha256, patterns, rules_id, archive FROM files '
+                    f'WHERE dir = ? AND name IN ({",".join("?" * len(chunk))})',
+                    [directory] + chunk
+                ).fetchall())
+        return {row[0]: row[1:] for row in rows}
+    
+    def names(self, directory):
+        """Имена всех файлов каталога в индексе (без остальных полей)"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            rows = self._conn.execute('SELECT name FROM files WHERE dir = ?', (directory,)).fetchall()
+        return {row[0] for row in rows}
+    
+    def lookup(self, directory, name):
+        """Запись одного файла или None"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            return self._conn.execute(
+                'SELECT size, mtime_ns, inode, sha256, patterns, rules_id, archive FROM files WHERE dir = ? AND name = ?',
+                (directory, name)
+            ).fetchone()
+    
+    def record(self, directory, entry, sha256=None, patterns=None, rules_id=None, archive=None):
+        """Запоминание состояния файла (запись откладывается до flush)"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            self._pending.append((
+                directory, entry.name, entry.size, entry.mtime_ns, entry.inode,
+                sha256, patterns, rules_id, archive
+            ))
+            if len(self._pending) >= self.FLUSH_EVERY:
+                self._flush_locked()
+    
+    def forget(self, directory, names):
+        """Удаление записей о файлах, которых больше нет"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            self._flush_locked()
+            self._conn.executemany(
+                'DELETE FROM files WHERE dir = ? AND name = ?',
+                [(directory, name) for name in names]
+            )
+            self._conn.commit()
+    
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+    
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO files (dir, name, size, mtime_ns, inode, sha256, patterns, rules_id, archive) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            self._pending
+        )
+        self._conn.commit()
+        self._pending = []
+    
+    def clear(self):
+        """Полная очистка индекса"""
+        with self._lock:
+            self._pending = []
+            self._conn.execute('DELETE FROM files')
+            self._conn.commit()
+    
+    def __len__(self):
+        with self._lock:
+            self._flush_locked()
+            return self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+    
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            self._conn.close()
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def sha256_file(path, chunk_size=HASH_CHUNK_SIZE):
+    """SHA-256 файла потоковым чтением фиксированными блоками"""
+    import hashlib
+    with open(path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, 'sha256').digest()
+        digest = hashlib.sha256()
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+        return digest.digest()
+
+def sample_ranges(size, sample_size):
+    """Начало и конец файла: [(смещение, длина)] без перекрытия"""
+    if size <= 2 * sample_size:
+        return [(0, size)]
+    return [(0, sample_size), (size - sample_size, sample_size)]
+
+def partial_fingerprint(path, size, sample_size):
+    """SHA-256 от размера, начала и конца файла (отпечаток больших файлов)"""
+    import hashlib
+    digest = hashlib.sha256(size.to_bytes(8, 'little'))
+    with open(path, 'rb') as f:
+        for start, length in sample_ranges(size, sample_size):
+            f.seek(start)
+            digest.update(f.read(length))
+    return digest.digest()
+
+class SignatureDatabase:
+    """Локальная база SHA-256 сигнатур.
+    
+    Формат файла: по одной сигнатуре на строку - hex-хэш и необязательное
+    имя через пробел, строки с # игнорируются. Хэши хранятся как 32-байтные
+    bytes в множестве, поэтому поиск O(1) и при сотнях тысяч записей.
+    Строки вида partial:<hex> - частичные отпечатки больших файлов
+    (см. partial_fingerprint).
+    """
+    
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, 'signatures.txt')
+        self.digests = set()
+        self.partials = set()
+        self.names = {}  # Только для сигнатур с именем
+        self.mtime_ns = None
+    
+    def load(self, path=None):
+        """Загрузка базы из файла, возвращает число сигнатур"""
+        if path:
+            self.path = path
+        digests = set()
+        partials = set()
+        names = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split(None, 1)
+                value = parts[0]
+                target = digests
+                if value.startswith('partial:'):
+                    value = value[8:]
+                    target = partials
+                try:
+                    digest = bytes.fromhex(value)
+                except ValueError:
+                    continue
+                if len(digest) != 32:
+                    continue
+                target.add(digest)
+                if len(parts) > 1:
+                    names[digest] = parts[1]
+        self.digests = digests
+        self.partials = partials
+        self.names = names
+        self.mtime_ns = os.stat(self.path).st_mtime_ns
+        return len(self)
+    
+    def load_if_exists(self):
+        """Загрузка базы по умолчанию, если файл существует"""
+        if self.mtime_ns is not None:
+            return len(self)  # Уже загружена (например, вручную)
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            return self.load()
+        except (OSError, UnicodeDecodeError) as e:
+            report_error(f"Не удалось загрузить сигнатуры: {e}")
+            return 0
+    
+    def match(self, digest):
+        """Имя сигнатуры (или hex-хэш) при совпадении, иначе None"""
+        if digest in self.digests:
+            return self.names.get(digest, digest.hex())
+        return None
+    
+    def match_partial(self, digest):
+        """То же для частичного отпечатка"""
+        if digest in self.partials:
+            return self.names.get(digest, digest.hex())
+        return None
+    
+    def __len__(self):
+        return len(self.digests) + len(self.partials)
+    
+    def __contains__(self, digest):
+        return digest in self.digests
+
+class AnchorGroup:
+    """Сигнатуры одной длины слова для PatternMatcher.
+    
+    Любое вхождение сигнатуры не короче 2 * word - 1 байт целиком
+    содержит слово буфера, выровненное по word. Для каждого из word
+    возможных сдвигов сигнатуры относительно выравнивания выбирается
+    самое редкое её слово (якорь), и буфер читается как массив
+    выровненных слов (на C): сначала пересечение с множеством якорей,
+    затем позиции совпавших якорей, и сигнатура сверяется только по
+    смещению, которое даёт якорь. Стоимость - проход по словам буфера
+    плюс число вхождений якорей, а не число правил.
+    
+    Слово, встретившееся больше HOT_LIMIT раз (выравнивание, типовой код),
+    перестаёт сверяться по позициям: его правила один раз ищет find.
+    """
+    
+    HOT_LIMIT = 1024  # Вхождений слова, после которых его правила ищет find
+    RETIRE_BATCH = 16  # Ненужных слов до пересборки прохода
+    
+    def __init__(self, fmt, patterns, weights):
+        self.fmt = fmt
+        self.word = width = array(fmt).itemsize
+        self.anchors = {}  # слово -> [(rule_id, сдвиг якоря, сигнатура)]
+        self.rejected = {}  # rule_id -> сигнатура без редкого якоря
+        
+        # Слово, которое есть во многих сигнатурах, скорее всего часто
+        # встречается и в файлах (выравнивание, типовые инструкции)
+        shared = Counter()
+        for pattern in patterns.values():
+            shared.update({pattern[j:j + width] for j in range(len(pattern) - width + 1)})
+        
+        for rule_id, pattern in patterns.items():
+            chosen = []
+            for shift in range(width):
+                _, j = min(
+                    (shared[pattern[j:j + width]] * 256 + sum(weights[b] for b in pattern[j:j + width]), j)
+                    for j in range(shift, len(pattern) - width + 1, width)
+                )
+                if len(set(pattern[j:j + width])) == 1 and pattern[j] in PatternMatcher.COMMON_BYTES:
+                    break  # Лучшее слово - нули или заполнитель, якорь был бы везде
+                chosen.append(j)
+            if len(chosen) < width:
+                self.rejected[rule_id] = pattern
+                continue
+            for j in chosen:
+                word = array(fmt, pattern[j:j + width])[0]
+                self.anchors.setdefault(word, []).append((rule_id, j, pattern))
+        self.words = frozenset(self.anchors)
+        self.rule_words = {}  # rule_id -> слова его якорей
+        for word, entries in self.anchors.items():
+            for rule_id, _, _ in entries:
+                self.rule_words.setdefault(rule_id, []).append(word)
+    
+    def scan(self, buffer, view, hits):
+        """Первые вхождения сигнатур группы в hits {rule_id: смещение}.
+        
+        buffer - bytes или mmap (нужен find), view - memoryview на него.
+        """
+        width = self.word
+        size = len(view) // width * width
+        if not self.anchors or not size:
+            return
+        words = array(self.fmt)
+        words.frombytes(view[:size])  # Копия быстрее перебирается, чем memoryview.cast
+        found = set(self.words.intersection(words))
+        anchors = self.anchors
+        pending = {word: len(anchors[word]) for word in found}  # Непроверенных правил на слово
+        seen = Counter()
+        done = set()
+        
+        def settle(rule_id, offset):
+            done.add(rule_id)
+            if offset >= 0:
+                hits[rule_id] = offset
+            for word in self.rule_words[rule_id]:
+                if word in pending:
+                    pending[word] -= 1
+                    if not pending[word]:
+                        retired.append(word)
+        
+        start = 0
+        while found:
+            retired = []
+            positions = itertools.compress(itertools.count(start), map(found.__contains__, words[start:]))
+            for index in positions:
+                word = words[index]
+                seen[word] += 1
+                if seen[word] > self.HOT_LIMIT:
+                    for rule_id, j, pattern in anchors[word]:
+                        if rule_id not in done:
+                            low = max(0, index * width - len(pattern) + width)
+                            settle(rule_id, buffer.find(pattern, low))
+                    continue
+                for rule_id, j, pattern in anchors[word]:
+                    if rule_id in done:
+                        continue
+                    offset = index * width - j
+                    if offset < 0 or buffer[offset:offset + len(pattern)] != pattern:
+                        continue
+                    # Более раннее вхождение могло выровняться по слову
+                    # дальше этого - оно не дальше длины сигнатуры
+                    low = max(0, offset - len(pattern) + width)
+                    settle(rule_id, buffer.find(pattern, low, offset + len(pattern)))
+                if len(retired) > self.RETIRE_BATCH:
+                    break
+            else:
+                return
+            # Слова, у которых не осталось правил, больше не проверяются
+            start = index + 1
+            found.difference_update(retired)
+
+class PatternMatcher:
+    """Поиск множества байтовых сигнатур за один проход.
+    
+    Сигнатуры от 15 байт ищутся по выровненным 8-байтовым словам, от 7 -
+    по 4-байтовым (см. AnchorGroup), поэтому время линейно по размеру
+    буфера и почти не зависит от числа правил.
+    Редкость слова оценивается по тому, во скольких сигнатурах оно есть, и
+    по частоте его байтов (нули и 0xFF в исполняемых файлах встречаются
+    чаще всего).
+    
+    Сигнатуры короче 7 байт, сигнатуры без редкого якоря (из одних нулей)
+    и небольшие наборы (до FIND_MAX) ищутся по одной через find на C.
+    Для каждого правила выдаётся только первое вхождение.
+    """
+    
+    FIND_MAX = 16  # Столько сигнатур быстрее искать по одной через find
+    GROUPS = (('Q', 15), ('I', 7))  # (формат слова, минимальная длина сигнатуры)
+    COMMON_BYTES = {0x00: 64, 0xFF: 16, 0xCC: 4, 0x90: 4, 0x48: 4, 0x8B: 4, 0x89: 4, 0x20: 2}
+    
+    def __init__(self, patterns):
+        # patterns: {rule_id: bytes}
+        patterns = {rule_id: pattern for rule_id, pattern in patterns.items() if pattern}
+        self._find = {}  # rule_id -> сигнатура, которую ищет find
+        self._groups = []
+        self._overlap = max(map(len, patterns.values()), default=1) - 1
+        
+        if len(patterns) <= self.FIND_MAX:
+            self._find = patterns
+            return
+        
+        counts = Counter()
+        for pattern in patterns.values():
+            counts.update(pattern)
+        total = sum(counts.values())
+        weights = [
+            counts[b] * 256 / total + self.COMMON_BYTES.get(b, 1)
+            for b in range(256)
+        ]
+        rest = patterns
+        for fmt, min_length in self.GROUPS:
+            group = AnchorGroup(fmt, {rule_id: pattern for rule_id, pattern in rest.items()
+                                      if len(pattern) >= min_length}, weights)
+            if group.anchors:
+                self._groups.append(group)
+            self._find.update(group.rejected)
+            rest = {rule_id: pattern for rule_id, pattern in rest.items() if len(pattern) < min_length}
+        self._find.update(rest)
+    
+    def __len__(self):
+        return len(self._find) + sum(len(group.rule_words) for group in self._groups)
+    
+    def stream(self, max_hits=100):
+        """Потоковый поиск по кускам (см. MatchStream)"""
+        return MatchStream(self, max_hits)
+    
+    def scan(self, buffer, stream=None):
+        """Генератор (rule_id, первое смещение) по буферу (bytes, mmap, memoryview).
+        
+        Совпадения выдаются по возрастанию смещения. stream - MatchStream,
+        в котором хранится конец прошлого куска: совпадения на границе
+        кусков ищутся в нём плюс начале нового куска (смещение тогда
+        отрицательное - относительно начала куска), без копирования
+        всего куска.
+        """
+        hits = {}
+        if stream is not None and stream.tail:
+            lead = len(stream.tail)
+            edge = stream.tail + bytes(buffer[:self._overlap])
+            for rule_id, offset in self._first_hits(edge).items():
+                if offset < lead:
+                    hits[rule_id] = offset - lead
+        if stream is not None:
+            keep = self._overlap
+            if not keep:
+                stream.tail = b''
+            elif len(buffer) >= keep:
+                stream.tail = bytes(buffer[len(buffer) - keep:])
+            else:
+                stream.tail = (stream.tail + bytes(buffer))[-keep:]
+        for rule_id, offset in self._first_hits(buffer).items():
+            hits.setdefault(rule_id, offset)
+        for rule_id, offset in sorted(hits.items(), key=lambda item: item[1]):
+            yield rule_id, offset
+    
+    def _first_hits(self, buffer):
+        """{rule_id: первое смещение} по одному буферу"""
+        hits = {}
+        if not hasattr(buffer, 'find'):
+            buffer = bytes(buffer)
+        if self._find:
+            for rule_id, pattern in self._find.items():
+                offset = buffer.find(pattern)
+                if offset >= 0:
+                    hits[rule_id] = offset
+        if self._groups:
+            with memoryview(buffer) as view:
+                for group in self._groups:
+                    group.scan(buffer, view, hits)
+        return hits
+
+class MatchStream:
+    """Поиск сигнатур в потоке (например, распаковываемом файле) по кускам.
+    
+    Между кусками переносится только их граница (длина самой длинной
+    сигнатуры), смещения - от начала потока, для каждого правила
+    запоминается первое совпадение.
+    """
+    
+    def __init__(self, matcher, max_hits=100):
+        self.matcher = matcher
+        self.max_hits = max_hits
+        self.tail = b''
+        self.offset = 0
+        self.hits = {}
+    
+    @property
+    def done(self):
+        return len(self.hits) >= self.max_hits
+    
+    def feed(self, chunk):
+        if not self.done:
+            for rule_id, pos in self.matcher.scan(chunk, self):
+                if rule_id not in self.hits:
+                    self.hits[rule_id] = self.offset + pos
+                    if self.done:
+                        break
+        self.offset += len(chunk)
+    
+    def results(self):
+        """[[rule_id, смещение], ...] как у PatternDatabase.match_file"""
+        return [[rule_id, offset] for rule_id, offset in self.hits.items()]
+
+class PatternDatabase:
+    """Локальная база байтовых сигнатур для PatternMatcher.
+    
+    Формат файла: <rule_id> <hex-байты> или <rule_id> "текст" на строку,
+    строки с # игнорируются. Отпечаток набора правил хранится в индексе,
+    чтобы результаты неизменённых файлов переиспользовались, пока правила
+    те же.
+    """
+    
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, 'patterns.txt')
+        self.patterns = {}
+        self.matcher = None
+        self.fingerprint = None
+    
+    def load(self, path=None):
+        """Загрузка и компиляция правил, возвращает их число"""
+        if path:
+            self.path = path
+        patterns = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split(None, 1)
+                if len(parts) != 2:
+                    continue
+                rule_id, value = parts
+                if len(value) >= 2 and value[0] == value[-1] == '"':
+                    pattern = value[1:-1].encode('utf-8')
+                else:
+                    try:
+                        pattern = bytes.fromhex(value)
+                    except ValueError:
+                        continue
+                if pattern:
+                    patterns[rule_id] = pattern
+        self.compile(patterns)
+        return len(patterns)
+    
+    def compile(self, patterns):
+        """Компиляция набора правил {rule_id: bytes} в автомат"""
+        import hashlib
+        digest = hashlib.sha256()
+        for rule_id in sorted(patterns):
+            digest.update(rule_id.encode('utf-8') + b'\0' + patterns[rule_id] + b'\0')
+        self.patterns = dict(patterns)
+        self.matcher = PatternMatcher(self.patterns) if patterns else None
+        self.fingerprint = digest.hexdigest()[:16]
+    
+    def load_if_exists(self):
+        """Загрузка базы по умолчанию, если файл существует"""
+        if self.fingerprint is not None:
+            return len(self)  # Уже загружена
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            return self.load()
+        except (OSError, UnicodeDecodeError) as e:
+            report_error(f"Не удалось загрузить правила сигнатур: {e}")
+            return 0
+    
+    def match_file(self, path, max_hits=100):
+        """Поиск сигнатур в файле через mmap: [[rule_id, первое смещение], ...]"""
+        import mmap
+        hits = {}
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for rule_id, offset in self.matcher.scan(mm):
+                    if rule_id not in hits:
+                        hits[rule_id] = offset
+                        if len(hits) >= max_hits:
+                            break
+        return [[rule_id, offset] for rule_id, offset in hits.items()]
+    
+    def match_ranges(self, path, ranges, max_hits=100):
+        """Поиск сигнатур только в участках файла [(смещение, длина), ...]"""
+        hits = {}
+        with open(path, 'rb') as f:
+            for start, length in ranges:
+                f.seek(start)
+                for rule_id, offset in self.matcher.scan(f.read(length)):
+                    if rule_id not in hits:
+                        hits[rule_id] = start + offset
+                        if len(hits) >= max_hits:
+                            break
+        return [[rule_id, offset] for rule_id, offset in hits.items()]
+    
+    def __len__(self):
+        return len(self.patterns)
+
+class ScanResultStore:
+    """Индексированное хранилище найденных угроз.
+    
+    Угрозы лежат в словаре с ключом (файл, тип, правило), поэтому проверка
+    на дубликат - O(1). Список ключей в порядке добавления даёт страницы
+    и последние записи за O(размер страницы), индексы по типу и по файлу
+    ускоряют фильтрацию. Записи только добавляются, поэтому читать можно
+    во время сканирования.
+    """
+    
+    def __init__(self):
+        self._items = {}
+        self._order = []
+        self._by_type = {}  # тип -> [ключи]
+        self._by_file = {}
+    
+    @staticmethod
+    def key(threat):
+        return (threat.file, threat.type, threat.detail)
+    
+    def add(self, threat):
+        """Добавление угрозы, False если такая уже есть"""
+        key = self.key(threat)
+        if key in self._items:
+            return False
+        self._items[key] = threat
+        self._order.append(key)
+        self._by_type.setdefault(threat.type, []).append(key)
+        self._by_file.setdefault(threat.file, []).append(key)
+        return True
+    
+    def __len__(self):
+        return len(self._order)
+    
+    def __iter__(self):
+        return self._iter_keys(self._order)
+    
+    def __contains__(self, path):
+        return path in self._by_file
+    
+    def _iter_keys(self, keys):
+        # Длина фиксируется заранее: добавленное во время обхода не попадёт
+        items = self._items
+        for i in range(len(keys)):
+            yield items[keys[i]]
+    
+    def clear(self):
+        self._items.clear()
+        self._order.clear()
+        self._by_type.clear()
+        self._by_file.clear()
+    
+    def types(self):
+        return list(self._by_type)
+    
+    def for_file(self, path):
+        """Все угрозы одного файла"""
+        return list(self._iter_keys(self._by_file.get(path, [])))
+    
+    def recent(self, count):
+        """Последние count угроз в порядке добавления"""
+        return [self._items[key] for key in self._order[-count:]] if count > 0 else []
+    
+    def filter(self, threat_type=None, reason=None, since=None, until=None):
+        """Генератор угроз по типу, подстроке причины и интервалу времени.
+        
+        since/until - datetime или секунды epoch.
+        """
+        if isinstance(since, datetime):
+            since = since.timestamp()
+        if isinstance(until, datetime):
+            until = until.timestamp()
+        keys = self._order if threat_type is None else self._by_type.get(threat_type, [])
+        for threat in self._iter_keys(keys):
+            if since is not None and threat.timestamp < since:
+                continue
+            if until is not None and threat.timestamp > until:
+                continue
+            if reason is not None and reason not in threat.reason:
+                continue
+            yield threat
+    
+    def page(self, offset, limit, **filters):
+        """Страница результатов (с теми же фильтрами, что и filter)"""
+        if not filters:
+            return [self._items[key] for key in self._order[offset:offset + limit]]
+        return list(itertools.islice(self.filter(**filters), offset, offset + limit))
+    
+    def chunks(self, size):
+        """Все результаты пачками по size, без копии всего хранилища"""
+        offset = 0
+        while True:
+            chunk = self.page(offset, size)
+            if not chunk:
+                return
+            yield chunk
+            offset += len(chunk)
+
+DEFAULT_RULES = {
+    'rules': [
+        {
+            'id': 'suspicious-extension',
+            'target': 'file',
+            'severity': 'medium',
+            'description': 'подозрительное расширение',
+            'extensions': ['.exe', '.bat', '.vbs', '.ps1', '.js']
+        }
+    ]
+}
+
+# Условия правил: ключ в файле -> (поле записи, вид проверки).
+# Индексируются exact, prefix, range, cidr и glob без подстановочных
+# символов (см. RuleIndex), остальные glob и contains проверяются
+# только у кандидатов
+RULE_FIELDS = {
+    'file': {
+        'extensions': ('ext', 'exact'),
+        'paths': ('path', 'prefix'),
+        'size': ('size', 'range'),
+        'names': ('name', 'glob'),
+    },
+    'process': {
+        'names': ('name', 'exact'),
+        'exe_paths': ('exe', 'prefix'),
+        'cpu': ('cpu', 'range'),
+        'memory': ('memory', 'range'),
+        'cmdline': ('cmdline', 'contains'),
+    },
+    'network': {
+        'remote_ports': ('remote_port', 'range'),
+        'processes': ('process', 'exact'),
+        'local_ports': ('local_port', 'range'),
+        'status': ('status', 'exact'),
+        'remote': ('remote_ip', 'cidr'),
+    },
+}
+
+def split_path(path):
+    """Компоненты пути в нормализованном регистре (для префиксов правил)"""
+    return tuple(part for part in re.split(r'[\\/]+', os.path.normcase(path)) if part)
+
+class RangeIndex:
+    """Числовые интервалы правил, поиск - один bisect.
+    
+    Границы интервалов делят ось на отрезки, и для каждого отрезка заранее
+    собран кортеж правил, чьи интервалы его покрывают. Границы хранятся
+    парами (значение, 0 - начало / 1 - после конца), поэтому оба конца
+    интервала входят в него.
+    """
+    
+    def __init__(self):
+        self.ranges = []  # (от, до, правило), None - без границы
+        self.bounds = []
+        self.segments = [()]
+    
+    def add(self, low, high, value):
+        self.ranges.append((low, high, value))
+    
+    def compile(self):
+        events = []
+        for number, (low, high, _) in enumerate(self.ranges):
+            events.append(((float('-inf') if low is None else low, 0), number))
+            events.append(((float('inf') if high is None else high, 1), number))
+        events.sort()
+        active = {}
+        self.bounds = []
+        self.segments = [()]
+        for bound, number in events:
+            if bound[1] == 0:
+                active[number] = self.ranges[number][2]
+            else:
+                active.pop(number, None)
+            self.bounds.append(bound)
+            self.segments.append(tuple(active.values()))
+    
+    def lookup(self, number):
+        import bisect
+        return self.segments[bisect.bisect_right(self.bounds, (number, 0.5))]
+
+class PathTrie:
+    """Префиксы путей по компонентам, поиск проходит путь один раз"""
+    
+    def __init__(self):
+        self.root = {}  # компонент -> узел, ключ None - значения узла
+    
+    def insert(self, parts, value):
+        node = self.root
+        for part in parts:
+            node = node.setdefault(part, {})
+        node.setdefault(None, []).append(value)
+    
+    def lookup(self, parts):
+        """Значения всех префиксов пути (parts - результат split_path)"""
+        node = self.root
+        found = list(node.get(None, ()))
+        for part in parts:
+            node = node.get(part)
+            if node is None:
+                break
+            found.extend(node.get(None, ()))
+        return found
+
+class CidrIndex:
+    """Подсети правил в PrefixTrie (IPv4 и IPv6), поиск - все подсети,
+    содержащие адрес, за один проход по его битам"""
+    
+    def __init__(self):
+        self.tries = {version: PrefixTrie(bits) for version, bits in IPBlocklist.BITS.items()}
+        self.values = []  # метка узла -> [значения]
+        self.labels = {}  # подсеть -> метка
+    
+    def insert(self, network, value):
+        """network - (версия, адрес сети, длина) от IPBlocklist.parse_network"""
+        label = self.labels.get(network)
+        if label is None:
+            label = self.labels[network] = len(self.values)
+            self.values.append([])
+            version, address, length = network
+            self.tries[version].insert(address, length, label)
+        self.values[label].append(value)
+    
+    def lookup(self, address):
+        """Значения всех подсетей адреса (версия, int) от IPBlocklist.parse_ip"""
+        version, number = address
+        found = []
+        for label in self.tries[version].matches(number):
+            found.extend(self.values[label])
+        return found
+
+class Rule:
+    """Скомпилированное правило: условия объединяются через И, значения - через ИЛИ"""
+    
+    __slots__ = ('id', 'target', 'severity', 'description', 'checks', 'rank')
+    
+    def __init__(self, rule_id, target, severity, description, checks):
+        self.id = rule_id
+        self.target = target
+        self.severity = severity
+        self.description = description
+        self.checks = checks  # [(поле, вид, значения)]
+        self.rank = SEVERITY_ORDER[severity]
+    
+    @property
+    def label(self):
+        return f"{self.id} ({self.description})" if self.description else self.id
+    
+    def matches(self, record):
+        for name, kind, values in self.checks:
+            value = record[name]
+            if value is None:
+                return False
+            if kind == 'exact':
+                ok = value in values
+            elif kind == 'prefix':
+                ok = any(value[:len(prefix)] == prefix for prefix in values)
+            elif kind == 'range':
+                ok = any((low is None or low <= value) and (high is None or value <= high) for low, high in values)
+            elif kind == 'glob':
+                ok = any(fnmatch.fnmatchcase(value, pattern) for pattern in values)
+            elif kind == 'contains':
+                ok = any(part in value for part in values)
+            else:  # cidr
+                ok = any(IPBlocklist.in_network(value, network) for network in values)
+            if not ok:
+                return False
+        return True
+
+class RuleIndex:
+    """Индекс правил одного вида (file, process или network).
+    
+    Каждое правило индексируется по одному условию: точные значения (и
+    маски имён без *, ? и [) в словаре, префиксы путей в PathTrie,
+    числовые интервалы в RangeIndex, подсети в CidrIndex, правила без
+    таких условий (только маски и подстроки) - в общем списке. Из условий
+    правила при компиляции берётся то, чей ключ делит меньше всего правил
+    (например, путь, а не частое расширение .exe). Поиск берёт кандидатов
+    из индексов и проверяет у них все условия, так что стоимость записи
+    зависит от числа кандидатов, а не от общего числа правил.
+    """
+    
+    GLOB_MAGIC = re.compile(r'[*?[]')
+    
+    def __init__(self):
+        self.rules = []
+        self.exact = {}  # поле -> {значение: [правила]}
+        self.prefix = {}  # поле -> PathTrie
+        self.ranges = {}  # поле -> RangeIndex
+        self.cidr = {}  # поле -> CidrIndex
+        self.always = []
+    
+    @property
+    def count(self):
+        return len(self.rules)
+    
+    def add(self, rule):
+        self.rules.append(rule)
+    
+    @classmethod
+    def _keys(cls, rule):
+        """Условия правила, пригодные для индекса: [(поле, вид, значения)]"""
+        keys = []
+        for name, kind, values in rule.checks:
+            if kind == 'glob' and not any(cls.GLOB_MAGIC.search(value) for value in values):
+                kind = 'exact'  # Маска без подстановок - просто имя
+            if kind in ('exact', 'prefix', 'range', 'cidr'):
+                keys.append((name, kind, values))
+        return keys
+    
+    def compile(self):
+        keys = {rule: self._keys(rule) for rule in self.rules}
+        
+        # Сколько правил разделили бы каждый ключ индекса
+        load = Counter()
+        for rule in self.rules:
+            for name, kind, values in keys[rule]:
+                if kind == 'range':
+                    load[name] += len(values)
+                else:
+                    load.update((name, value) for value in values)
+        
+        for rule in self.rules:
+            best = None
+            for name, kind, values in keys[rule]:
+                if kind == 'range':
+                    cost = load[name]
+                else:
+                    cost = max((load[name, value] for value in values), default=0)
+                if best is None or cost < best[0]:
+                    best = (cost, name, kind, values)
+            if best is None:
+                self.always.append(rule)
+                continue
+            
+            _, name, kind, values = best
+            if kind == 'exact':
+                table = self.exact.setdefault(name, {})
+                for value in values:
+                    table.setdefault(value, []).append(rule)
+            elif kind == 'prefix':
+                trie = self.prefix.setdefault(name, PathTrie())
+                for prefix in values:
+                    trie.insert(prefix, rule)
+            elif kind == 'cidr':
+                index = self.cidr.setdefault(name, CidrIndex())
+                for network in values:
+                    index.insert(network, rule)
+            else:
+                index = self.ranges.setdefault(name, RangeIndex())
+                for low, high in values:
+                    index.add(low, high, rule)
+        
+        for index in self.ranges.values():
+            index.compile()
+    
+    def match(self, record):
+        """Сработавшие правила, самые опасные первыми"""
+        candidates = list(self.always)
+        for name, table in self.exact.items():
+            candidates.extend(table.get(record[name], ()))
+        for name, trie in self.prefix.items():
+            if record[name] is not None:
+                candidates.extend(trie.lookup(record[name]))
+        for name, index in self.ranges.items():
+            if record[name] is not None:
+                candidates.extend(index.lookup(record[name]))
+        for name, index in self.cidr.items():
+            if record[name] is not None:
+                candidates.extend(index.lookup(record[name]))
+        if not candidates:
+            return []
+        matched = [rule for rule in dict.fromkeys(candidates) if rule.matches(record)]
+        matched.sort(key=lambda rule: rule.rank)
+        return matched
+
+class RuleSet:
+    """Правила обнаружения для файлов, процессов и соединений.
+    
+    Файл - JSON (или TOML через tomllib, YAML при установленном PyYAML):
+    {"rules": [{"id", "target": file|process|network, "severity":
+    critical|high|medium|low, "description", условия из RULE_FIELDS}]}.
+    Числовые условия - число или {"min": ..., "max": ...} (или их список).
+    Без файла действуют DEFAULT_RULES. refresh() перечитывает файл при
+    изменении mtime, а при ошибке в нём остаются прежние правила.
+    """
+    
+    CHECK_INTERVAL = 2.0  # Как часто refresh() смотрит на mtime файла, с
+    
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, 'rules.json')
+        self.mtime_ns = None
+        self.error = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._apply(DEFAULT_RULES)
+    
+    @staticmethod
+    def parse(path):
+        """Чтение файла правил в словарь по расширению"""
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.toml':
+            import tomllib
+            with open(path, 'rb') as f:
+                return tomllib.load(f)
+        if ext in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("для правил в YAML нужен пакет PyYAML")
+            with open(path, 'r', encoding='utf-8') as f:
+                try:
+                    return yaml.safe_load(f)
+                except yaml.YAMLError as e:
+                    raise ValueError(str(e))
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    @staticmethod
+    def compile_rule(spec):
+        """Rule из словаря правила, ValueError при ошибке в описании"""
+        if not isinstance(spec, dict):
+            raise ValueError(f"правило должно быть объектом: {spec!r}")
+        rule_id = str(spec.get('id') or '')
+        target = spec.get('target')
+        severity = spec.get('severity', 'medium')
+        if not rule_id:
+            raise ValueError(f"у правила нет id: {spec!r}")
+        if target not in RULE_FIELDS:
+            raise ValueError(f"{rule_id}: неизвестный target {target!r}")
+        if severity not in SEVERITY_ORDER:
+            raise ValueError(f"{rule_id}: неизвестный severity {severity!r}")
+        fields = RULE_FIELDS[target]
+        unknown = set(spec) - set(fields) - {'id', 'target', 'severity', 'description'}
+        if unknown:
+            raise ValueError(f"{rule_id}: неизвестные условия {', '.join(sorted(unknown))}")
+        
+        checks = []
+        for key, (name, kind) in fields.items():
+            if key not in spec:
+                continue
+            values = spec[key]
+            if not isinstance(values, list):
+                values = [values]
+            try:
+                checks.append((name, kind, RuleSet._compile_values(name, kind, values)))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"{rule_id}: условие {key}: {e}")
+        return Rule(rule_id, target, severity, str(spec.get('description', '')), checks)
+    
+    @staticmethod
+    def _compile_values(name, kind, values):
+        if kind == 'range':
+            ranges = []
+            for value in values:
+                if isinstance(value, dict):
+                    unknown = set(value) - {'min', 'max'}
+                    if unknown:
+                        raise ValueError(f"неизвестные ключи диапазона {', '.join(sorted(map(str, unknown)))}")
+                    low, high = value.get('min'), value.get('max')
+                else:
+                    low = high = value
+                # Границы сравниваются при компиляции индекса (RangeIndex),
+                # поэтому строка или bool здесь - ошибка файла, а не TypeError там
+                for bound in (low, high):
+                    if bound is not None and (
+                        isinstance(bound, bool) or not isinstance(bound, (int, float)) or bound != bound
+                    ):
+                        raise ValueError(f"ожидается число или {{min, max}} с числами: {value!r}")
+                if low is None and high is None and not isinstance(value, dict):
+                    raise ValueError(f"ожидается число или {{min, max}}: {value!r}")
+                if low is not None and high is not None and low > high:
+                    raise ValueError(f"min больше max: {value!r}")
+                ranges.append((low, high))
+            return tuple(ranges)
+        if kind == 'cidr':
+            networks = []
+            for value in values:
+                network = IPBlocklist.parse_network(str(value))
+                if network is None:
+                    raise ValueError(f"неверный адрес {value!r}")
+                networks.append(network)
+            return tuple(networks)
+        if kind == 'prefix':
+            return tuple(split_path(os.path.expanduser(str(value))) for value in values)
+        if name == 'status':
+            return frozenset(str(value).upper() for value in values)
+        if name == 'ext':
+            return frozenset(value if value.startswith('.') else '.' + value for value in map(str.lower, map(str, values)))
+        if kind == 'exact':
+            return frozenset(str(value).lower() for value in values)
+        return tuple(str(value).lower() for value in values)
+    
+    def _apply(self, data):
+        """Компиляция и атомарная замена индексов"""
+        import hashlib
+        if not isinstance(data, dict) or not isinstance(data.get('rules'), list):
+            raise ValueError("ожидается объект с массивом rules")
+        indexes = {target: RuleIndex() for target in RULE_FIELDS}
+        for spec in data['rules']:
+            rule = self.compile_rule(spec)
+            indexes[rule.target].add(rule)
+        for index in indexes.values():
+            index.compile()
+        self.indexes = indexes
+        self.fingerprint = hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    
+    def load(self, path=None):
+        """Загрузка и компиляция правил из файла, возвращает их число"""
+        if path:
+            self.path = path
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        self._apply(self.parse(self.path))
+        self.mtime_ns = mtime_ns
+        self.error = None
+        return len(self)
+    
+    def load_if_exists(self):
+        """Загрузка файла по умолчанию, если он существует"""
+        if self.mtime_ns is not None:
+            return len(self)
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            return self.load()
+        except (OSError, ValueError) as e:
+            self.error = str(e)
+            report_error(f"Не удалось загрузить правила: {e}")
+            return 0
+    
+    def refresh(self):
+        """Перечитывание изменившегося файла без перезапуска, True - правила обновлены"""
+        now = time.monotonic()
+        if now - self._checked < self.CHECK_INTERVAL:
+            return False
+        with self._lock:
+            self._checked = now
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return False  # Файла нет - остаются текущие правила
+            if mtime_ns == self.mtime_ns:
+                return False
+            try:
+                self.load()
+            except (OSError, ValueError) as e:
+                self.mtime_ns = mtime_ns  # Не повторяем ошибку до следующего изменения
+                self.error = str(e)
+                report_error(f"Не удалось перечитать правила: {e}")
+                return False
+        return True
+    
+    def __len__(self):
+        return sum(index.count for index in self.indexes.values())
+    
+    def counts(self):
+        return {target: index.count for target, index in self.indexes.items()}
+    
+    def match_file(self, path, name, size):
+        index = self.indexes['file']
+        if not index.count:
+            return []
+        return index.match({
+            'ext': os.path.splitext(name)[1].lower(),
+            'name': name.lower(),
+            'path': split_path(path),
+            'size': size
+        })
+    
+    def match_process(self, proc):
+        index = self.indexes['process']
+        if not index.count:
+            return []
+        return index.match({
+            'name': proc.name.lower(),
+            'exe': split_path(proc.exe) if proc.exe else None,
+            'cmdline': proc.cmdline.lower() if proc.cmdline else None,
+            'cpu': proc.cpu,
+            'memory': proc.memory
+        })
+    
+    def match_connection(self, conn):
+        index = self.indexes['network']
+        if not index.count:
+            return []
+        return index.match({
+            'remote_port': conn.raddr[1] if conn.raddr else None,
+            'local_port': conn.laddr[1] if conn.laddr else None,
+            'process': conn.process.lower() if conn.process else None,
+            'status': conn.status,
+            'remote_ip': IPBlocklist.parse_ip(conn.raddr[0]) if conn.raddr else None
+        })
+
+class LargeFilePolicy:
+    """Уровни обработки файлов по размеру.
+    
+    До full_limit файл проверяется целиком. Для файлов больше читается
+    заголовок: исполняемые файлы (до exec_limit) всё равно проверяются
+    целиком, образы дисков/ВМ и медиа пропускаются, остальное проверяется
+    выборочно - частичный отпечаток и поиск сигнатур по началу и концу
+    (sample_size с каждой стороны). max_bytes и max_seconds - бюджет
+    чтения содержимого на одно сканирование.
+    """
+    
+    MAGIC = (
+        (0, b'MZ', 'executable'),
+        (0, b'\x7fELF', 'executable'),
+        (0, b'\xcf\xfa\xed\xfe', 'executable'),
+        (0, b'\xce\xfa\xed\xfe', 'executable'),
+        (0, b'\xca\xfe\xba\xbe', 'executable'),
+        (0, b'#!', 'executable'),
+        (0x8001, b'CD001', 'disk image'),
+        (0, b'KDMV', 'disk image'),
+        (0, b'vhdxfile', 'disk image'),
+        (0, b'conectix', 'disk image'),
+        (0, b'QFI\xfb', 'disk image'),
+        (64, b'\x7f\x10\xda\xbe', 'disk image'),
+        (4, b'ftyp', 'media'),
+        (0, b'\x1aE\xdf\xa3', 'media'),
+        (0, b'RIFF', 'media'),
+        (0, b'ID3', 'media'),
+        (0, b'OggS', 'media'),
+    )
+    SKIP_KINDS = ('disk image', 'media')
+    HEADER_SIZE = 0x8001 + 5
+    
+    def __init__(self, full_limit=64 * 2 ** 20, exec_limit=512 * 2 ** 20, sample_size=2 ** 20,
+                 max_bytes=None, max_seconds=None):
+        self.full_limit = full_limit
+        self.exec_limit = exec_limit
+        self.sample_size = sample_size
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+    
+    def file_kind(self, path):
+        """Тип файла по магическим байтам заголовка или None"""
+        with open(path, 'rb') as f:
+            header = f.read(self.HEADER_SIZE)
+        for offset, magic, kind in self.MAGIC:
+            if header.startswith(magic, offset):
+                return kind
+        return None
+    
+    def classify(self, path, size):
+        """('full' | 'sampled' | 'skipped', тип файла)"""
+        if size <= self.full_limit:
+            return 'full', None
+        kind = self.file_kind(path)
+        if kind == 'executable' and size <= self.exec_limit:
+            return 'full', kind
+        if kind in self.SKIP_KINDS:
+            return 'skipped', kind
+        return 'sampled', kind
+    
+    def read_cost(self, mode, size):
+        """Сколько байт придётся прочитать для проверки содержимого"""
+        return size if mode == 'full' else min(size, 2 * self.sample_size)
+
+class ScanBudget:
+    """Бюджет чтения содержимого за одно сканирование (байты и время)"""
+    
+    def __init__(self, max_bytes=None, max_seconds=None):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.used_bytes = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def consume(self, nbytes):
+        """Списание nbytes, False - бюджет исчерпан и файл надо пропустить"""
+        if self.max_seconds is not None and time.monotonic() - self.started > self.max_seconds:
+            return False
+        with self._lock:
+            if self.max_bytes is not None and self.used_bytes + nbytes > self.max_bytes:
+                return False
+            self.used_bytes += nbytes
+        return True
+
+class ContentReport:
+    """Отчёт о файлах, проверенных выборочно или без чтения содержимого"""
+    
+    def __init__(self, limit=1000):
+        self.counts = Counter()
+        self.sizes = Counter()
+        self.items = deque(maxlen=limit)  # (путь, размер, действие, причина)
+        self._lock = threading.Lock()
+    
+    def add(self, path, size, action, reason):
+        with self._lock:
+            self.counts[action] += 1
+            self.sizes[action] += size
+            self.items.append((path, size, action, reason))
+    
+    def summary(self):
+        with self._lock:
+            return {
+                action: {'files': count, 'bytes': self.sizes[action]}
+                for action, count in self.counts.items()
+            }
+
+ArchiveMember = namedtuple('ArchiveMember', ['path', 'name', 'size'])
+
+class ArchiveLimitExceeded(Exception):
+    """Превышен предел проверки архива (защита от zip-бомб)"""
+
+class ArchiveInspector:
+    """Проверка содержимого архивов без распаковки на диск.
+    
+    Формат определяется по магическим байтам: zip, tar и одиночные
+    gzip/bz2/xz (внутри которых тоже может быть tar). Содержимое каждого
+    файла архива читается потоком кусками и идёт сразу в проверки сканера:
+    расширение имени, SHA-256 и поиск байтовых сигнатур (MatchStream).
+    Вложенные архивы до nested_limit байт держатся в памяти и проверяются
+    рекурсивно до глубины max_depth.
+    
+    Защита от zip-бомб: не больше max_members файлов, а распакованный
+    объём всего дерева архива ограничен размером архива на диске,
+    умноженным на max_ratio (и не больше max_bytes).
+    Угрозы внутри архива имеют путь вида архив!файл_внутри.
+    """
+    
+    MAGIC = (
+        (0, b'PK\x03\x04', 'zip'),
+        (0, b'PK\x05\x06', 'zip'),
+        (0, b'\x1f\x8b', 'gzip'),
+        (0, b'BZh', 'bz2'),
+        (0, b'\xfd7zXZ\x00', 'xz'),
+        (257, b'ustar', 'tar'),
+    )
+    HEADER_SIZE = 262
+    COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz')
+    SEPARATOR = '!'
+    
+    def __init__(self, scanner, max_depth=3, max_members=10000, max_ratio=100,
+                 max_bytes=2 ** 30, nested_limit=64 * 2 ** 20):
+        self.scanner = scanner
+        self.max_depth = max_depth
+        self.max_members = max_members
+        self.max_ratio = max_ratio
+        self.max_bytes = max_bytes
+        self.nested_limit = nested_limit
+    
+    @classmethod
+    def archive_kind(cls, header):
+        """Формат архива по первым байтам или None"""
+        for offset, magic, kind in cls.MAGIC:
+            if header.startswith(magic, offset):
+                return kind
+        return None
+    
+    def fingerprint(self):
+        """Ключ действительности сохранённых в индексе результатов"""
+        scanner = self.scanner
+        return '|'.join(map(str, (
+            scanner.patterns.fingerprint, scanner.signatures.mtime_ns, len(scanner.signatures),
+            scanner.rules.fingerprint, self.max_depth, self.max_members, self.max_ratio
+        )))
+    
+    def inspect(self, entry):
+        """(формат, угрозы) для файла на диске.
+        
+        Формат None - это не архив. Угрозы None - архив не проверялся
+        (слишком большой или исчерпан бюджет сканирования).
+        """
+        report = self.scanner.content_report
+        with open(entry.path, 'rb') as f:
+            kind = self.archive_kind(f.read(self.HEADER_SIZE))
+            if kind is None:
+                return None, []
+            if entry.size > self.scanner.large_files.full_limit:
+                report.add(entry.path, entry.size, 'skipped', 'archive size')
+                return kind, None
+            budget = self.scanner.budget
+            if budget is not None and not budget.consume(entry.size):
+                report.add(entry.path, entry.size, 'skipped', 'budget')
+                return kind, None
+            
+            f.seek(0)
+            threats = []
+            limits = {'members': self.max_members, 'bytes': min(self.max_bytes, max(entry.size, 1) * self.max_ratio)}
+            with METRICS.timer('scan.archive'):
+                try:
+                    self._walk(f, kind, entry.path, 1, threats, limits)
+                except ArchiveLimitExceeded as e:
+                    report.add(entry.path, entry.size, 'skipped', f'archive {e}')
+                except self._errors() as e:
+                    report.add(entry.path, entry.size, 'skipped', f'archive damaged: {e}')
+        return kind, threats
+    
+    @staticmethod
+    def _errors():
+        """Ошибки чтения повреждённых или неподдерживаемых архивов"""
+        import zipfile, tarfile, lzma, zlib
+        return (
+            zipfile.BadZipFile, tarfile.TarError, lzma.LZMAError, zlib.error,
+            EOFError, OSError, ValueError, RuntimeError, NotImplementedError
+        )
+    
+    def _walk(self, fileobj, kind, path, depth, threats, limits):
+        """Проверка всех файлов архива (fileobj должен поддерживать seek)"""
+        for name, stream, size in self._members(fileobj, kind, path, limits):
+            with stream:
+                self._check_member(path + self.SEPARATOR + name, name, stream, size, depth, threats, limits)
+    
+    def _count(self, limits):
+        limits['members'] -= 1
+        if limits['members'] < 0:
+            raise ArchiveLimitExceeded('members')
+    
+    def _members(self, fileobj, kind, path, limits):
+        """Генератор (имя, поток, размер) файлов архива"""
+        if kind == 'zip':
+            import zipfile
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    self._count(limits)
+                    if info.flag_bits & 0x1:
+                        self.scanner.content_report.add(
+                            path + self.SEPARATOR + info.filename, info.file_size, 'skipped', 'encrypted'
+                        )
+                        continue
+                    # Заявленный размер проверяем до распаковки, фактический - при чтении
+                    if info.file_size > max(info.compress_size, 1) * self.max_ratio:
+                        raise ArchiveLimitExceeded('ratio')
+                    yield info.filename, archive.open(info), info.file_size
+        elif kind == 'tar':
+            yield from self._tar_members(fileobj, limits)
+        else:
+            # gzip/bz2/xz: внутри или tar, или один сжатый файл
+            header = self._decompress(fileobj, kind).read(self.HEADER_SIZE)
+            fileobj.seek(0)
+            stream = self._decompress(fileobj, kind)
+            if self.archive_kind(header) == 'tar':
+                with stream:
+                    yield from self._tar_members(stream, limits)
+                return
+            self._count(limits)
+            name = os.path.basename(path.rsplit(self.SEPARATOR, 1)[-1])
+            stem, ext = os.path.splitext(name)
+            yield (stem if ext.lower() in self.COMPRESSED_SUFFIXES else name), stream, None
+    
+    def _tar_members(self, fileobj, limits):
+        import tarfile
+        # Потоковый режим: tar читается один раз подряд, без seek
+        with tarfile.open(fileobj=fileobj, mode='r|') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                self._count(limits)
+                yield member.name, archive.extractfile(member), member.size
+    
+    @staticmethod
+    def _decompress(fileobj, kind):
+        if kind == 'gzip':
+            import gzip
+            return gzip.GzipFile(fileobj=fileobj, mode='rb')
+        if kind == 'bz2':
+            import bz2
+            return bz2.BZ2File(fileobj, mode='rb')
+        import lzma
+        return lzma.LZMAFile(fileobj, mode='rb')
+    
+    def _check_member(self, path, name, stream, size, depth, threats, limits):
+        """Потоковая проверка одного файла архива и рекурсия во вложенный архив"""
+        import hashlib
+        scanner = self.scanner
+        hasher = hashlib.sha256() if scanner.signatures else None
+        matcher = scanner.patterns.matcher
+        search = matcher.stream() if matcher is not None else None
+        nested = None
+        nested_kind = None
+        total = 0
+        
+        while True:
+            chunk = stream.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            limits['bytes'] -= len(chunk)
+            if limits['bytes'] < 0:
+                raise ArchiveLimitExceeded('ratio')
+            if not total:
+                nested_kind = self.archive_kind(chunk[:self.HEADER_SIZE])
+                if nested_kind is not None:
+                    if depth < self.max_depth:
+                        nested = bytearray()
+                    else:
+                        scanner.content_report.add(path, size or 0, 'skipped', 'archive depth')
+            total += len(chunk)
+            if nested is not None:
+                if len(nested) + len(chunk) > self.nested_limit:
+                    scanner.content_report.add(path, size or 0, 'skipped', 'nested archive size')
+                    nested = None
+                else:
+                    nested += chunk
+            if hasher is not None:
+                hasher.update(chunk)
+            if search is not None:
+                search.feed(chunk)
+        
+        METRICS.count('scan.archive_members')
+        METRICS.count('scan.archive_bytes', total)
+        entry = ArchiveMember(path, os.path.basename(name), total)
+        threats.extend(scanner.inspect(
+            entry,
+            hasher.digest() if hasher is not None else None,
+            search.results() if search is not None else None
+        ))
+        if nested is not None:
+            import io
+            self._walk(io.BytesIO(nested), nested_kind, path, depth + 1, threats, limits)
+
 class BasicFileScanner:
     """Базовый сканер файлов"""
     
-    def __init__(self):
-        self.suspicious_extensions = ['.exe', '.bat', '.vbs', '.ps1', '.js']
-        self.scan_results = []
+    def __init__(self, index_path=None, use_index=True, signatures_path=None, patterns_path=None, rules=None):
+        self.scan_results = ScanResultStore()
         self.unique_files_scanned = set()  # Для отслеживания уникальных файлов
+        self.files_unchanged = 0  # Пропущено по индексу (не менялись с прошлого запуска)
+        self.files_hashed = 0
+        self.bytes_hashed = 0
+        self.bytes_matched = 0
+        self.match_seconds = 0.0
+        self.walker = FileWalker()
+        self.large_files = LargeFilePolicy()
+        self.archives = ArchiveInspector(self)  # None - архивы проверяются только как файлы
+        self.budget = None  # Действует только во время сканирования (begin_scan)
+        self.content_report = ContentReport()
+        self._lock = threading.Lock()  # Проверки идут из нескольких потоков
+        
+        # Индекс и базы сигнатур открываются при первом сканировании (prepare)
+        self.index = None
+        self.index_path = index_path
+        self.use_index = use_index
+        self._prepared = False
+        self.signatures = SignatureDatabase(signatures_path)
+        self.patterns = PatternDatabase(patterns_path)
+        self.rules = rules if rules is not None else RuleSet()  # Правила для имён, путей и размеров
+    
+    def prepare(self):
+        """Открытие индекса и загрузка баз сигнатур (один раз, по требованию)"""
+        if self._prepared:
+            return
+        with self._lock:
+            if self._prepared:
+                return
+            if self.use_index:
+                import sqlite3
+                try:
+                    self.index = ScanIndex(self.index_path)
+                except (OSError, sqlite3.Error) as e:
+                    report_error(f"Индекс сканирования недоступен: {e}")
+            self.signatures.load_if_exists()
+            self.patterns.load_if_exists()
+            self.rules.load_if_exists()
+            self._prepared = True
+    
+    def begin_scan(self):
+        """Новый бюджет чтения и отчёт о больших файлах на время сканирования"""
+        policy = self.large_files
+        self.budget = ScanBudget(policy.max_bytes, policy.max_seconds)
+        self.content_report = ContentReport()
+        self.rules.refresh()
+    
+    def end_scan(self):
+        """Снятие бюджета: одиночные проверки (наблюдатель) им не ограничены"""
+        self.budget = None
+    
+    def inspect(self, entry, digest=None, pattern_hits=None, partial=None):
+        """Проверки имени, хэша и содержимого файла, возвращает список угроз"""
+        threats = [
+            ThreatRecord(entry.path, 'RULE', rule.label, severity=rule.severity)
+            for rule in self.rules.match_file(entry.path, entry.name, entry.size)
+        ]
+        
+        if digest is not None:
+            name = self.signatures.match(digest)
+            if name:
+                threats.append(ThreatRecord(entry.path, 'HASH', name))
+        
+        if partial is not None:
+            name = self.signatures.match_partial(partial)
+            if name:
+                threats.append(ThreatRecord(entry.path, 'PARTIAL', name))
+        
+        for rule_id, offset in pattern_hits or ():
+            threats.append(ThreatRecord(entry.path, 'PATTERN', rule_id, offset))
+        return threats
+    
+    def _match(self, entry, ranges=None):
+        """Поиск байтовых сигнатур в файле (или его участках), None при ошибке чтения"""
+        started = time.perf_counter()
+        try:
+            if ranges is None:
+                hits = self.patterns.match_file(entry.path)
+            else:
+                hits = self.patterns.match_ranges(entry.path, ranges)
+        except (OSError, ValueError):
+            return None
+        elapsed = time.perf_counter() - started
+        nbytes = entry.size if ranges is None else sum(length for _, length in ranges)
+        METRICS.add_time('scan.match', elapsed)
+        METRICS.count('scan.bytes_matched', nbytes)
+        with self._lock:
+            self.bytes_matched += nbytes
+            self.match_seconds += elapsed
+        return hits
+    
+    @property
+    def match_throughput(self):
+        """Скорость поиска байтовых сигнатур, МБ/с"""
+        if not self.match_seconds:
+            return 0.0
+        return self.bytes_matched / self.match_seconds / (1024 * 1024)
+    
+    def _hash(self, entry):
+        """SHA-256 файла с учётом статистики, None при ошибке чтения"""
+        try:
+            with METRICS.timer('scan.hash'):
+                digest = sha256_file(entry.path)
+        except OSError:
+            return None
+        METRICS.count('scan.bytes_hashed', entry.size)
+        with self._lock:
+            self.files_hashed += 1
+            self.bytes_hashed += entry.size
+        return digest
+    
+    def _content_mode(self, entry):
+        """Как читать содержимое файла: 'full', 'sampled' или 'skipped'"""
+        policy = self.large_files
+        mode, kind = policy.classify(entry.path, entry.size)
+        reason = kind or 'size'
+        if mode != 'skipped' and self.budget is not None \
+                and not self.budget.consume(policy.read_cost(mode, entry.size)):
+            mode, reason = 'skipped', 'budget'
+        if mode != 'full':
+            self.content_report.add(entry.path, entry.size, mode, reason)
+            METRICS.count(f'scan.files_{mode}')
+        return mode
+    
+    def _claim(self, entry):
+        """Отметка файла как проверенного в этой сессии, False - уже проверялся"""
+        file_id = f"{entry.path}_{entry.size}_{entry.mtime_ns}"
+        with self._lock:
+            if file_id in self.unique_files_scanned:
+                return False
+            self.unique_files_scanned.add(file_id)
+            return True
+    
+    def _check(self, directory, entry, known):
+        """Проверка файла с учётом сессии и постоянного индекса"""
+        # Проверяем, сканировали ли уже этот файл
+        if not self._claim(entry):
+            return []
+        
+        # Файл не менялся с прошлого сканирования - хэш берём из индекса
+        unchanged = known is not None and known[:3] == (entry.size, entry.mtime_ns, entry.inode)
+        digest = known[3] if unchanged else None
+        if unchanged:
+            with self._lock:
+                self.files_unchanged += 1
+        
+        # Хэшируем только когда есть с чем сравнивать.
+        # Результаты поиска сигнатур действительны, пока не поменялись правила
+        need_hash = digest is None and bool(self.signatures)
+        reuse_hits = unchanged and self.patterns.matcher is not None and known[5] == self.patterns.fingerprint
+        need_match = self.patterns.matcher is not None and not reuse_hits
+        mode = self._content_mode(entry) if need_hash or need_match else 'full'
+        
+        # Большие файлы без известного формата читаются только с краёв:
+        # частичный отпечаток в индекс не пишется, хэш останется пустым
+        hashed = False
+        partial = None
+        if need_hash and mode == 'full':
+            digest = self._hash(entry)
+            hashed = digest is not None
+        elif need_hash and mode == 'sampled' and self.signatures.partials:
+            try:
+                partial = partial_fingerprint(entry.path, entry.size, self.large_files.sample_size)
+            except OSError:
+                pass
+        
+        hits = None
+        matched = False
+        if reuse_hits:
+            hits = json.loads(known[4]) if known[4] else []
+        elif need_match and mode != 'skipped':
+            ranges = None if mode == 'full' else sample_ranges(entry.size, self.large_files.sample_size)
+            hits = self._match(entry, ranges)
+            matched = hits is not None
+        
+        # Угрозы внутри архива (см. _check_archive)
+        cached = known[6] if unchanged else None
+        archive_threats, archive = self._check_archive(entry, cached)
+        
+        if self.index is not None and (not unchanged or hashed or matched or archive != cached):
+            self.index.record(
+                directory, entry, digest,
+                json.dumps(hits) if hits else None,
+                self.patterns.fingerprint if hits is not None else None,
+                archive
+            )
+        return self.inspect(entry, digest, hits, partial) + archive_threats
+    
+    def _check_archive(self, entry, cached):
+        """Угрозы внутри архива и значение для индекса.
+        
+        В индексе '' - не архив, JSON - угрозы с ключом правил, None - не
+        проверялся. Возвращает (угрозы, значение для индекса).
+        """
+        if self.archives is None or cached == '':
+            return [], cached
+        key = self.archives.fingerprint()
+        if cached:
+            saved = json.loads(cached)
+            if saved['rules'] == key:
+                return [ThreatRecord(*item) for item in saved['threats']], cached
+        try:
+            kind, threats = self.archives.inspect(entry)
+        except OSError:
+            return [], None
+        if kind is None:
+            return [], ''
+        if threats is None:
+            return [], None
+        return threats, json.dumps({
+            'rules': key,
+            'threats': [[t.file, t.type, t.detail, t.offset, t.severity] for t in threats]
+        })
+    
+    def check_file(self, filepath):
+        """Проверка одного файла, возвращает список угроз"""
+        self.prepare()
+        entry = FileWalker.entry_for(filepath)
+        directory = os.path.dirname(filepath)
+        known = self.index.lookup(directory, entry.name) if self.index is not None else None
+        return self._check(directory, entry, known)
+    
+    def check_directory(self, directory, entries, cancel_event=None, complete=False):
+        """Проверка файлов одного каталога (выполняется в рабочем потоке).
+        
+        entries - записи FileEntry от FileWalker. complete=True означает,
+        что это полный список файлов каталога, и записи индекса об
+        исчезнувших файлах можно удалить. Вместо True можно передать
+        множество всех имён каталога, если часть файлов проверяется
+        отдельно (большие файлы откладываются на конец сканирования).
+        """
+        self.prepare()
+        with METRICS.profile('scan'):
+            with METRICS.timer('index.lookup_dir'):
+                known = self._lookup_batch(directory, entries, complete)
+            threats = []
+            for entry in entries:
+                if cancel_event is not None and cancel_event.is_set():
+                    return threats
+                try:
+                    threats.extend(self._check(directory, entry, known.get(entry.name)))
+                except OSError:
+                    continue
+        METRICS.count('scan.files', len(entries))
+        self._forget_missing(directory, known, entries, complete)
+        return threats
+    
+    def _lookup_batch(self, directory, entries, complete):
+        """Записи индекса для пачки: весь каталог, если он пришёл одной
+        пачкой, иначе только файлы пачки - чтобы каталог из тысяч файлов
+        не перечитывался из индекса на каждой своей части"""
+        if self.index is None:
+            return {}
+        if complete is True:
+            return self.index.lookup_dir(directory)
+        return self.index.lookup_names(directory, [entry.name for entry in entries])
+    
+    def _forget_missing(self, directory, known, entries, complete):
+        """Удаление из индекса файлов каталога, которых больше нет"""
+        if not complete or self.index is None:
+            return
+        if isinstance(complete, (set, frozenset)):
+            stored = self.index.names(directory)
+            names = complete
+        else:
+            stored = known
+            names = {entry.name for entry in entries}
+        removed = set(stored).difference(names)
+        if removed:
+            self.index.forget(directory, removed)
+    
+    def shard_batch(self, directory, entries, complete=False):
+        """Подготовка пачки для процесса пула (в основном процессе).
+        
+        Возвращает (записи, {имя: запись индекса}) только для файлов, ещё не
+        проверенных в этой сессии; в процесс уходят пути и метаданные, а не
+        содержимое. Записи индекса об исчезнувших файлах удаляются здесь же.
+        """
+        self.prepare()
+        known = self._lookup_batch(directory, entries, complete)
+        fresh = [entry for entry in entries if self._claim(entry)]
+        self._forget_missing(directory, known, entries, complete)
+        return fresh, {entry.name: known[entry.name] for entry in fresh if entry.name in known}
+    
+    def shard_settings(self):
+        """Настройки для сканера в процессе пула (при spawn он создаётся заново)"""
+        archives = None
+        if self.archives is not None:
+            archives = {name: value for name, value in vars(self.archives).items() if name != 'scanner'}
+        return {
+            'signatures': self.signatures.path,
+            'patterns': self.patterns.path,
+            'rules': self.rules.path,
+            'large_files': self.large_files,
+            'archives': archives,
+            'metrics': METRICS.enabled
+        }
+    
+    def take_shard_state(self):
+        """Накопленное процессом пула с прошлой пачки (со сбросом)"""
+        with self._lock:
+            state = {
+                'records': self.index.take(),
+                'report': list(self.content_report.items),
+                'counters': (self.files_unchanged, self.files_hashed, self.bytes_hashed,
+                             self.bytes_matched, self.match_seconds),
+                'metrics': METRICS.take()
+            }
+            self.content_report = ContentReport()
+            self.unique_files_scanned.clear()
+            self.files_unchanged = self.files_hashed = self.bytes_hashed = self.bytes_matched = 0
+            self.match_seconds = 0.0
+        return state
+    
+    def merge_shard(self, state):
+        """Учёт состояния процесса пула: записи индекса, отчёт, счётчики, метрики"""
+        if self.index is not None:
+            for record in state['records']:
+                self.index.record(*record)
+        for item in state['report']:
+            self.content_report.add(*item)
+        unchanged, hashed, bytes_hashed, bytes_matched, match_seconds = state['counters']
+        with self._lock:
+            self.files_unchanged += unchanged
+            self.files_hashed += hashed
+            self.bytes_hashed += bytes_hashed
+            self.bytes_matched += bytes_matched
+            self.match_seconds += match_seconds
+        METRICS.merge(*state['metrics'])
+    
+    def check_paths(self, paths):
+        """Проверка отдельных файлов (события наблюдателя), возвращает новые угрозы"""
+        self.rules.refresh()
+        threats = []
+        for path in paths:
+            try:
+                threats.extend(self.check_file(path))
+            except OSError:
+                continue  # Файл успели удалить или он недоступен
+        self.flush_index()
+        return self.add_results(threats)
+    
+    def add_results(self, threats):
+        """Добавление только новых угроз в общую базу, возвращает новые"""
+        with self._lock:
+            return [threat for threat in threats if self.scan_results.add(threat)]
+    
+    def flush_index(self):
+        """Сохранение отложенных записей индекса на диск"""
+        import sqlite3
+        if self.index is not None:
+            try:
+                with METRICS.timer('index.flush'):
+                    self.index.flush()
+            except sqlite3.Error as e:
+                report_error(f"Ошибка записи индекса: {e}")
+    
+    def clear(self):
+        """Сброс результатов и индекса"""
+        self.prepare()
+        with self._lock:
+            self.scan_results.clear()
+            self.unique_files_scanned.clear()
+            self.files_unchanged = 0
+        if self.index is not None:
+            self.index.clear()
     
     def quick_scan(self, path=None):
         """Быстрое сканирование"""
         if not path:
-            path = os.path.expanduser('~\\Downloads')
+            path = DOWNLOADS_DIR
         
+        self.prepare()
+        self.begin_scan()
         threats = []
         try:
-            if os.path.exists(path):
-                for root, dirs, files in os.walk(path):
-                    for file in files:
-                        filepath = os.path.join(root, file)
-                        file_id = f"{filepath}_{os.path.getsize(filepath) if os.path.exists(filepath) else 0}"
-                        
-                        # Проверяем, сканировали ли уже этот файл
-                        if file_id in self.unique_files_scanned:
-                            continue
-                        
-                        self.unique_files_scanned.add(file_id)
-                        ext = os.path.splitext(file)[1].lower()
-                        
-                        if ext in self.suspicious_extensions:
-                            threats.append({
-                                'file': filepath,
-                                'type': 'FILE',
-                                'reason': f'Подозрительное расширение {ext}',
-                                'timestamp': datetime.now()
-                            })
+            for directory, entries in self.walker.iter_dirs(path):
+                threats.extend(self.check_directory(directory, entries, complete=True))
         
         except Exception as e:
-            print(f"Ошибка сканирования: {e}")
-        
-        # Добавляем только новые угрозы
-        for threat in threats:
-            if not any(t['file'] == threat['file'] for t in self.scan_results):
-                self.scan_results.append(threat)
+            report_error(f"Ошибка сканирования {path}: {e}")
         
+        self.end_scan()
+        self.flush_index()
+        self.add_results(threats)
         return threats
 
-class BasicProcessMonitor:
-    """Базовый монитор процессов"""
+class ShardRecorder:
+    """Индекс процесса пула: строки индекса приходят с пачкой, а записи
+    копятся и возвращаются в основной процесс, где и пишутся в SQLite"""
     
     def __init__(self):
-        pass
+        self.known = {}
+        self.records = []
+    
+    def lookup_dir(self, directory):
+        return self.known
+    
+    def lookup_names(self, directory, names):
+        return self.known
+    
+    def record(self, directory, entry, *values):
+        self.records.append((directory, entry) + values)
+    
+    def take(self):
+        records, self.records = self.records, []
+        return records
+
+_shard_scanner = None
+
+def _shard_init(settings, processes, signatures=None, patterns=None, rules=None):
+    """Инициализация процесса пула сканирования"""
+    global _shard_scanner
+    # После fork блокировка метрик могла остаться захваченной другим потоком
+    METRICS._lock = threading.Lock()
+    METRICS.take()
+    METRICS.enabled = settings['metrics']
+    METRICS.profiled = set()
+    
+    scanner = BasicFileScanner(
+        use_index=False,
+        signatures_path=settings['signatures'],
+        patterns_path=settings['patterns'],
+        rules=rules if rules is not None else RuleSet(settings['rules'])
+    )
+    scanner.large_files = settings['large_files']
+    archives = settings['archives']
+    scanner.archives = ArchiveInspector(scanner, **archives) if archives is not None else None
+    if signatures is not None:
+        # fork: базы, правила и автомат Ахо-Корасик уже в памяти и общие с основным
+        # процессом (копирование при записи), заново ничего не загружается
+        scanner.signatures = signatures
+        scanner.patterns = patterns
+        scanner._prepared = True
+    else:
+        scanner.prepare()
+    scanner.index = ShardRecorder()
+    # Бюджет чтения делится между процессами поровну
+    policy = scanner.large_files
+    scanner.budget = ScanBudget(policy.max_bytes // processes if policy.max_bytes else None, policy.max_seconds)
+    _shard_scanner = scanner
+
+def _shard_check(directory, entries, known):
+    """Проверка пачки в процессе пула: (угрозы, состояние для merge_shard)"""
+    scanner = _shard_scanner
+    scanner.index.known = known
+    threats = scanner.check_directory(directory, entries)
+    return threats, scanner.take_shard_state()
+
+class ScanJob:
+    """Фоновое сканирование: обход каталогов и проверки в пуле потоков.
+    
+    Корни группируются по устройству (st_dev): у каждого устройства свой
+    поток обхода и свой пул из workers потоков проверки, а устройства
+    сканируются одновременно, поэтому полное сканирование нескольких дисков
+    длится примерно как сканирование самого большого. Вложенные корни
+    отбрасываются, чтобы файлы не проверялись дважды.
+    
+    Внутри устройства сначала проверяются мелкие файлы (по возрастанию
+    размера), а файлы больше LargeFilePolicy.full_limit откладываются до
+    конца обхода, чтобы быстрые результаты не ждали многогигабайтных файлов.
+    
+    С processes > 0 проверки идут в пуле процессов (хэширование и поиск
+    сигнатур не упираются в GIL): процессам отправляются только записи
+    файлов, базы сигнатур при fork наследуются без копирования, а
+    результаты принимаются в порядке отправки пачек, так что порядок угроз
+    не зависит от числа процессов.
+    
+    Результаты всех устройств сводятся в одну очередь сообщений, которую
+    интерфейс опрашивает через root.after, поэтому окно не замирает.
+    Сообщения: ('progress', файлов, [угрозы]), ('done', отменено), ('error', текст).
+    """
+    
+    BATCH_SIZE = 256
+    LARGE_BATCH_SIZE = 4
+    
+    def __init__(self, scanner, paths, workers=None, processes=0):
+        self.scanner = scanner
+        self.paths = list(paths)
+        self.workers = workers or min(8, (os.cpu_count() or 1) + 4)  # Потоков проверки на устройство
+        self.processes = processes  # Процессов проверки на всё сканирование, 0 - потоки
+        self._pool = None
+        self.start_method = None  # Способ запуска процессов пула (см. _start_pool)
+        self.queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.files_done = 0
+        self.threats = []
+        self.devices = {}  # st_dev -> [корни]
+        self._lock = threading.Lock()
+        self._errors = []
+        self._thread = None
+        self._unchanged_at_start = scanner.files_unchanged
+    
+    @property
+    def files_unchanged(self):
+        """Сколько файлов этого сканирования пропущено по индексу"""
+        return self.scanner.files_unchanged - self._unchanged_at_start
+    
+    def start(self):
+        """Запуск сканирования в фоновом потоке"""
+        if self.processes:
+            # Пул создаётся в вызывающем потоке, до потоков сканирования
+            try:
+                self._pool = self._start_pool()
+            except Exception as e:
+                self.queue.put(('error', f"Пул процессов не запущен: {e}"))
+                return
+        self._thread = threading.Thread(target=self._run, name='scan-job', daemon=True)
+        self._thread.start()
+    
+    def cancel(self):
+        """Запрос отмены (обработка остановится после текущих пачек)"""
+        self.cancel_event.set()
+    
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def wait(self, timeout=None):
+        """Ожидание конца сканирования, True если оно закончилось.
+        
+        Если поток не запускался (например, не поднялся пул процессов),
+        ждать нечего.
+        """
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return not self.is_running()
+    
+    @staticmethod
+    def group_roots(paths):
+        """Корни по устройствам: {st_dev: [корни]}, без несуществующих и вложенных"""
+        roots = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            roots.append((path, os.path.realpath(path), st.st_dev))
+        
+        # Короткие пути первыми, чтобы вложенный корень находил своего предка
+        roots.sort(key=lambda root: len(root[1]))
+        kept = []
+        for path, real, dev in roots:
+            if any(real == parent or real.startswith(parent.rstrip(os.sep) + os.sep) for _, parent, _ in kept):
+                continue
+            kept.append((path, real, dev))
+        
+        devices = {}
+        for path, _, dev in kept:
+            devices.setdefault(dev, []).append(path)
+        return devices
+    
+    def _iter_batches(self, paths):
+        """Обход каталогов: пачка - файлы одного каталога (большие режутся).
+        
+        Файлы больше full_limit выдаются небольшими пачками после обхода.
+        Пачка - (каталог, записи, complete), см. check_directory.
+        """
+        walker = self.scanner.walker
+        limit = self.scanner.large_files.full_limit
+        deferred = []
+        for path in paths:
+            for directory, entries in walker.iter_dirs(path, self.cancel_event):
+                small = sorted((entry for entry in entries if entry.size <= limit), key=lambda entry: entry.size)
+                complete = True
+                if len(small) < len(entries):
+                    deferred.append((directory, [entry for entry in entries if entry.size > limit]))
+                if len(small) < len(entries) or len(small) > self.BATCH_SIZE:
+                    complete = {entry.name for entry in entries}
+                # Все имена каталога уходят с последней частью: по ним из
+                # индекса удаляются исчезнувшие файлы (и в пустом каталоге тоже)
+                last = max(0, (len(small) - 1) // self.BATCH_SIZE * self.BATCH_SIZE)
+                for i in range(0, last, self.BATCH_SIZE):
+                    yield directory, small[i:i + self.BATCH_SIZE], False
+                yield directory, small[last:], complete
+        
+        for directory, large in deferred:
+            for i in range(0, len(large), self.LARGE_BATCH_SIZE):
+                if self.cancel_event.is_set():
+                    return
+                yield directory, large[i:i + self.LARGE_BATCH_SIZE], False
+    
+    def _collect(self, futures, sizes):
+        """Сбор готовых пачек и отправка прогресса в общую очередь"""
+        for future in futures:
+            count = sizes.pop(future)
+            if future.cancelled():
+                continue
+            self._deliver(future.result(), count)
+    
+    def _deliver(self, threats, count):
+        self.scanner.add_results(threats)
+        with self._lock:
+            self.threats.extend(threats)
+            self.files_done += count
+            self.queue.put(('progress', self.files_done, threats))
+    
+    def _run(self):
+        with METRICS.timer('scan.job'):
+            self._scan()
+    
+    def _scan(self):
+        try:
+            self.scanner.prepare()
+            self.scanner.begin_scan()
+            self.devices = self.group_roots(self.paths)
+            threads = [
+                threading.Thread(target=self._scan_device, args=(roots,), name=f'scan-dev-{dev}', daemon=True)
+                for dev, roots in self.devices.items()
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.scanner.end_scan()
+            self.scanner.flush_index()
+        except Exception as e:
+            self._errors.append(str(e))
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+        if self._errors:
+            self.queue.put(('error', '; '.join(self._errors)))
+        else:
+            self.queue.put(('done', self.cancel_event.is_set()))
+    
+    def _start_pool(self):
+        """Пул процессов проверки (процессы стартуют сразу, до потоков обхода).
+        
+        fork копирует и блокировки, захваченные другими потоками (logging,
+        sqlite, METRICS), поэтому он используется, только если других
+        потоков нет (консольный scan). В окне уже работают замеры, журнал и
+        DNS - там процессы запускает forkserver (или spawn) и базы
+        загружаются в них заново.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        methods = multiprocessing.get_all_start_methods()
+        if 'fork' in methods and threading.active_count() == 1:
+            self.start_method = 'fork'
+        else:
+            self.start_method = 'forkserver' if 'forkserver' in methods else 'spawn'
+        scanner = self.scanner
+        initargs = (scanner.shard_settings(), self.processes)
+        if self.start_method == 'fork':
+            scanner.prepare()
+            initargs += (scanner.signatures, scanner.patterns, scanner.rules)
+        pool = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=_shard_init,
+            initargs=initargs
+        )
+        # При fork все процессы создаются на первой задаче, ещё в этом потоке
+        pool.submit(os.getpid).result()
+        return pool
+    
+    def _scan_device(self, roots):
+        """Обход корней одного устройства и проверки в его собственном пуле"""
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        if self._pool is not None:
+            return self._scan_device_sharded(roots)
+        try:
+            with METRICS.profile('scan_job'), \
+                    ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scan') as pool:
+                sizes = {}
+                for directory, entries, complete in self._iter_batches(roots):
+                    future = pool.submit(self.scanner.check_directory, directory, entries, self.cancel_event, complete)
+                    sizes[future] = len(entries)
+                    # Не даём обходу убегать далеко вперёд проверок
+                    if len(sizes) >= self.workers * 2:
+                        done, _ = wait(list(sizes), return_when=FIRST_COMPLETED)
+                        self._collect(done, sizes)
+                if self.cancel_event.is_set():
+                    for future in sizes:
+                        future.cancel()
+                done, _ = wait(list(sizes))
+                self._collect(done, sizes)
+        except Exception as e:
+            with self._lock:
+                self._errors.append(f"{', '.join(roots)}: {e}")
+    
+    def _scan_device_sharded(self, roots):
+        """Обход корней устройства с проверками в общем пуле процессов"""
+        pending = deque()  # (future или None, файлов) в порядке отправки
+        try:
+            for directory, entries, complete in self._iter_batches(roots):
+                fresh, known = self.scanner.shard_batch(directory, entries, complete)
+                future = self._pool.submit(_shard_check, directory, fresh, known) if fresh else None
+                pending.append((future, len(entries)))
+                # Не даём обходу убегать далеко вперёд проверок
+                while len(pending) >= self.processes * 2:
+                    self._take_shard(*pending.popleft())
+            if self.cancel_event.is_set():
+                for future, _ in pending:
+                    if future is not None:
+                        future.cancel()
+            while pending:
+                self._take_shard(*pending.popleft())
+        except Exception as e:
+            with self._lock:
+                self._errors.append(f"{', '.join(roots)}: {e}")
+    
+    def _take_shard(self, future, count):
+        """Ожидание пачки из пула процессов и учёт её результатов"""
+        if future is None:
+            self._deliver([], count)
+            return
+        if future.cancelled():
+            return
+        threats, state = future.result()
+        self.scanner.merge_shard(state)
+        self._deliver(threats, count)
+
+class ExeHashCache:
+    """LRU-кэш SHA-256 исполняемых файлов.
+    
+    Ключ - (путь, inode, mtime_ns): сотни рабочих процессов одного
+    бинарника хэшируются один раз, а подменённый файл получает новый ключ.
+    """
+    
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def digest(self, path):
+        """SHA-256 файла (bytes) или None, если файл недоступен"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (path, st.st_ino, st.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+                self.hits += 1
+                return digest
+        
+        try:
+            digest = sha256_file(path)
+        except OSError:
+            return None
+        with self._lock:
+            self.misses += 1
+            self._digests[key] = digest
+            if len(self._digests) > self.maxsize:
+                self._digests.popitem(last=False)
+        return digest
+    
+    def __len__(self):
+        return len(self._digests)
+
+class BasicProcessMonitor:
+    """Базовый монитор процессов.
+    
+    Объекты psutil.Process живут между замерами, поэтому cpu_percent()
+    считается как разница с прошлым замером того же процесса (а не 0.0
+    при разовом обходе), имя читается один раз, а каждый замер стоит
+    одного чтения статистики на процесс внутри oneshot().
+    
+    Путь к исполняемому файлу, командная строка и его SHA-256 (через
+    ExeHashCache) тоже читаются один раз при первой встрече процесса.
+    Хэш считается уже после снятия блокировки: чтение больших exe не
+    задерживает names(), который вызывает поток замера соединений.
+    Сверка хэша с базой сигнатур - на каждом замере, чтобы новые
+    сигнатуры сразу помечали уже запущенные процессы. Так же на каждом
+    замере применяются правила RuleSet (CPU и память меняются).
+    """
+    
+    def __init__(self, signatures=None, hash_executables=True, exe_cache=None, rules=None):
+        # pid -> [psutil.Process, имя, прошлый RSS, exe, cmdline, SHA-256 exe, хэш посчитан]
+        self._handles = {}
+        self._lock = threading.Lock()  # Замеры идут и из UI, и из планировщика
+        self.signatures = signatures
+        self.rules = rules
+        self.hash_executables = hash_executables
+        self.exe_cache = exe_cache if exe_cache is not None else ExeHashCache()
+    
+    def _describe(self, proc):
+        """Статические сведения о новом процессе: имя, exe, cmdline.
+        
+        Хэш exe здесь не считается (вызов идёт под блокировкой): ручка
+        помечается непосчитанной, и _sample хэширует её после замера.
+        """
+        import psutil
+        name = proc.name()
+        try:
+            exe = proc.exe()
+        except (psutil.AccessDenied, OSError):
+            exe = ''
+        try:
+            cmdline = ' '.join(proc.cmdline())
+        except (psutil.AccessDenied, OSError):
+            cmdline = ''
+        hashed = not (exe and self.hash_executables)
+        return [proc, name, 0, exe, cmdline, None, hashed]
+    
+    def names(self):
+        """pid -> имя по последнему замеру (для присоединения к соединениям)"""
+        with self._lock:
+            return {pid: handle[1] or '' for pid, handle in self._handles.items()}
+    
+    @staticmethod
+    def build_tree(processes):
+        """Дерево процессов: ppid -> список дочерних PID"""
+        children = {}
+        for proc in processes:
+            if proc.ppid is not None and proc.ppid != proc.pid:
+                children.setdefault(proc.ppid, []).append(proc.pid)
+        return children
+    
+    @staticmethod
+    def descendants(children, pid):
+        """Все потомки процесса по дереву из build_tree"""
+        result = []
+        stack = list(children.get(pid, ()))
+        while stack:
+            child = stack.pop()
+            result.append(child)
+            stack.extend(children.get(child, ()))
+        return result
     
     def get_processes(self):
         """Получение списка процессов"""
+        with METRICS.profile('processes'), METRICS.timer('psutil.processes'):
+            processes = self._sample()
+        METRICS.count('psutil.process_rows', len(processes))
+        return processes
+    
+    def _sample(self):
+        import psutil
         processes = []
-        try:
-            for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
+        pending = []  # (запись, ручка) процессов, чей exe ещё не хэширован
+        signatures = self.signatures
+        if signatures is not None:
+            signatures.load_if_exists()
+        with self._lock:
+            try:
+                pids = psutil.pids()
+            except Exception:
+                return processes
+            
+            # Процессы, которых больше нет, забываем
+            alive = set(pids)
+            for pid in [pid for pid in self._handles if pid not in alive]:
+                del self._handles[pid]
+            
+            for pid in pids:
+                handle = self._handles.get(pid)
                 try:
-                    info = proc.info
-                    processes.append({
-                        'pid': info['pid'],
-                        'name': info['name'],
-                        'cpu': info['cpu_percent'],
-                        'memory': info['memory_percent']
-                    })
-                except:
+                    if handle is None:
+                        handle = self._describe(psutil.Process(pid))
+                        self._handles[pid] = handle
+                    proc, name, last_rss, exe, cmdline, digest, hashed = handle
+                    with proc.oneshot():
+                        cpu = proc.cpu_percent(None)
+                        rss = proc.memory_info().rss
+                        memory = proc.memory_percent()
+                        ppid = proc.ppid()
+                    handle[2] = rss
+                    threat = signatures.match(digest) if digest is not None and signatures else None
+                    record = ProcessRecord(
+                        pid, name or '', cpu, memory, rss, rss - last_rss if last_rss else 0,
+                        ppid, exe, cmdline, digest, threat
+                    )
+                    processes.append(record)
+                    if not hashed:
+                        pending.append((record, handle))
+                except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                    self._handles.pop(pid, None)
+                except psutil.AccessDenied:
+                    if handle is not None:
+                        processes.append(ProcessRecord(pid, handle[1] or '', 0.0, 0.0))
+                except Exception:
                     continue
-        except:
-            pass
+        
+        # Хэши новых exe - вне блокировки. Два параллельных замера могут
+        # взять одну ручку; ExeHashCache вернёт второму готовый результат
+        for record, handle in pending:
+            digest = self.exe_cache.digest(handle[3])
+            handle[5], handle[6] = digest, True
+            record.exe_sha256 = digest
+            if digest is not None and signatures:
+                record.threat = signatures.match(digest)
+        
+        rules = self.rules
+        if rules is not None:
+            rules.refresh()
+            for proc in processes:
+                matched = rules.match_process(proc)
+                if matched:
+                    proc.rule, proc.severity = matched[0].id, matched[0].severity
         return processes
 
+class ProcNetReader:
+    """Чтение TCP-соединений напрямую из /proc/net/tcp и tcp6 (Linux).
+    
+    Дешевле psutil.net_connections: не нужен обход /proc/*/fd на каждом
+    замере. Владелец сокета (PID) ищется по inode, и карта inode -> PID
+    перестраивается только когда появляются неизвестные inode, не чаще
+    раза в pid_refresh секунд.
+    """
+    
+    TCP_STATES = {
+        '01': 'ESTABLISHED', '02': 'SYN_SENT', '03': 'SYN_RECV', '04': 'FIN_WAIT1',
+        '05': 'FIN_WAIT2', '06': 'TIME_WAIT', '07': 'CLOSE', '08': 'CLOSE_WAIT',
+        '09': 'LAST_ACK', '0A': 'LISTEN', '0B': 'CLOSING', '0C': 'SYN_RECV'
+    }
+    FILES = (('/proc/net/tcp', False), ('/proc/net/tcp6', True))
+    
+    def __init__(self, pid_refresh=5.0):
+        self.pid_refresh = pid_refresh
+        self._inode_pids = {}
+        self._pids_built_at = 0.0
+    
+    @staticmethod
+    def available():
+        return os.path.exists('/proc/net/tcp')
+    
+    @staticmethod
+    def parse_addr(value, ipv6):
+        """'0100007F:0035' -> ('127.0.0.1', 53); адреса в /proc - слова little-endian"""
+        import socket
+        host, port = value.split(':')
+        raw = bytes.fromhex(host)
+        if ipv6:
+            raw = b''.join(raw[i:i + 4][::-1] for i in range(0, 16, 4))
+            ip = socket.inet_ntop(socket.AF_INET6, raw)
+        else:
+            ip = socket.inet_ntop(socket.AF_INET, raw[::-1])
+        return ip, int(port, 16)
+    
+    def _build_inode_map(self):
+        inode_pids = {}
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            fd_dir = f'/proc/{pid}/fd'
+            try:
+                for fd in os.listdir(fd_dir):
+                    try:
+                        target = os.readlink(f'{fd_dir}/{fd}')
+                    except OSError:
+                        continue
+                    if target.startswith('socket:['):
+                        inode_pids[int(target[8:-1])] = int(pid)
+            except OSError:
+                continue
+        self._inode_pids = inode_pids
+        self._pids_built_at = time.monotonic()
+    
+    def get_connections(self):
+        connections = []
+        unknown = False
+        rows = []
+        for path, ipv6 in self.FILES:
+            try:
+                with open(path, 'r') as f:
+                    next(f)  # заголовок
+                    for line in f:
+                        parts = line.split()
+                        if len(parts) < 10:
+                            continue
+                        remote = parts[2]
+                        # Как и в psutil-режиме, нужны только соединения с удалённым концом
+                        if remote.rstrip('0:') == '' or remote.endswith(':0000'):
+                            continue
+                        inode = int(parts[9])
+                        if inode and inode not in self._inode_pids:
+                            unknown = True
+                        rows.append((parts[1], remote, parts[3], inode, ipv6))
+            except OSError:
+                continue
+        
+        if unknown and time.monotonic() - self._pids_built_at >= self.pid_refresh:
+            self._build_inode_map()
+        
+        for local, remote, state, inode, ipv6 in rows:
+            try:
+                connections.append(ConnectionRecord(
+                    self._inode_pids.get(inode),
+                    self.parse_addr(local, ipv6),
+                    self.parse_addr(remote, ipv6),
+                    self.TCP_STATES.get(state, 'NONE')
+                ))
+            except (ValueError, OSError):
+                continue
+        return connections
+
 class BasicNetworkMonitor:
-    """Базовый сетевой монитор"""
+    """Базовый сетевой монитор.
     
-    def __init__(self):
-        pass
+    source='psutil' - psutil.net_connections (все платформы),
+    source='proc' - чтение /proc/net/tcp{,6} на Linux (только TCP, дешевле).
+    """
+    
+    def __init__(self, source='psutil'):
+        self._proc_reader = ProcNetReader() if source == 'proc' and ProcNetReader.available() else None
+        self.source = 'proc' if self._proc_reader is not None else 'psutil'
     
     def get_connections(self):
         """Получение сетевых соединений"""
+        with METRICS.profile('connections'), METRICS.timer(f'{self.source}.connections'):
+            connections = self._sample()
+        METRICS.count('net.connection_rows', len(connections))
+        return connections
+    
+    def _sample(self):
+        if self._proc_reader is not None:
+            return self._proc_reader.get_connections()
+        
+        import psutil
         connections = []
         try:
             for conn in psutil.net_connections(kind='inet'):
                 try:
                     if conn.raddr:
-                        connections.append({
-                            'pid': conn.pid,
-                            'local': f"{conn.laddr.ip}:{conn.laddr.port}" if conn.laddr else '',
-                            'remote': f"{conn.raddr.ip}:{conn.raddr.port}" if conn.raddr else '',
-                            'status': conn.status
-                        })
+                        # Адреса остаются кортежами psutil, строки - только при показе
+                        connections.append(ConnectionRecord(conn.pid, conn.laddr, conn.raddr, conn.status))
                 except:
                     continue
         except:
             pass
         return connections
 
+@dataclass(slots=True)
+class ConnectionEvent:
+    """Событие соединения: NEW, CLOSED или STATE_CHANGED"""
+    kind: str
+    connection: ConnectionRecord
+    previous_status: str = None
+    lifetime: float = 0.0  # Для CLOSED - сколько жило соединение, с
+    timestamp: float = field(default_factory=time.time)
+    
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            **self.connection.as_dict(),
+            'previous_status': self.previous_status,
+            'lifetime': round(self.lifetime, 3),
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat(timespec='seconds')
+        }
+
+class ConnectionTracker:
+    """Отслеживание соединений между снимками.
+    
+    Соединение определяется по (pid, локальный адрес, удалённый адрес);
+    смена статуса у того же соединения - STATE_CHANGED, а не закрытие и
+    открытие. Для активных соединений хранится время появления и число
+    смен статуса, закрытые попадают в ограниченную историю со временем жизни.
+    Первый снимок только запоминается - NEW для уже открытых соединений
+    не генерируется.
+    """
+    
+    def __init__(self, closed_history=10000, pending_limit=10000):
+        self.active = {}  # идентификатор -> [запись, появилось, смен статуса]
+        self.closed = deque(maxlen=closed_history)  # (запись, появилось, закрыто, смен статуса)
+        self.counts = Counter()
+        self.primed = False
+        self._pending = deque(maxlen=pending_limit)
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def identity(conn):
+        return (conn.pid, tuple(conn.laddr or ()), tuple(conn.raddr or ()))
+    
+    def update(self, connections, now=None):
+        """Сравнение нового снимка с предыдущим, возвращает список событий"""
+        now = time.time() if now is None else now
+        events = []
+        seen = set()
+        
+        with self._lock:
+            for conn in connections:
+                identity = self.identity(conn)
+                seen.add(identity)
+                state = self.active.get(identity)
+                if state is None:
+                    self.active[identity] = [conn, now, 0]
+                    if self.primed:
+                        events.append(ConnectionEvent('NEW', conn, timestamp=now))
+                    continue
+                previous = state[0]
+                if previous.status != conn.status:
+                    state[2] += 1
+                    events.append(ConnectionEvent('STATE_CHANGED', conn, previous.status, now - state[1], now))
+                state[0] = conn
+            
+            for identity in [identity for identity in self.active if identity not in seen]:
+                conn, opened, changes = self.active.pop(identity)
+                self.closed.append((conn, opened, now, changes))
+                events.append(ConnectionEvent('CLOSED', conn, conn.status, now - opened, now))
+            
+            self.primed = True
+            for event in events:
+                self.counts[event.kind] += 1
+            self._pending.extend(events)
+        return events
+    
+    def take_events(self):
+        """События, накопленные с прошлого вызова"""
+        with self._lock:
+            events = list(self._pending)
+            self._pending.clear()
+        return events
+    
+    def lifetime(self, conn, now=None):
+        """Сколько секунд соединение уже активно (None, если не отслеживается)"""
+        with self._lock:
+            state = self.active.get(self.identity(conn))
+        if state is None:
+            return None
+        return (time.time() if now is None else now) - state[1]
+    
+    def stats(self):
+        """Сводка: активные, закрытые, средняя жизнь закрытых, счётчики событий"""
+        # Снимок под замком: update() меняет словарь в потоке замеров
+        with self._lock:
+            lifetimes = [closed - opened for _, opened, closed, _ in self.closed]
+            active = len(self.active)
+            counts = dict(self.counts)
+        return {
+            'active': active,
+            'closed': len(lifetimes),
+            'avg_closed_lifetime': sum(lifetimes) / len(lifetimes) if lifetimes else 0.0,
+            'events': counts
+        }
+
+def fresh_alerts(reported, alerts):
+    """Оповещения снимка, которых не было в прошлом: alerts - {ключ: запись}.
+    
+    reported заменяется ключами текущего снимка, поэтому завершившиеся
+    процессы и закрытые соединения в нём не копятся.
+    """
+    fresh = [record for key, record in alerts.items() if key not in reported]
+    reported.clear()
+    reported.update(alerts)
+    return fresh
+
+class PrefixTrie:
+    """Двоичное префиксное дерево адресов для поиска по CIDR.
+    
+    Узлы лежат в плоских массивах (дети по 0 и 1, номер метки), поэтому
+    дерево на сотни тысяч префиксов не создаёт объект на узел, а поиск
+    проходит не больше bits шагов.
+    """
+    
+    def __init__(self, bits):
+        self.bits = bits
+        self.zero = array('i', [0])
+        self.one = array('i', [0])
+        self.value = array('i', [-1])
+    
+    def insert(self, address, length, value):
+        zero, one = self.zero, self.one
+        node = 0
+        for shift in range(self.bits - 1, self.bits - 1 - length, -1):
+            branch = one if (address >> shift) & 1 else zero
+            child = branch[node]
+            if not child:
+                child = len(self.value)
+                zero.append(0)
+                one.append(0)
+                self.value.append(-1)
+                branch[node] = child
+            node = child
+        self.value[node] = value
+    
+    def longest(self, address):
+        """Метка самого длинного совпавшего префикса или -1"""
+        zero, one, value = self.zero, self.one, self.value
+        node = 0
+        found = value[0]
+        for shift in range(self.bits - 1, -1, -1):
+            node = (one if (address >> shift) & 1 else zero)[node]
+            if not node:
+                break
+            if value[node] >= 0:
+                found = value[node]
+        return found
+    
+    def matches(self, address):
+        """Метки всех совпавших префиксов, от короткого к длинному"""
+        zero, one, value = self.zero, self.one, self.value
+        node = 0
+        found = [value[0]] if value[0] >= 0 else []
+        for shift in range(self.bits - 1, -1, -1):
+            node = (one if (address >> shift) & 1 else zero)[node]
+            if not node:
+                break
+            if value[node] >= 0:
+                found.append(value[node])
+        return found
+    
+    def __len__(self):
+        return len(self.value)
+
+class IPBlocklist:
+    """Локальный блок-лист IP-адресов и подсетей.
+    
+    Формат файла: адрес или подсеть CIDR (IPv4/IPv6) и необязательная метка
+    через пробел, строки с # игнорируются. Одиночные адреса - основная
+    масса таких списков - хранятся в словаре (O(1)), подсети - в
+    PrefixTrie (O(длина префикса)).
+    """
+    
+    BITS = {4: 32, 6: 128}
+    
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, 'blocklist.txt')
+        self.mtime_ns = None
+        self._reset()
+    
+    def _reset(self):
+        self.labels = []
+        self.exact = {4: {}, 6: {}}
+        self.tries = {version: PrefixTrie(bits) for version, bits in self.BITS.items()}
+        self.count = 0
+    
+    @staticmethod
+    def parse_ip(text):
+        """'1.2.3.4' -> (4, int), None если это не адрес.
+        
+        Зона IPv6 ('fe80::1%eth0') отбрасывается, а IPv4, отображённый в
+        IPv6 ('::ffff:1.2.3.4' - так адреса отдают сокеты двойного стека),
+        приводится к версии 4.
+        """
+        import socket
+        try:
+            if ':' in text:
+                number = int.from_bytes(socket.inet_pton(socket.AF_INET6, text.partition('%')[0]), 'big')
+                if number >> 32 == 0xffff:
+                    return 4, number & 0xffffffff
+                return 6, number
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, text), 'big')
+        except (OSError, ValueError):
+            return None
+    
+    @classmethod
+    def parse_network(cls, entry):
+        """'10.0.0.0/8' -> (4, адрес сети, длина префикса), None если не разобрано.
+        
+        Биты хоста отбрасываются, как в ipaddress.ip_network(strict=False).
+        """
+        address, _, prefix = entry.partition('/')
+        parsed = cls.parse_ip(address)
+        if parsed is None:
+            return None
+        version, address = parsed
+        bits = cls.BITS[version]
+        try:
+            length = int(prefix) if prefix else bits
+        except ValueError:
+            return None
+        if version == 4 and ':' in entry and prefix:
+            length -= 96  # Префикс записан для ::ffff:0:0/96
+        if not 0 <= length <= bits:
+            return None
+        return version, address & (((1 << length) - 1) << (bits - length)), length
+    
+    @classmethod
+    def in_network(cls, address, network):
+        """Входит ли адрес (версия, int) в подсеть от parse_network"""
+        version, number = address
+        net_version, net, length = network
+        return version == net_version and (number ^ net) >> (cls.BITS[version] - length) == 0
+    
+    def add(self, entry, label=None):
+        """Добавление адреса или подсети, False если запись не разобрана"""
+        network = self.parse_network(entry)
+        if network is None:
+            return False
+        version, address, length = network
+        bits = self.BITS[version]
+        
+        label_index = len(self.labels)
+        if length == bits:
+            self.exact[version][address] = label_index
+        else:
+            self.tries[version].insert(address, length, label_index)
+        self.labels.append(label or entry)
+        self.count += 1
+        return True
+    
+    def load(self, path=None):
+        """Загрузка списка из файла, возвращает число записей"""
+        if path:
+            self.path = path
+        self._reset()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split(None, 1)
+                self.add(parts[0], parts[1] if len(parts) > 1 else None)
+        self.mtime_ns = os.stat(self.path).st_mtime_ns
+        return self.count
+    
+    def load_if_exists(self):
+        """Загрузка списка по умолчанию, если файл существует"""
+        if self.mtime_ns is not None:
+            return len(self)
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            return self.load()
+        except (OSError, UnicodeDecodeError) as e:
+            report_error(f"Не удалось загрузить блок-лист: {e}")
+            return 0
+    
+    def match(self, ip):
+        """Метка записи, под которую попадает адрес, иначе None"""
+        if not self.count:
+            return None
+        parsed = self.parse_ip(ip)
+        if parsed is None:
+            return None
+        version, address = parsed
+        index = self.exact[version].get(address)
+        if index is None:
+            index = self.tries[version].longest(address)
+            if index < 0:
+                return None
+        return self.labels[index]
+    
+    def __len__(self):
+        return self.count
+
+class ReverseDNSCache:
+    """Асинхронный обратный DNS с TTL-кэшем.
+    
+    lookup() никогда не ждёт сеть: возвращает имя из кэша (или None) и,
+    если записи нет или она устарела, ставит разрешение в небольшой пул
+    потоков. Неудачные ответы кэшируются на negative_ttl, чтобы не
+    повторять медленные запросы на каждом замере.
+    """
+    
+    def __init__(self, ttl=600, negative_ttl=120, max_entries=10000, workers=4):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.workers = workers
+        self._cache = OrderedDict()  # ip -> (имя или '', время истечения)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+    
+    def lookup(self, ip):
+        with self._lock:
+            cached = self._cache.get(ip)
+            hostname = cached[0] or None if cached else None
+            if cached is not None and cached[1] > time.monotonic() or ip in self._pending:
+                return hostname
+            self._pending.add(ip)
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='rdns')
+            executor = self._executor
+        executor.submit(self._resolve, ip)
+        return hostname  # Устаревшее имя показываем, пока не придёт новое
+    
+    def _resolve(self, ip):
+        import socket
+        try:
+            hostname = socket.gethostbyaddr(ip)[0]
+            ttl = self.ttl
+        except (OSError, UnicodeError):
+            hostname = ''
+            ttl = self.negative_ttl
+        with self._lock:
+            self._pending.discard(ip)
+            self._cache[ip] = (hostname, time.monotonic() + ttl)
+            self._cache.move_to_end(ip)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+    
+    def wait(self, timeout):
+        """Ожидание поставленных разрешений (для разовых снимков в консоли)"""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.05)
+    
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    def __len__(self):
+        return len(self._cache)
+
+class ConnectionEnricher:
+    """Дополнение соединений именем процесса, DNS-именем и блок-листом.
+    
+    Имена процессов присоединяются за один проход по словарю pid -> имя
+    из готового снимка процессов, без psutil-запроса на каждую строку.
+    DNS-имена берутся только из кэша, поэтому enrich() не ждёт сеть.
+    Правила RuleSet применяются после имён процессов (условие processes).
+    """
+    
+    def __init__(self, blocklist=None, dns=None, rules=None):
+        self.blocklist = blocklist
+        self.dns = dns
+        self.rules = rules
+    
+    def enrich(self, connections, names=None):
+        """Заполнение process/hostname/blocked, возвращает заблокированные соединения.
+        
+        names - словарь pid -> имя (например, BasicProcessMonitor.names()).
+        """
+        names = names or {}
+        blocklist = self.blocklist
+        if blocklist is not None:
+            blocklist.load_if_exists()
+            if not blocklist:
+                blocklist = None
+        dns = self.dns
+        blocked = []
+        for conn in connections:
+            conn.process = names.get(conn.pid, '')
+            ip = conn.raddr[0] if conn.raddr else None
+            if ip is None:
+                continue
+            if dns is not None:
+                conn.hostname = dns.lookup(ip)
+            if blocklist is not None:
+                conn.blocked = blocklist.match(ip)
+                if conn.blocked:
+                    blocked.append(conn)
+        
+        rules = self.rules
+        if rules is not None:
+            rules.refresh()
+            for conn in connections:
+                matched = rules.match_connection(conn)
+                if matched:
+                    conn.rule, conn.severity = matched[0].id, matched[0].severity
+        return blocked
+
+class RingBuffer:
+    """Кольцевой буфер фиксированного размера на array: O(1) добавление"""
+    
+    __slots__ = ('data', 'capacity', 'pos', 'count')
+    
+    def __init__(self, capacity, typecode='d'):
+        self.data = array(typecode, [0]) * capacity
+        self.capacity = capacity
+        self.pos = 0
+        self.count = 0
+    
+    def append(self, value):
+        self.data[self.pos] = value
+        self.pos = (self.pos + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+    
+    def __len__(self):
+        return self.count
+    
+    def values(self, last=None):
+        """Последние значения от старых к новым (срезы array, без цикла Python)"""
+        count = self.count if last is None else min(last, self.count)
+        if count == 0:
+            return self.data[:0]
+        start = (self.pos - count) % self.capacity
+        if start + count <= self.capacity:
+            return self.data[start:start + count]
+        return self.data[start:] + self.data[:self.pos]
+    
+    def latest(self):
+        return self.data[(self.pos - 1) % self.capacity] if self.count else 0.0
+    
+    def mean(self, last=None):
+        values = self.values(last)
+        return sum(values) / len(values) if values else 0.0
+    
+    def max(self, last=None):
+        values = self.values(last)
+        return max(values) if values else 0.0
+
+class MetricsHistory:
+    """История метрик процессов и сети с ограниченной памятью.
+    
+    Каждый ряд (CPU и память на PID, число соединений на удалённый адрес,
+    итоги) - кольцевой буфер из capacity значений. После каждого замера
+    вытесняются ряды, не обновлявшиеся stale_ticks замеров (завершённые
+    процессы, закрытые соединения), а сверх max_series - все, что не
+    обновились в этом замере. Ряды живых процессов не вытесняются даже
+    при тысячах PID, так что средние и всплески не теряют историю, а
+    память ограничена числом того, что реально наблюдается.
+    """
+    
+    def __init__(self, capacity=300, max_series=5000, stale_ticks=30):
+        self.capacity = capacity
+        self.max_series = max_series
+        self.stale_ticks = stale_ticks
+        self.series = OrderedDict()  # (метрика, ключ) -> RingBuffer, по времени обновления
+        self.updated = {}  # (метрика, ключ) -> номер замера последнего значения
+        self.labels = {}  # (метрика, ключ) -> подпись (имя процесса)
+        self.ticks = 0
+    
+    def _series(self, metric, key):
+        name = (metric, key)
+        buffer = self.series.get(name)
+        if buffer is None:
+            buffer = self.series[name] = RingBuffer(self.capacity)
+        else:
+            self.series.move_to_end(name)
+        self.updated[name] = self.ticks
+        return buffer
+    
+    def _evict(self):
+        """Вытеснение устаревших рядов (первыми в series идут самые старые)"""
+        while self.series:
+            name = next(iter(self.series))
+            age = self.ticks - self.updated[name]
+            if age <= self.stale_ticks and (age == 0 or len(self.series) <= self.max_series):
+                break
+            del self.series[name]
+            del self.updated[name]
+            self.labels.pop(name, None)
+    
+    def add(self, metric, key, value, label=None):
+        self._series(metric, key).append(value)
+        if label is not None:
+            self.labels[(metric, key)] = label
+    
+    def record_processes(self, processes):
+        """Замер CPU/памяти по каждому PID и суммарный CPU"""
+        total_cpu = 0.0
+        for proc in processes:
+            self.add('cpu', proc.pid, proc.cpu, proc.name)
+            self.add('memory', proc.pid, proc.memory, proc.name)
+            total_cpu += proc.cpu
+        self.add('total', 'cpu', total_cpu)
+        self.add('total', 'processes', len(processes))
+        self._evict()
+        self.ticks += 1
+    
+    def record_connections(self, connections):
+        """Число соединений на каждый удалённый адрес и общее число"""
+        counts = Counter(conn.raddr[0] for conn in connections if conn.raddr)
+        for endpoint, count in counts.items():
+            self.add('endpoint', endpoint, count)
+        self.add('total', 'connections', len(connections))
+        self._evict()
+    
+    def get(self, metric, key):
+        return self.series.get((metric, key))
+    
+    def label(self, metric, key):
+        return self.labels.get((metric, key), str(key))
+    
+    def rolling_mean(self, metric, key, window=30):
+        buffer = self.get(metric, key)
+        return buffer.mean(window) if buffer else 0.0
+    
+    def top(self, metric, count=5, window=30):
+        """Top-N ключей метрики по среднему за окно: [(ключ, среднее), ...]"""
+        means = [
+            (key, buffer.mean(window))
+            for (name, key), buffer in self.series.items() if name == metric
+        ]
+        return heapq.nlargest(count, means, key=lambda item: item[1])
+    
+    def spikes(self, metric, factor=3.0, window=30, minimum=5.0):
+        """Ключи, у которых последнее значение выбивается из окна.
+        
+        Всплеск - значение выше minimum и выше среднего + factor * СКО
+        за предыдущие window замеров.
+        """
+        import statistics
+        result = []
+        for (name, key), buffer in self.series.items():
+            if name != metric or len(buffer) < 3:
+                continue
+            latest = buffer.latest()
+            if latest < minimum:
+                continue
+            previous = buffer.values(window + 1)[:-1]
+            mean = sum(previous) / len(previous)
+            deviation = statistics.pstdev(previous, mean)
+            if latest > mean + factor * deviation:
+                result.append((key, latest, mean))
+        return result
+    
+    def memory_bytes(self):
+        """Оценка памяти, занятой буферами"""
+        return sum(buffer.data.itemsize * buffer.capacity for buffer in self.series.values())
+
+class FileWatcher:
+    """Наблюдение за каталогами: inotify на Linux, иначе периодический опрос.
+    
+    События копятся и отдаются пачками в callback(список путей) после
+    паузы debounce секунд (или сразу при max_batch путях), чтобы серия
+    записей в один файл давала одну проверку. Вызовы callback идут из
+    потока наблюдателя.
+    """
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+    EVENT_HEADER = struct.Struct('iIII')
+    
+    def __init__(self, paths, callback, walker=None, debounce=0.5, max_batch=500,
+                 poll_interval=5.0, use_inotify=True):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.callback = callback
+        self.walker = walker or FileWalker()
+        self.debounce = debounce
+        self.max_batch = max_batch
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and sys.platform.startswith('linux')
+        self.backend = None
+        self.last_error = None
+        self._pending = {}  # путь -> время последнего события
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name='file-watcher', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+    
+    def _run(self, stop):
+        if self.use_inotify:
+            try:
+                self._run_inotify(stop)
+                return
+            except OSError as e:
+                self.last_error = f"inotify недоступен ({e}), переход на опрос"
+        self._run_polling(stop)
+    
+    # --- накопление событий ---
+    
+    def _add(self, path):
+        self._pending[path] = time.monotonic()
+    
+    def _flush(self, force=False):
+        """Отдача пачки, если события затихли или пачка набралась"""
+        if not self._pending:
+            return
+        quiet = time.monotonic() - max(self._pending.values()) >= self.debounce
+        if not (force or quiet or len(self._pending) >= self.max_batch):
+            return
+        batch = list(self._pending)
+        self._pending.clear()
+        try:
+            self.callback(batch)
+        except Exception as e:
+            self.last_error = str(e)
+    
+    # --- inotify ---
+    
+    def _run_inotify(self, stop):
+        import ctypes
+        import ctypes.util
+        import select
+        
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        
+        watches = {}  # wd -> каталог
+        
+        def add_watch(directory):
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), self.WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                self.last_error = f"Не удалось наблюдать {directory}: {os.strerror(errno)}"
+                return False
+            watches[wd] = directory
+            return True
+        
+        def add_tree(root, report_files):
+            # Файлы, появившиеся до установки наблюдения, тоже проверяем
+            for directory, entries in self.walker.iter_dirs(root, stop):
+                add_watch(directory)
+                if report_files:
+                    for entry in entries:
+                        self._add(entry.path)
+        
+        try:
+            for path in self.paths:
+                add_tree(path, report_files=False)
+            self.backend = 'inotify'
+            
+            while not stop.is_set():
+                timeout = self.debounce if self._pending else 0.5
+                ready, _, _ = select.select([fd], [], [], timeout)
+                if ready:
+                    try:
+                        data = os.read(fd, 65536)
+                    except BlockingIOError:
+                        data = b''
+                    offset = 0
+                    while offset + self.EVENT_HEADER.size <= len(data):
+                        wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+                        offset += self.EVENT_HEADER.size
+                        name = data[offset:offset + length].rstrip(b'\0')
+                        offset += length
+                        
+                        if mask & self.IN_Q_OVERFLOW:
+                            # Очередь ядра переполнена - перепроверяем всё дерево
+                            for path in self.paths:
+                                for entry in self.walker.walk(path, stop):
+                                    self._add(entry.path)
+                            continue
+                        if mask & self.IN_IGNORED:
+                            watches.pop(wd, None)
+                            continue
+                        directory = watches.get(wd)
+                        if directory is None or not name:
+                            continue
+                        path = os.path.join(directory, os.fsdecode(name))
+                        if mask & self.IN_ISDIR:
+                            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                                add_tree(path, report_files=True)
+                        elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                            self._add(path)
+                self._flush()
+        finally:
+            os.close(fd)
+        self._flush(force=True)
+    
+    # --- опрос ---
+    
+    def _snapshot(self, stop):
+        state = {}
+        for path in self.paths:
+            for entry in self.walker.walk(path, stop):
+                state[entry.path] = (entry.size, entry.mtime_ns)
+        return state
+    
+    def _run_polling(self, stop):
+        self.backend = 'polling'
+        previous = self._snapshot(stop)
+        while not stop.wait(self.poll_interval):
+            current = self._snapshot(stop)
+            for path, state in current.items():
+                if previous.get(path) != state:
+                    self._add(path)
+            previous = current
+            self._flush(force=True)
+
+class PeriodicSampler:
+    """Периодический замер в фоновом потоке.
+    
+    func вызывается раз в interval секунд; интерфейс забирает последний
+    результат через take_latest() из root.after, так что устаревшие
+    снимки не копятся, а поток интерфейса не ждёт psutil.
+    """
+    
+    def __init__(self, func, interval=2.0, name='sampler'):
+        self.func = func
+        self.interval = interval
+        self.name = name
+        self.last_duration = 0.0
+        self.last_error = None
+        self._latest = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._once = None
+    
+    def start(self):
+        if self.is_running():
+            return
+        # У каждого запуска своё событие: старый поток доработает и выйдет
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name=self.name, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+    
+    def run_once(self):
+        """Один замер в фоновом потоке (результат - через take_latest).
+        
+        Пока прошлый разовый замер не закончился, новый не запускается:
+        повторные нажатия «Обновить» не плодят потоки.
+        """
+        if self._once is not None and self._once.is_alive():
+            return False
+        self._once = threading.Thread(target=self._sample, name=f'{self.name}-once', daemon=True)
+        self._once.start()
+        return True
+    
+    def take_latest(self):
+        """Последний результат (или None, если новых замеров не было)"""
+        with self._lock:
+            latest, self._latest = self._latest, None
+        return latest
+    
+    def _sample(self):
+        started = time.perf_counter()
+        try:
+            result = self.func()
+        except Exception as e:
+            self.last_error = str(e)
+        else:
+            with self._lock:
+                self._latest = result
+        self.last_duration = time.perf_counter() - started
+    
+    def _run(self, stop):
+        while not stop.is_set():
+            self._sample()
+            stop.wait(max(0.05, self.interval - self.last_duration))
+
+EXPORT_SCHEMAS = {
+    'threats': (
+        ('file', 's'), ('type', 's'), ('reason', 's'), ('detail', 's'), ('offset', 'q'),
+        ('severity', 's'), ('timestamp', 's')
+    ),
+    'processes': (
+        ('pid', 'q'), ('ppid', 'q'), ('name', 's'), ('cpu', 'f'), ('memory', 'f'), ('rss', 'q'),
+        ('rss_delta', 'q'), ('exe', 's'), ('cmdline', 's'), ('exe_sha256', 's'), ('threat', 's'),
+        ('rule', 's'), ('severity', 's')
+    ),
+    'connections': (
+        ('pid', 'q'), ('process', 's'), ('local', 's'), ('remote', 's'), ('hostname', 's'),
+        ('status', 's'), ('blocked', 's'), ('rule', 's'), ('severity', 's')
+    ),
+}
+
+EXPORT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.smc': 'columnar'}
+
+def export_format(path):
+    """Формат экспорта по расширению файла (по умолчанию CSV)"""
+    return EXPORT_FORMATS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+def chunked(records, size):
+    """Разбивка готового списка на пачки"""
+    for i in range(0, len(records), size):
+        yield records[i:i + size]
+
+class ColumnarWriter:
+    """Компактный колоночный формат (.smc).
+    
+    Заголовок: b'SMC1', длина и JSON со схемой. Дальше блоки: число строк
+    и по каждой колонке сжатый zlib массив - int64, float64 или строки
+    словарём (уникальные значения блока + индексы uint32), что сильно
+    сжимает повторяющиеся типы, статусы и пути. Блок с 0 строк - конец.
+    Числа записываются в little-endian, None - NaN/минимальный int64/0xFFFFFFFF.
+    """
+    
+    MAGIC = b'SMC1'
+    INT_NULL = -2 ** 63
+    STR_NULL = 0xFFFFFFFF
+    
+    def __init__(self, f, kind, columns):
+        self.f = f
+        self.columns = columns
+        header = json.dumps({'kind': kind, 'columns': columns}).encode('utf-8')
+        f.write(self.MAGIC + struct.pack('<I', len(header)) + header)
+    
+    @staticmethod
+    def _little_endian(values):
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values.tobytes()
+    
+    def _encode(self, values, kind):
+        if kind == 'q':
+            null = self.INT_NULL
+            return self._little_endian(array('q', [null if v is None else int(v) for v in values]))
+        if kind == 'f':
+            return self._little_endian(array('d', [float('nan') if v is None else float(v) for v in values]))
+        
+        index = {}
+        codes = array('I')
+        for v in values:
+            if v is None:
+                codes.append(self.STR_NULL)
+                continue
+            code = index.get(v)
+            if code is None:
+                code = index[v] = len(index)
+            codes.append(code)
+        encoded = [str(v).encode('utf-8') for v in index]
+        lengths = array('I', [len(v) for v in encoded])
+        return (
+            struct.pack('<I', len(encoded)) + self._little_endian(lengths)
+            + b''.join(encoded) + self._little_endian(codes)
+        )
+    
+    def write_chunk(self, rows):
+        import zlib
+        if not rows:
+            return
+        parts = [struct.pack('<I', len(rows))]
+        for name, kind in self.columns:
+            block = zlib.compress(self._encode([row.get(name) for row in rows], kind), 6)
+            parts.append(struct.pack('<I', len(block)))
+            parts.append(block)
+        self.f.write(b''.join(parts))
+    
+    def close(self):
+        self.f.write(struct.pack('<I', 0))
+
+def read_columnar(path):
+    """Чтение файла .smc: заголовок (kind, columns) и генератор строк-словарей.
+    
+    Заголовок читается сразу, а генератор открывает файл заново и держит
+    его открытым только пока идёт чтение строк.
+    """
+    import zlib
+    
+    def unpack(raw, typecode):
+        values = array(typecode)
+        values.frombytes(raw)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+    
+    with open(path, 'rb') as f:
+        if f.read(4) != ColumnarWriter.MAGIC:
+            raise ValueError("Не файл формата SMC1")
+        header = json.loads(f.read(struct.unpack('<I', f.read(4))[0]))
+        start = f.tell()
+    
+    def rows():
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while True:
+                count = struct.unpack('<I', f.read(4))[0]
+                if not count:
+                    return
+                columns = []
+                for name, kind in header['columns']:
+                    raw = zlib.decompress(f.read(struct.unpack('<I', f.read(4))[0]))
+                    if kind == 'q':
+                        columns.append([None if v == ColumnarWriter.INT_NULL else v for v in unpack(raw, 'q')])
+                    elif kind == 'f':
+                        columns.append([None if v != v else v for v in unpack(raw, 'd')])
+                    else:
+                        size = struct.unpack_from('<I', raw)[0]
+                        lengths = unpack(raw[4:4 + 4 * size], 'I')
+                        pos = 4 + 4 * size
+                        strings = []
+                        for length in lengths:
+                            strings.append(raw[pos:pos + length].decode('utf-8'))
+                            pos += length
+                        columns.append([
+                            None if code == ColumnarWriter.STR_NULL else strings[code]
+                            for code in unpack(raw[pos:], 'I')
+                        ])
+                names = [name for name, _ in header['columns']]
+                for values in zip(*columns):
+                    yield dict(zip(names, values))
+    
+    return header, rows()
+
+class ExportJob:
+    """Потоковый экспорт записей в CSV, JSON Lines или колоночный .smc.
+    
+    Записи приходят пачками из генератора (например, ScanResultStore.chunks),
+    в словари превращается только текущая пачка, а файл пишется во
+    временный и переименовывается после успешного завершения.
+    Сообщения: ('progress', записано, всего), ('done', записано, отменено), ('error', текст).
+    """
+    
+    CHUNK_SIZE = 5000
+    
+    def __init__(self, kind, chunks, path, fmt=None, total=None):
+        self.kind = kind
+        self.chunks = chunks
+        self.path = path
+        self.fmt = fmt or export_format(path)
+        self.total = total
+        self.written = 0
+        self.error = None
+        self.queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='export-job', daemon=True)
+        self._thread.start()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def run(self):
+        """Экспорт в текущем потоке (start() запускает его в фоновом)"""
+        tmp_path = self.path + '.part'
+        try:
+            if self.fmt == 'columnar':
+                f = open(tmp_path, 'wb')
+            else:
+                f = open(tmp_path, 'w', newline='', encoding='utf-8')
+            with f:
+                self._write(f)
+            if self.cancel_event.is_set():
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            self.error = str(e)
+            self.queue.put(('error', self.error))
+            return
+        self.queue.put(('done', self.written, self.cancel_event.is_set()))
+    
+    def _write(self, f):
+        columns = EXPORT_SCHEMAS[self.kind]
+        names = [name for name, _ in columns]
+        if self.fmt == 'csv':
+            import csv
+            writer = csv.DictWriter(f, names, extrasaction='ignore')
+            writer.writeheader()
+            write = writer.writerows
+        elif self.fmt == 'jsonl':
+            write = lambda rows: f.writelines(
+                json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows
+            )
+        else:
+            writer = ColumnarWriter(f, self.kind, columns)
+            write = writer.write_chunk
+        
+        for chunk in self.chunks:
+            if self.cancel_event.is_set():
+                return
+            write([record.as_dict() for record in chunk])
+            self.written += len(chunk)
+            self.queue.put(('progress', self.written, self.total))
+        
+        if self.fmt == 'columnar':
+            writer.close()
+
+SEVERITIES = ('debug', 'info', 'warning', 'error')
+SEVERITY_RANK = {name: rank for rank, name in enumerate(SEVERITIES)}
+
+@dataclass(slots=True)
+class LogEntry:
+    """Запись журнала событий"""
+    message: str
+    severity: str = 'info'
+    timestamp: float = field(default_factory=time.time)
+    
+    def format(self):
+        marker = {'warning': '⚠ ', 'error': '✖ '}.get(self.severity, '')
+        return f"[{datetime.fromtimestamp(self.timestamp).strftime('%H:%M:%S')}] {marker}{self.message}"
+
+class ActivityLog:
+    """Журнал событий в кольцевом буфере с необязательным файлом.
+    
+    Хранится не больше capacity последних записей. Новые записи копятся в
+    очереди для интерфейса, который забирает их пачкой раз в кадр
+    (take_pending). Запись в файл с ротацией идёт через QueueListener в
+    фоновом потоке, поэтому add() не ждёт диск.
+    """
+    
+    def __init__(self, capacity=5000):
+        self.entries = deque(maxlen=capacity)
+        self._pending = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._logger = None
+        self._listener = None
+        self.file_path = None
+    
+    def add(self, message, severity='info'):
+        entry = LogEntry(message, severity)
+        with self._lock:
+            self.entries.append(entry)
+            self._pending.append(entry)
+        if self._logger is not None:
+            self._logger.log(self._level(severity), message)
+        return entry
+    
+    @staticmethod
+    def _level(severity):
+        import logging
+        return getattr(logging, severity.upper(), logging.INFO)
+    
+    def take_pending(self):
+        """Записи, добавленные с прошлого вызова"""
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+        return pending
+    
+    def filtered(self, min_severity='debug'):
+        """Записи не ниже заданной важности"""
+        rank = SEVERITY_RANK[min_severity]
+        with self._lock:
+            return [entry for entry in self.entries if SEVERITY_RANK[entry.severity] >= rank]
+    
+    def open_file(self, path=None, max_bytes=5 * 2 ** 20, backups=3):
+        """Запись журнала в файл с ротацией (в фоновом потоке)"""
+        import logging
+        import logging.handlers
+        self.close_file()
+        path = path or os.path.join(DATA_DIR, 'activity.log')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        log_queue = queue.Queue()
+        logger = logging.getLogger(f'security_monitor.activity.{id(self)}')
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self._listener = logging.handlers.QueueListener(log_queue, handler)
+        self._listener.start()
+        self._logger = logger
+        self.file_path = path
+        return path
+    
+    def close_file(self):
+        if self._listener is None:
+            return
+        self._listener.stop()  # Дописывает очередь и закрывает файл
+        for handler in self._listener.handlers:
+            handler.close()
+        for handler in list(self._logger.handlers):
+            self._logger.removeHandler(handler)
+        self._listener = self._logger = self.file_path = None
+    
+    def __len__(self):
+        return len(self.entries)
+
+# ==================== ВИДЖЕТЫ ====================
+
+class VirtualTable:
+    """Таблица с виртуальной прокруткой поверх ttk.Treeview.
+    
+    Полный набор данных хранится в модели (ключи по порядку и записи),
+    а в Treeview существуют только видимые строки. Значения колонок
+    форматируются только для них, и при каждом обновлении к видимому окну
+    применяется разница по ключам: вставка, изменение или удаление строк.
+    """
+    
+    ROW_HEIGHT = 20
+    HEADER_HEIGHT = 25
+    
+    def __init__(self, parent, columns, formatter, key=None, height=20, width=150, tagger=None):
+        self.formatter = formatter  # запись -> кортеж значений колонок
+        self.tagger = tagger  # запись -> тег строки (цвет) или ''
+        self.key = key or (lambda record: record)
+        self.keys = []
+        self.rows = {}
+        self.offset = 0
+        self.page_size = height
+        self._shown = {}  # iid -> значения, сейчас отображённые в Treeview
+        
+        self.tree = ttk.Treeview(parent, columns=columns, show='headings', height=height)
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=width)
+        
+        # Прокруткой управляет модель, а не Treeview
+        self.scrollbar = ttk.Scrollbar(parent, orient='vertical', command=self.on_scroll)
+        
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+        
+        self.tree.bind('<Configure>', self.on_resize)
+        self.tree.bind('<MouseWheel>', self.on_wheel)
+        self.tree.bind('<Button-4>', lambda e: self.scroll_by(-3))
+        self.tree.bind('<Button-5>', lambda e: self.scroll_by(3))
+        self.update_scrollbar()
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    # --- модель ---
+    
+    def set_data(self, records):
+        """Полная замена данных (например, новый снимок процессов)"""
+        rows = {}
+        keys = []
+        for record in records:
+            key = self.key(record)
+            if key not in rows:
+                keys.append(key)
+            rows[key] = record
+        self.keys = keys
+        self.rows = rows
+        self.clamp_offset()
+        self.render()
+    
+    def append(self, records):
+        """Добавление записей в конец; если показан хвост - следуем за ним"""
+        at_end = self.offset + self.page_size >= len(self.keys)
+        for record in records:
+            key = self.key(record)
+            if key not in self.rows:
+                self.keys.append(key)
+            self.rows[key] = record
+        if at_end:
+            self.offset = max(0, len(self.keys) - self.page_size)
+        self.render()
+    
+    def clear(self):
+        self.keys = []
+        self.rows = {}
+        self.offset = 0
+        self.render()
+    
+    def visible_records(self):
+        return [self.rows[key] for key in self.keys[self.offset:self.offset + self.page_size]]
+    
+    # --- отображение ---
+    
+    def render(self):
+        """Применение разницы между видимым окном модели и Treeview"""
+        with METRICS.profile('render'), METRICS.timer('ui.render'):
+            self._render()
+    
+    def _render(self):
+        wanted = []
+        tagger = self.tagger
+        for key in self.keys[self.offset:self.offset + self.page_size]:
+            record = self.rows[key]
+            values = tuple(self.formatter(record))
+            if tagger is not None:
+                values = (values, tagger(record) or '')
+            wanted.append((str(key), values))
+        wanted_ids = {iid for iid, _ in wanted}
+        
+        for iid in list(self._shown):
+            if iid not in wanted_ids:
+                self.tree.delete(iid)
+                del self._shown[iid]
+        
+        children = self.tree.get_children()
+        for index, (iid, values) in enumerate(wanted):
+            shown = self._shown.get(iid)
+            if shown is None:
+                self.tree.insert('', index, iid=iid, **self._item_options(values))
+                self._shown[iid] = values
+                continue
+            if shown != values:
+                self.tree.item(iid, **self._item_options(values))
+                self._shown[iid] = values
+            if index >= len(children) or children[index] != iid:
+                self.tree.move(iid, '', index)
+        
+        self.update_scrollbar()
+    
+    def _item_options(self, values):
+        if self.tagger is None:
+            return {'values': values}
+        values, tag = values
+        return {'values': values, 'tags': (tag,) if tag else ()}
+    
+    def set_tag_colors(self, colors):
+        """Цвет текста строк по тегу: {тег: цвет}"""
+        for tag, color in colors.items():
+            self.tree.tag_configure(tag, foreground=color)
+    
+    def update_scrollbar(self):
+        total = len(self.keys)
+        if total <= self.page_size:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.offset / total, (self.offset + self.page_size) / total)
+    
+    def clamp_offset(self):
+        self.offset = max(0, min(self.offset, len(self.keys) - self.page_size))
+    
+    # --- события ---
+    
+    def scroll_by(self, rows):
+        self.offset += rows
+        self.clamp_offset()
+        self.render()
+    
+    def on_scroll(self, action, value, unit=None):
+        """Команда полосы прокрутки: moveto / scroll units|pages"""
+        if action == 'moveto':
+            self.offset = int(float(value) * len(self.keys))
+            self.clamp_offset()
+            self.render()
+        elif action == 'scroll':
+            step = int(value) * (self.page_size if unit == 'pages' else 1)
+            self.scroll_by(step)
+    
+    def on_wheel(self, event):
+        self.scroll_by(-3 if event.delta > 0 else 3)
+        return 'break'
+    
+    def on_resize(self, event):
+        """Число видимых строк зависит от высоты виджета"""
+        page_size = max(1, (event.height - self.HEADER_HEIGHT) // self.ROW_HEIGHT)
+        if page_size != self.page_size:
+            self.page_size = page_size
+            self.clamp_offset()
+            self.render()
+
 # ==================== ГЛАВНОЕ ПРИЛОЖЕНИЕ ====================
 
 class SecurityMonitor:
@@ -115,9 +4377,46 @@ class SecurityMonitor:
         self.root.configure(bg='#0a1929')
         
         # Инициализация компонентов
-        self.file_scanner = BasicFileScanner()
-        self.process_monitor = BasicProcessMonitor()
+        self.rules = RuleSet()  # Общие правила для файлов, процессов и сети
+        self.file_scanner = BasicFileScanner(rules=self.rules)
+        self.process_monitor = BasicProcessMonitor(signatures=self.file_scanner.signatures, rules=self.rules)
         self.network_monitor = BasicNetworkMonitor()
+        self.connection_tracker = ConnectionTracker()
+        self.ip_blocklist = IPBlocklist()
+        self.dns_cache = ReverseDNSCache()
+        self.connection_enricher = ConnectionEnricher(self.ip_blocklist, self.dns_cache, self.rules)
+        # Уже попавшие в журнал оповещения последнего снимка (см. fresh_alerts)
+        self.blocked_reported = set()  # (адрес, запись)
+        self.process_alerts_reported = set()  # (PID, правило)
+        self.connection_alerts_reported = set()  # (ключ соединения, правило)
+        self.connection_events = deque(maxlen=1000)  # Последние события для таблицы
+        self.scan_job = None  # Текущее фоновое сканирование
+        self.scan_kind = None
+        self.export_job = None  # Текущий фоновый экспорт
+        self.extra_scan_roots = []  # Дополнительные корни полного сканирования (другие диски)
+        self.activity_log = ActivityLog()
+        # Ошибки приходят и из фоновых потоков: в журнал сразу, в окно - при опросе
+        set_error_handler(lambda message: self.activity_log.add(message, 'error'))
+        self.activity_max_lines = 1000  # Строк в окне журнала, старые удаляются
+        self.activity_flush_scheduled = False
+        self.export_status_var = tk.StringVar(value="")
+        self.file_watcher = None  # Наблюдение за папкой в реальном времени
+        self.watch_queue = queue.Queue()
+        self.watch_polling = False
+        self.watch_backend = None
+        
+        # Фоновые замеры процессов и сети (включаются на вкладках)
+        self.process_sampler = PeriodicSampler(self.process_monitor.get_processes, name='process-sampler')
+        self.network_sampler = PeriodicSampler(self.sample_connections, name='network-sampler')
+        # Интервал общий для обоих замеров: поле ввода - на вкладке процессов,
+        # а автообновление сети можно включить до её первого открытия
+        self.sample_interval_var = tk.DoubleVar(value=2.0)
+        self.history = MetricsHistory()
+        self.last_processes = None  # Последние снимки для вкладок, открытых позже
+        self.process_children = {}  # ppid -> дочерние PID из последнего снимка
+        self.last_connections = None
+        self.startup_ms = None
+        self.exit_after_startup = False
         
         # Цветовая схема
         self.colors = {
@@ -147,8 +4446,11 @@ class SecurityMonitor:
         # Инициализация интерфейса
         self.init_ui()
         
-        # Начальная загрузка данных
-        self.update_all_data()
+        # Начальная загрузка данных - один обход в фоне, без блокировки окна
+        self.process_sampler.run_once()
+        self.network_sampler.run_once()
+        self.root.after(250, self.poll_samplers)
+        self.root.bind('<Map>', self.on_first_map)
     
     def init_ui(self):
         """Инициализация интерфейса"""
@@ -163,12 +4465,51 @@ class SecurityMonitor:
         self.notebook = ttk.Notebook(main_container)
         self.notebook.pack(fill='both', expand=True, pady=10)
         
-        # Создание вкладок
-        self.create_dashboard_tab()
-        self.create_file_scanner_tab()
-        self.create_process_monitor_tab()
-        self.create_network_tab()
-        
+        # Вкладки создаются пустыми и заполняются при первом открытии;
+        # дашборд нужен сразу (в нём журнал событий)
+        self.tabs = {}
+        self.add_lazy_tab('dashboard', '📊 Дашборд', self.create_dashboard_tab)
+        self.add_lazy_tab('files', '📁 Сканер файлов', self.create_file_scanner_tab)
+        self.add_lazy_tab('processes', '🖥️ Монитор процессов', self.create_process_monitor_tab)
+        self.add_lazy_tab('network', '🌐 Сетевой монитор', self.create_network_tab)
+        self.add_lazy_tab('metrics', '📈 Метрики', self.create_metrics_tab)
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+        self.ensure_tab('dashboard')
+    
+    def add_lazy_tab(self, name, title, builder):
+        """Пустая вкладка, содержимое которой строит builder(tab) по требованию"""
+        tab = tk.Frame(self.notebook, bg=self.colors['dark_bg'])
+        self.notebook.add(tab, text=title)
+        self.tabs[name] = [tab, builder, False]
+    
+    def ensure_tab(self, name):
+        """Построение вкладки, если она ещё не построена"""
+        entry = self.tabs[name]
+        if not entry[2]:
+            entry[2] = True
+            entry[1](entry[0])
+    
+    def is_tab_built(self, name):
+        return self.tabs[name][2]
+    
+    def on_tab_changed(self, event):
+        selected = self.notebook.nametowidget(self.notebook.select())
+        for name, (tab, builder, built) in self.tabs.items():
+            if tab is selected:
+                self.ensure_tab(name)
+                break
+    
+    def on_first_map(self, event):
+        """Замер времени от запуска процесса до первого показа окна"""
+        if event.widget is not self.root:
+            return
+        self.root.unbind('<Map>')
+        self.startup_ms = (time.perf_counter() - _STARTUP_T0) * 1000
+        self.update_activity(f"Окно готово за {self.startup_ms:.0f} мс")
+        if self.exit_after_startup:
+            emit('startup', ms=round(self.startup_ms, 1))
+            self.root.after(0, self.on_closing)
+
     def create_header(self, parent):
         """Создание заголовка"""
         header = tk.Frame(parent, bg=self.colors['panel_bg'], height=80)
@@ -241,10 +4582,9 @@ class SecurityMonitor:
             )
             self.stats_labels[key].pack()
     
-    def create_dashboard_tab(self):
+    def create_dashboard_tab(self, tab):
         """Вкладка дашборда"""
-        tab = tk.Frame(self.notebook, bg=self.colors['dark_bg'])
-        self.notebook.add(tab, text='📊 Дашборд')
+        import platform
         
         # Левая панель - система
         left_frame = tk.LabelFrame(
@@ -278,6 +4618,25 @@ class SecurityMonitor:
         sys_text.insert('1.0', sys_info)
         sys_text.config(state='disabled')
         
+        # История метрик
+        tk.Label(
+            left_frame,
+            text="📈 История (среднее за последние замеры)",
+            font=('Arial', 10, 'bold'),
+            fg=self.colors['text'],
+            bg=self.colors['panel_bg']
+        ).pack(anchor='w', pady=(10, 2))
+        
+        self.history_text = scrolledtext.ScrolledText(
+            left_frame,
+            height=14,
+            font=('Consolas', 9),
+            bg='#1a1a1a',
+            fg='white'
+        )
+        self.history_text.pack(fill='both', expand=True)
+        self.history_text.config(state='disabled')
+        
         # Правая панель - активность
         right_frame = tk.LabelFrame(
             tab,
@@ -290,6 +4649,40 @@ class SecurityMonitor:
         )
         right_frame.pack(side='right', fill='both', expand=True, padx=5, pady=5)
         
+        filter_frame = tk.Frame(right_frame, bg=self.colors['panel_bg'])
+        filter_frame.pack(fill='x', pady=(0, 5))
+        
+        tk.Label(
+            filter_frame,
+            text="Важность от:",
+            font=('Arial', 9),
+            fg=self.colors['text'],
+            bg=self.colors['panel_bg']
+        ).pack(side='left', padx=5)
+        
+        self.activity_severity_var = tk.StringVar(value='info')
+        severity_box = ttk.Combobox(
+            filter_frame,
+            textvariable=self.activity_severity_var,
+            values=SEVERITIES,
+            state='readonly',
+            width=8
+        )
+        severity_box.pack(side='left', padx=5)
+        severity_box.bind('<<ComboboxSelected>>', lambda event: self.apply_activity_filter())
+        
+        self.activity_file_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            filter_frame,
+            text="📝 Журнал в файл",
+            variable=self.activity_file_var,
+            command=self.toggle_activity_file,
+            bg=self.colors['panel_bg'],
+            fg=self.colors['text'],
+            selectcolor=self.colors['dark_bg'],
+            font=('Arial', 9)
+        ).pack(side='left', padx=10)
+        
         self.activity_text = scrolledtext.ScrolledText(
             right_frame,
             height=25,
@@ -303,10 +4696,8 @@ class SecurityMonitor:
         # Начальное сообщение
         self.update_activity("Система запущена")
     
-    def create_file_scanner_tab(self):
+    def create_file_scanner_tab(self, tab):
         """Вкладка сканирования файлов"""
-        tab = tk.Frame(self.notebook, bg=self.colors['dark_bg'])
-        self.notebook.add(tab, text='📁 Сканер файлов')
         
         # Управление
         control_frame = tk.LabelFrame(
@@ -332,7 +4723,7 @@ class SecurityMonitor:
             bg=self.colors['panel_bg']
         ).pack(side='left', padx=5)
         
-        self.scan_path_var = tk.StringVar(value=os.path.expanduser('~\\Downloads'))
+        self.scan_path_var = tk.StringVar(value=DOWNLOADS_DIR)
         path_entry = tk.Entry(
             path_frame,
             textvariable=self.scan_path_var,
@@ -375,6 +4766,54 @@ class SecurityMonitor:
             padx=20
         ).pack(side='left', padx=5)
         
+        tk.Button(
+            button_frame,
+            text="➕ Корень",
+            command=self.add_full_scan_root,
+            bg=self.colors['info'],
+            fg='white',
+            font=('Arial', 10),
+            padx=10
+        ).pack(side='left', padx=5)
+        
+        tk.Button(
+            button_frame,
+            text="⏹ Отмена",
+            command=self.cancel_scan_action,
+            bg=self.colors['danger'],
+            fg='white',
+            font=('Arial', 10),
+            padx=20
+        ).pack(side='left', padx=5)
+        
+        self.watch_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            button_frame,
+            text="👁 Наблюдение за папкой",
+            variable=self.watch_var,
+            command=self.toggle_watch_action,
+            bg=self.colors['panel_bg'],
+            fg=self.colors['text'],
+            selectcolor=self.colors['dark_bg'],
+            font=('Arial', 10)
+        ).pack(side='left', padx=10)
+        
+        # Прогресс сканирования
+        progress_frame = tk.Frame(control_frame, bg=self.colors['panel_bg'])
+        progress_frame.pack(fill='x', pady=5)
+        
+        self.scan_progress = ttk.Progressbar(progress_frame, mode='indeterminate', length=300)
+        self.scan_progress.pack(side='left', padx=5)
+        
+        self.scan_progress_var = tk.StringVar(value="Сканирование не запущено")
+        tk.Label(
+            progress_frame,
+            textvariable=self.scan_progress_var,
+            font=('Arial', 9),
+            fg=self.colors['text'],
+            bg=self.colors['panel_bg']
+        ).pack(side='left', padx=10)
+        
         # Результаты
         results_frame = tk.LabelFrame(
             tab,
@@ -389,17 +4828,11 @@ class SecurityMonitor:
         
         # Таблица результатов
         columns = ('Файл', 'Тип', 'Статус', 'Время')
-        self.scan_tree = ttk.Treeview(results_frame, columns=columns, show='headings', height=15)
-        
-        for col in columns:
-            self.scan_tree.heading(col, text=col)
-            self.scan_tree.column(col, width=150)
-        
-        scrollbar = ttk.Scrollbar(results_frame, orient='vertical', command=self.scan_tree.yview)
-        self.scan_tree.configure(yscrollcommand=scrollbar.set)
-        
-        self.scan_tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
+        self.scan_table = VirtualTable(
+            results_frame, columns, self.format_threat_row,
+            key=ScanResultStore.key, height=15, tagger=lambda threat: threat.level
+        )
+        self.scan_table.set_tag_colors(self.severity_colors())
         
         # Кнопки управления
         manage_frame = tk.Frame(results_frame, bg=self.colors['panel_bg'])
@@ -416,17 +4849,41 @@ class SecurityMonitor:
         
         tk.Button(
             manage_frame,
-            text="💾 Экспорт в CSV",
+            text="💾 Экспорт",
             command=self.export_scan_results,
             bg=self.colors['success'],
             fg='white',
             font=('Arial', 9)
         ).pack(side='left', padx=2)
+        
+        tk.Button(
+            manage_frame,
+            text="📚 Загрузить сигнатуры",
+            command=self.load_signatures_action,
+            bg=self.colors['info'],
+            fg='white',
+            font=('Arial', 9)
+        ).pack(side='left', padx=2)
+        
+        tk.Button(
+            manage_frame,
+            text="📜 Правила",
+            command=self.load_rules_action,
+            bg=self.colors['info'],
+            fg='white',
+            font=('Arial', 9)
+        ).pack(side='left', padx=2)
+        
+        tk.Label(
+            manage_frame,
+            textvariable=self.export_status_var,
+            font=('Arial', 9),
+            fg=self.colors['text'],
+            bg=self.colors['panel_bg']
+        ).pack(side='left', padx=10)
     
-    def create_process_monitor_tab(self):
+    def create_process_monitor_tab(self, tab):
         """Вкладка процессов"""
-        tab = tk.Frame(self.notebook, bg=self.colors['dark_bg'])
-        self.notebook.add(tab, text='🖥️ Монитор процессов')
         
         # Управление
         control_frame = tk.LabelFrame(
@@ -450,6 +4907,54 @@ class SecurityMonitor:
             padx=15
         ).pack(side='left', padx=5)
         
+        self.process_live_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="⏱ Автообновление",
+            variable=self.process_live_var,
+            command=lambda: self.toggle_sampler(self.process_sampler, self.process_live_var),
+            bg=self.colors['panel_bg'],
+            fg=self.colors['text'],
+            selectcolor=self.colors['dark_bg'],
+            font=('Arial', 10)
+        ).pack(side='left', padx=10)
+        
+        tk.Label(
+            control_frame,
+            text="Интервал, с:",
+            font=('Arial', 9),
+            fg=self.colors['text'],
+            bg=self.colors['panel_bg']
+        ).pack(side='left', padx=5)
+        
+        tk.Spinbox(
+            control_frame,
+            from_=0.5,
+            to=60,
+            increment=0.5,
+            width=5,
+            textvariable=self.sample_interval_var,
+            command=self.apply_sample_interval
+        ).pack(side='left', padx=5)
+        
+        tk.Button(
+            control_frame,
+            text="💾 Экспорт",
+            command=lambda: self.export_snapshot('processes', self.last_processes),
+            bg=self.colors['success'],
+            fg='white',
+            font=('Arial', 10),
+            padx=15
+        ).pack(side='left', padx=5)
+        
+        tk.Label(
+            control_frame,
+            textvariable=self.export_status_var,
+            font=('Arial', 9),
+            fg=self.colors['text'],
+            bg=self.colors['panel_bg']
+        ).pack(side='left', padx=10)
+        
         # Таблица процессов
         table_frame = tk.LabelFrame(
             tab,
@@ -462,26 +4967,20 @@ class SecurityMonitor:
         )
         table_frame.pack(fill='both', expand=True, padx=10, pady=10)
         
-        columns = ('PID', 'Имя', 'CPU %', 'Память %')
-        self.process_tree = ttk.Treeview(table_frame, columns=columns, show='headings', height=20)
-        
-        for col in columns:
-            self.process_tree.heading(col, text=col)
-            self.process_tree.column(col, width=120)
-        
-        scrollbar = ttk.Scrollbar(table_frame, orient='vertical', command=self.process_tree.yview)
-        self.process_tree.configure(yscrollcommand=scrollbar.set)
-        
-        self.process_tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
+        columns = ('PID', 'PPID', 'Имя', 'CPU %', 'Память %', 'Потомков', 'Угроза')
+        self.process_table = VirtualTable(
+            table_frame, columns, self.format_process_row,
+            key=lambda proc: proc.pid, height=20, width=120,
+            tagger=lambda proc: 'critical' if proc.threat else proc.severity
+        )
+        self.process_table.set_tag_colors(self.severity_colors())
         
-        # Инициализация процессов
-        self.update_processes()
+        # Заполнение последним снимком (без повторного обхода процессов)
+        if self.last_processes is not None:
+            self.process_table.set_data(self.last_processes)
     
-    def create_network_tab(self):
+    def create_network_tab(self, tab):
         """Вкладка сети"""
-        tab = tk.Frame(self.notebook, bg=self.colors['dark_bg'])
-        self.notebook.add(tab, text='🌐 Сетевой монитор')
         
         # Управление
         control_frame = tk.LabelFrame(
@@ -505,6 +5004,38 @@ class SecurityMonitor:
             padx=15
         ).pack(side='left', padx=5)
         
+        tk.Button(
+            control_frame,
+            text="📂 Загрузить блок-лист",
+            command=self.load_blocklist_action,
+            bg=self.colors['warning'],
+            fg='white',
+            font=('Arial', 10),
+            padx=15
+        ).pack(side='left', padx=5)
+        
+        tk.Button(
+            control_frame,
+            text="💾 Экспорт",
+            command=lambda: self.export_snapshot('connections', self.last_connections),
+            bg=self.colors['success'],
+            fg='white',
+            font=('Arial', 10),
+            padx=15
+        ).pack(side='left', padx=5)
+        
+        self.network_live_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="⏱ Автообновление",
+            variable=self.network_live_var,
+            command=lambda: self.toggle_sampler(self.network_sampler, self.network_live_var),
+            bg=self.colors['panel_bg'],
+            fg=self.colors['text'],
+            selectcolor=self.colors['dark_bg'],
+            font=('Arial', 10)
+        ).pack(side='left', padx=10)
+        
         # Таблица соединений
         table_frame = tk.LabelFrame(
             tab,
@@ -517,110 +5048,384 @@ class SecurityMonitor:
         )
         table_frame.pack(fill='both', expand=True, padx=10, pady=10)
         
-        columns = ('PID', 'Локальный адрес', 'Удаленный адрес', 'Статус')
-        self.network_tree = ttk.Treeview(table_frame, columns=columns, show='headings', height=20)
+        columns = ('PID', 'Процесс', 'Локальный адрес', 'Удаленный адрес', 'Хост', 'Статус', 'Блок-лист', 'Правило')
+        self.network_table = VirtualTable(
+            table_frame, columns, self.format_connection_row,
+            key=lambda conn: conn.key, height=20,
+            tagger=lambda conn: 'high' if conn.blocked and not conn.severity else conn.severity
+        )
+        self.network_table.set_tag_colors(self.severity_colors())
         
-        for col in columns:
-            self.network_tree.heading(col, text=col)
-            self.network_tree.column(col, width=150)
+        # Заполнение последним снимком
+        if self.last_connections is not None:
+            self.network_table.set_data(self.last_connections)
+        
+        # События соединений (появление, закрытие, смена статуса)
+        events_frame = tk.LabelFrame(
+            tab,
+            text="🔔 События соединений",
+            font=('Arial', 11, 'bold'),
+            bg=self.colors['panel_bg'],
+            fg=self.colors['text'],
+            padx=15,
+            pady=15
+        )
+        events_frame.pack(fill='both', expand=False, padx=10, pady=(0, 10))
         
-        scrollbar = ttk.Scrollbar(table_frame, orient='vertical', command=self.network_tree.yview)
-        self.network_tree.configure(yscrollcommand=scrollbar.set)
+        columns = ('Время', 'Событие', 'PID', 'Удаленный адрес', 'Статус', 'Длительность, с')
+        self.connection_events_table = VirtualTable(
+            events_frame, columns, self.format_connection_event_row,
+            key=lambda event: (event.timestamp, event.kind, event.connection.key), height=8
+        )
+        self.connection_events_table.set_data(list(self.connection_events))
+    
+    def create_metrics_tab(self, tab):
+        """Вкладка метрик и профилирования"""
         
-        self.network_tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
+        # Управление
+        control_frame = tk.LabelFrame(
+            tab,
+            text="📈 Сбор метрик",
+            font=('Arial', 11, 'bold'),
+            bg=self.colors['panel_bg'],
+            fg=self.colors['text'],
+            padx=15,
+            pady=15
+        )
+        control_frame.pack(fill='x', padx=10, pady=10)
         
-        # Инициализация сети
-        self.update_network()
+        self.metrics_enabled_var = tk.BooleanVar(value=METRICS.enabled)
+        tk.Checkbutton(
+            control_frame,
+            text="⏱ Замер времени и счётчики",
+            variable=self.metrics_enabled_var,
+            command=self.toggle_metrics,
+            bg=self.colors['panel_bg'],
+            fg=self.colors['text'],
+            selectcolor=self.colors['dark_bg'],
+            font=('Arial', 10)
+        ).pack(side='left', padx=10)
+        
+        tk.Button(
+            control_frame,
+            text="🗑️ Сбросить",
+            command=self.reset_metrics,
+            bg=self.colors['danger'],
+            fg='white',
+            font=('Arial', 10),
+            padx=15
+        ).pack(side='left', padx=5)
+        
+        tk.Button(
+            control_frame,
+            text="💾 Сохранить",
+            command=self.save_metrics_action,
+            bg=self.colors['success'],
+            fg='white',
+            font=('Arial', 10),
+            padx=15
+        ).pack(side='left', padx=5)
+        
+        tk.Label(
+            control_frame,
+            text="Профилирование:",
+            font=('Arial', 9),
+            fg=self.colors['text'],
+            bg=self.colors['panel_bg']
+        ).pack(side='left', padx=(20, 5))
+        
+        self.profile_operation_var = tk.StringVar(value=PROFILE_OPERATIONS[0])
+        operation_box = ttk.Combobox(
+            control_frame,
+            textvariable=self.profile_operation_var,
+            values=PROFILE_OPERATIONS,
+            state='readonly',
+            width=12
+        )
+        operation_box.pack(side='left', padx=5)
+        operation_box.bind('<<ComboboxSelected>>', lambda event: self.profile_var.set(
+            self.profile_operation_var.get() in METRICS.profiled
+        ))
+        
+        self.profile_var = tk.BooleanVar(value=PROFILE_OPERATIONS[0] in METRICS.profiled)
+        tk.Checkbutton(
+            control_frame,
+            text="cProfile",
+            variable=self.profile_var,
+            command=self.toggle_profiling,
+            bg=self.colors['panel_bg'],
+            fg=self.colors['text'],
+            selectcolor=self.colors['dark_bg'],
+            font=('Arial', 10)
+        ).pack(side='left', padx=5)
+        
+        tk.Button(
+            control_frame,
+            text="📋 Показать профиль",
+            command=self.show_profile,
+            bg=self.colors['primary'],
+            fg='white',
+            font=('Arial', 10),
+            padx=15
+        ).pack(side='left', padx=5)
+        
+        # Таблица метрик
+        table_frame = tk.LabelFrame(
+            tab,
+            text="📋 Горячие участки",
+            font=('Arial', 11, 'bold'),
+            bg=self.colors['panel_bg'],
+            fg=self.colors['text'],
+            padx=15,
+            pady=15
+        )
+        table_frame.pack(fill='both', expand=True, padx=10, pady=10)
+        
+        columns = ('Метрика', 'Вызовов', 'Всего, мс', 'Среднее, мс', 'Макс, мс')
+        self.metrics_table = VirtualTable(
+            table_frame, columns, lambda row: row, key=lambda row: row[0], height=12
+        )
+        
+        self.profile_text = scrolledtext.ScrolledText(
+            tab,
+            height=12,
+            font=('Consolas', 9),
+            bg='#1a1a1a',
+            fg='white'
+        )
+        self.profile_text.pack(fill='both', expand=True, padx=10, pady=(0, 10))
+        
+        self.refresh_metrics()
     
     # ==================== ОСНОВНЫЕ МЕТОДЫ ====================
     
     def quick_scan_action(self):
         """Быстрое сканирование"""
+        self.ensure_tab('files')
+        path = self.scan_path_var.get()
+        if self.start_scan_job('quick', [path]):
+            self.update_activity(f"Начинаю быстрое сканирование: {path}")
+    
+    def full_scan_action(self):
+        """Полное сканирование"""
+        self.ensure_tab('files')
+        # Сканирование основных директорий
+        scan_paths = [
+            DOWNLOADS_DIR,
+            os.path.join(os.path.expanduser('~'), 'Desktop'),
+            os.path.join(os.path.expanduser('~'), 'Documents')
+        ] + self.extra_scan_roots
+        
+        # Корни на разных устройствах сканируются одновременно
+        devices = ScanJob.group_roots(scan_paths)
+        if self.start_scan_job('full', scan_paths):
+            self.update_activity(
+                f"Начинаю полное сканирование системы: корней {sum(map(len, devices.values()))}, устройств {len(devices)}"
+            )
+    
+    def add_full_scan_root(self):
+        """Добавление корня (например, другого диска) в полное сканирование"""
+        path = filedialog.askdirectory(title="Добавить корень полного сканирования")
+        if path and path not in self.extra_scan_roots:
+            self.extra_scan_roots.append(path)
+            self.update_activity(f"Корень полного сканирования добавлен: {path}")
+    
+    def cancel_scan_action(self):
+        """Отмена текущего сканирования"""
+        if self.scan_job and self.scan_job.is_running():
+            self.scan_job.cancel()
+            self.scan_progress_var.set("Отмена сканирования...")
+            self.update_activity("Запрошена отмена сканирования")
+    
+    def toggle_watch_action(self):
+        """Включение/выключение наблюдения за папкой сканирования"""
+        if self.file_watcher is not None:
+            self.file_watcher.stop()
+            self.file_watcher = None
+        
+        if not self.watch_var.get():
+            self.update_activity("Наблюдение за папкой выключено")
+            return
+        
         path = self.scan_path_var.get()
-        self.update_activity(f"Начинаю быстрое сканирование: {path}")
+        if not os.path.isdir(path):
+            self.watch_var.set(False)
+            messagebox.showerror("Наблюдение", f"Папка не найдена: {path}")
+            return
         
-        # Сканируем
-        new_threats = self.file_scanner.quick_scan(path)
+        self.file_watcher = FileWatcher([path], self.on_watched_files, walker=self.file_scanner.walker)
+        self.file_watcher.start()
+        self.watch_backend = None
+        self.update_activity(f"Наблюдение за папкой включено: {path}")
+        if not self.watch_polling:
+            self.watch_polling = True
+            self.root.after(250, self.poll_watch)
+    
+    def on_watched_files(self, paths):
+        """Проверка изменившихся файлов (в потоке наблюдателя)"""
+        new_threats = self.file_scanner.check_paths(paths)
+        self.watch_queue.put((len(paths), new_threats))
+    
+    def poll_watch(self):
+        """Перенос результатов наблюдения в интерфейс"""
+        watcher = self.file_watcher
+        checked = 0
+        new_threats = []
+        while True:
+            try:
+                count, threats = self.watch_queue.get_nowait()
+            except queue.Empty:
+                break
+            checked += count
+            new_threats.extend(threats)
         
-        # Обновляем статистику (реальные данные)
-        self.stats['files_scanned'] = len(self.file_scanner.unique_files_scanned)
-        self.stats['threats_found'] = len(self.file_scanner.scan_results)
+        if checked:
+            self.stats['files_scanned'] = len(self.file_scanner.unique_files_scanned)
+            self.stats['threats_found'] = len(self.file_scanner.scan_results)
+            self.update_scan_results()
+            self.update_stats_display()
+            self.update_activity(f"Наблюдение: проверено файлов {checked}, новых угроз {len(new_threats)}")
+            for threat in new_threats[:10]:
+                self.update_activity(f"{threat.file}: {threat.reason}", 'warning')
         
-        # Обновление таблицы
-        self.update_scan_results(new_threats)
+        if watcher is None:
+            self.watch_polling = False
+            return
+        if watcher.last_error:
+            self.update_activity(f"Наблюдение: {watcher.last_error}", 'error')
+            watcher.last_error = None
+        if watcher.backend != self.watch_backend:
+            self.watch_backend = watcher.backend
+            self.update_activity(f"Режим наблюдения: {watcher.backend}")
+        self.root.after(250, self.poll_watch)
+    
+    def start_scan_job(self, kind, paths):
+        """Запуск фонового сканирования"""
+        if self.scan_job and self.scan_job.is_running():
+            messagebox.showinfo("Сканирование", "Сканирование уже выполняется")
+            return False
         
-        # Обновление активности
-        self.update_activity(f"Сканирование завершено. Найдено новых угроз: {len(new_threats)}")
-        self.update_stats_display()
+        self.scan_kind = kind
+        self.scan_job = ScanJob(self.file_scanner, paths)
+        self.scan_job.start()
         
-        if new_threats:
-            messagebox.showwarning("Результаты", f"Найдено {len(new_threats)} новых угроз. Всего угроз в базе: {self.stats['threats_found']}")
-        else:
-            messagebox.showinfo("Результаты", "Новых угроз не найдено")
+        self.scan_progress.start(10)
+        self.scan_progress_var.set("Просканировано файлов: 0")
+        self.root.after(100, self.poll_scan_job)
+        return True
     
-    def full_scan_action(self):
-        """Полное сканирование"""
-        self.update_activity("Начинаю полное сканирование системы...")
+    def poll_scan_job(self):
+        """Опрос очереди фонового сканирования (в потоке интерфейса)"""
+        job = self.scan_job
+        got_threats = False
         
-        # Сканирование основных директорий
-        scan_paths = [
-            os.path.expanduser('~\\Downloads'),
-            os.path.expanduser('~\\Desktop'),
-            os.path.expanduser('~\\Documents')
-        ]
+        # Ограничиваем число сообщений за один тик, чтобы не блокировать окно
+        for _ in range(200):
+            try:
+                message = job.queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            kind = message[0]
+            if kind == 'progress':
+                self.scan_progress_var.set(f"Просканировано файлов: {message[1]}, угроз: {len(job.threats)}")
+                got_threats = got_threats or bool(message[2])
+                for threat in message[2]:
+                    self.update_activity(f"{threat.file}: {threat.reason}", 'warning')
+            elif kind == 'done':
+                self.finish_scan_job(cancelled=message[1])
+                return
+            elif kind == 'error':
+                self.scan_progress.stop()
+                self.scan_progress_var.set("Ошибка сканирования")
+                self.update_activity(f"Ошибка сканирования: {message[1]}", 'error')
+                return
+        
+        if got_threats:
+            self.update_scan_results()
+        
+        self.root.after(100, self.poll_scan_job)
+    
+    def report_large_files(self):
+        """Итоги по большим файлам: сколько проверено выборочно и пропущено"""
+        report = self.file_scanner.content_report
+        titles = {'sampled': "Проверено выборочно (начало и конец)", 'skipped': "Пропущено без чтения содержимого"}
+        for action, totals in sorted(report.summary().items()):
+            self.update_activity(
+                f"{titles[action]}: файлов {totals['files']}, {totals['bytes'] / 2 ** 30:.1f} ГБ"
+            )
+        for path, size, action, reason in report.items:
+            self.update_activity(f"{path}: {titles[action].lower()} ({reason}, {size / 2 ** 20:.0f} МБ)", 'debug')
+    
+    def finish_scan_job(self, cancelled):
+        """Завершение фонового сканирования"""
+        job = self.scan_job
+        new_threats = job.threats
         
-        all_new_threats = []
-        for path in scan_paths:
-            new_threats = self.file_scanner.quick_scan(path)
-            all_new_threats.extend(new_threats)
+        self.scan_progress.stop()
+        self.scan_progress_var.set(
+            f"{'Отменено' if cancelled else 'Завершено'}: файлов {job.files_done}, угроз {len(new_threats)}"
+        )
         
-        # Обновляем реальную статистику
+        # Обновляем статистику (реальные данные)
         self.stats['files_scanned'] = len(self.file_scanner.unique_files_scanned)
         self.stats['threats_found'] = len(self.file_scanner.scan_results)
         
         # Обновление таблицы
-        self.update_scan_results(all_new_threats)
-        
-        # Обновление активности
-        self.update_activity(f"Полное сканирование завершено. Найдено новых угроз: {len(all_new_threats)}")
+        self.update_scan_results()
         self.update_stats_display()
         
-        messagebox.showinfo(
-            "Сканирование завершено", 
-            f"Всего просканировано файлов: {self.stats['files_scanned']}\n"
-            f"Всего угроз в базе: {self.stats['threats_found']}\n"
-            f"Новых угроз в этом сканировании: {len(all_new_threats)}"
-        )
-    
-    def update_scan_results(self, threats):
-        """Обновление результатов сканирования"""
-        # Очистка таблицы
-        for item in self.scan_tree.get_children():
-            self.scan_tree.delete(item)
+        if job.files_unchanged:
+            self.update_activity(f"Без изменений с прошлого сканирования (пропущено): {job.files_unchanged}", 'debug')
+        if self.file_scanner.match_seconds:
+            self.update_activity(f"Поиск байтовых сигнатур: {self.file_scanner.match_throughput:.1f} МБ/с", 'debug')
+        self.report_large_files()
         
-        # Показываем последние 50 угроз
-        recent_threats = self.file_scanner.scan_results[-50:] if len(self.file_scanner.scan_results) > 50 else self.file_scanner.scan_results
+        if cancelled:
+            self.update_activity(f"Сканирование отменено. Найдено новых угроз: {len(new_threats)}")
+            return
         
-        for threat in recent_threats:
-            file_path = threat.get('file', '')
-            file_name = os.path.basename(file_path) if file_path else 'Неизвестно'
-            
-            self.scan_tree.insert('', 'end', values=(
-                file_name[:40] + '...' if len(file_name) > 40 else file_name,
-                threat.get('type', 'ФАЙЛ'),
-                threat.get('reason', 'Подозрительный файл'),
-                threat.get('timestamp', datetime.now()).strftime('%H:%M:%S')
-            ))
+        if self.scan_kind == 'full':
+            self.update_activity(f"Полное сканирование завершено. Найдено новых угроз: {len(new_threats)}")
+            messagebox.showinfo(
+                "Сканирование завершено", 
+                f"Всего просканировано файлов: {self.stats['files_scanned']}\n"
+                f"Всего угроз в базе: {self.stats['threats_found']}\n"
+                f"Новых угроз в этом сканировании: {len(new_threats)}"
+            )
+        else:
+            self.update_activity(f"Сканирование завершено. Найдено новых угроз: {len(new_threats)}")
+            if new_threats:
+                messagebox.showwarning("Результаты", f"Найдено {len(new_threats)} новых угроз. Всего угроз в базе: {self.stats['threats_found']}")
+            else:
+                messagebox.showinfo("Результаты", "Новых угроз не найдено")
+    
+    def update_scan_results(self):
+        """Обновление результатов сканирования"""
+        # Хранилище только пополняется, поэтому в таблицу дописываем хвост
+        store = self.file_scanner.scan_results
+        shown = len(self.scan_table)
+        if len(store) > shown:
+            self.scan_table.append(store.page(shown, len(store) - shown))
+    
+    def format_threat_row(self, threat):
+        file_name = os.path.basename(threat.file) if threat.file else 'Неизвестно'
+        return (
+            file_name[:40] + '...' if len(file_name) > 40 else file_name,
+            threat.type,
+            threat.reason,
+            threat.time.strftime('%H:%M:%S')
+        )
     
     def clear_scan_results(self):
         """Очистка результатов сканирования"""
+        if self.scan_job and self.scan_job.is_running():
+            messagebox.showinfo("Очистка", "Дождитесь окончания или отмените сканирование")
+            return
+        
         if messagebox.askyesno("Подтверждение", "Очистить все результаты сканирования?"):
-            for item in self.scan_tree.get_children():
-                self.scan_tree.delete(item)
-            
-            self.file_scanner.scan_results.clear()
-            self.file_scanner.unique_files_scanned.clear()
+            self.scan_table.clear()
+            self.file_scanner.clear()
             
             # Сбрасываем статистику
             self.stats['files_scanned'] = 0
@@ -632,83 +5437,341 @@ class SecurityMonitor:
     
     def export_scan_results(self):
         """Экспорт результатов сканирования"""
-        if not self.file_scanner.scan_results:
+        store = self.file_scanner.scan_results
+        if not store:
+            messagebox.showinfo("Экспорт", "Нет данных для экспорта")
+            return
+        self.start_export('threats', store.chunks(ExportJob.CHUNK_SIZE), len(store))
+    
+    def export_snapshot(self, kind, records):
+        """Экспорт последнего снимка процессов или соединений"""
+        if not records:
             messagebox.showinfo("Экспорт", "Нет данных для экспорта")
             return
+        records = list(records)  # Снимок может смениться во время экспорта
+        self.start_export(kind, chunked(records, ExportJob.CHUNK_SIZE), len(records))
+    
+    def start_export(self, kind, chunks, total):
+        """Выбор файла и запуск фонового экспорта"""
+        if self.export_job and self.export_job.is_running():
+            messagebox.showinfo("Экспорт", "Экспорт уже выполняется")
+            return
         
         file_path = filedialog.asksaveasfilename(
             defaultextension=".csv",
-            filetypes=[("CSV файлы", "*.csv"), ("Все файлы", "*.*")]
+            filetypes=[
+                ("CSV файлы", "*.csv"),
+                ("JSON Lines", "*.jsonl"),
+                ("Колоночный формат", "*.smc"),
+                ("Все файлы", "*.*")
+            ]
         )
+        if not file_path:
+            return
         
-        if file_path:
+        self.export_job = ExportJob(kind, chunks, file_path, total=total)
+        self.export_job.start()
+        self.export_status_var.set(f"Экспорт: 0 из {total}")
+        self.root.after(100, self.poll_export_job)
+    
+    def poll_export_job(self):
+        """Опрос очереди фонового экспорта (в потоке интерфейса)"""
+        job = self.export_job
+        while True:
             try:
-                with open(file_path, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(['Файл', 'Тип', 'Причина', 'Время', 'Статус'])
-                    
-                    for threat in self.file_scanner.scan_results:
-                        writer.writerow([
-                            threat.get('file', ''),
-                            threat.get('type', ''),
-                            threat.get('reason', ''),
-                            threat.get('timestamp', datetime.now()).strftime('%Y-%m-%d %H:%M:%S'),
-                            'Обнаружено'
-                        ])
-                
-                self.update_activity(f"Экспортировано {len(self.file_scanner.scan_results)} записей в {file_path}")
-                messagebox.showinfo("Экспорт", f"Сохранено {len(self.file_scanner.scan_results)} записей")
-                
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось экспортировать: {e}")
+                message = job.queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            kind = message[0]
+            if kind == 'progress':
+                self.export_status_var.set(f"Экспорт: {message[1]} из {message[2]}")
+            elif kind == 'done':
+                self.export_status_var.set(f"Экспортировано: {message[1]}")
+                self.update_activity(f"Экспортировано {message[1]} записей в {job.path} ({job.fmt})")
+                return
+            elif kind == 'error':
+                self.export_status_var.set("Ошибка экспорта")
+                messagebox.showerror("Ошибка", f"Не удалось экспортировать: {message[1]}")
+                return
+        
+        self.root.after(100, self.poll_export_job)
     
     def update_processes(self):
-        """Обновление списка процессов"""
-        # Очистка таблицы
-        for item in self.process_tree.get_children():
-            self.process_tree.delete(item)
+        """Обновление списка процессов: замер в фоне, показ - в poll_samplers"""
+        self.process_sampler.run_once()
+    
+    def show_processes(self, processes):
+        """Показ снимка процессов (помеченные и самые загруженные сверху)"""
+        self.stats['processes'] = len(processes)
+        self.process_children = BasicProcessMonitor.build_tree(processes)
         
-        try:
-            processes = self.process_monitor.get_processes()
-            self.stats['processes'] = len(processes)
-            
-            # Показываем первые 100 процессов
-            for proc in processes[:100]:
-                self.process_tree.insert('', 'end', values=(
-                    proc.get('pid', ''),
-                    proc.get('name', '')[:20],
-                    f"{proc.get('cpu', 0):.1f}",
-                    f"{proc.get('memory', 0):.1f}"
-                ))
-            
-            self.update_stats_display()
-            
-        except Exception as e:
-            self.update_activity(f"Ошибка обновления процессов: {e}")
+        # Процессы из файлов с сигнатурой попадают и в результаты сканера
+        flagged = [ThreatRecord(proc.exe, 'HASH', proc.threat) for proc in processes if proc.threat]
+        new_threats = self.file_scanner.add_results(flagged) if flagged else []
+        if new_threats:
+            for threat in new_threats:
+                self.update_activity(f"Запущен процесс из файла с сигнатурой: {threat.file} ({threat.detail})", 'warning')
+            self.stats['threats_found'] = len(self.file_scanner.scan_results)
+            if self.is_tab_built('files'):
+                self.update_scan_results()
+        
+        alerts = {(proc.pid, proc.rule): proc for proc in processes if proc.rule}
+        for proc in fresh_alerts(self.process_alerts_reported, alerts):
+            self.update_activity(f"Процесс {proc.name} ({proc.pid}): правило {proc.rule}", self.alert_severity(proc.severity))
+        
+        # Таблица показывает все процессы, отрисовываются только видимые
+        processes.sort(key=lambda proc: (proc.threat is not None, proc.severity is not None, proc.cpu), reverse=True)
+        self.last_processes = processes
+        if self.is_tab_built('processes'):
+            self.process_table.set_data(processes)
+        
+        self.history.record_processes(processes)
+        self.update_history_display()
+        self.update_stats_display()
+    
+    def severity_colors(self):
+        """Цвета строк таблиц по уровню угрозы"""
+        return {severity: self.colors[severity] for severity in RULE_SEVERITIES}
+    
+    @staticmethod
+    def alert_severity(severity):
+        """Уровень записи журнала для сработавшего правила"""
+        return 'warning' if severity in ('critical', 'high') else 'info'
+    
+    def format_process_row(self, proc):
+        return (
+            proc.pid, proc.ppid if proc.ppid is not None else '', proc.name[:20],
+            f"{proc.cpu:.1f}", f"{proc.memory:.1f}",
+            len(self.process_children.get(proc.pid, ())), proc.threat or proc.rule or ''
+        )
     
     def update_network(self):
-        """Обновление сетевых соединений"""
-        # Очистка таблицы
-        for item in self.network_tree.get_children():
-            self.network_tree.delete(item)
+        """Обновление сетевых соединений: замер в фоне, показ - в poll_samplers"""
+        self.network_sampler.run_once()
+    
+    def sample_connections(self):
+        """Снимок соединений и сравнение с предыдущим (в фоновом потоке)"""
+        connections = self.network_monitor.get_connections()
+        self.connection_enricher.enrich(connections, self.process_monitor.names())
+        self.connection_tracker.update(connections)
+        return connections
+    
+    def show_connections(self, connections):
+        """Показ снимка сетевых соединений"""
+        self.stats['connections'] = len(connections)
+        self.last_connections = connections
+        blocked = {(conn.raddr[0], conn.blocked): conn for conn in connections if conn.blocked}
+        for conn in fresh_alerts(self.blocked_reported, blocked):
+            self.update_activity(
+                f"Соединение с адресом из блок-листа: {conn.remote} ({conn.blocked}), "
+                f"процесс {conn.process or conn.pid}",
+                'warning'
+            )
+        alerts = {(conn.key, conn.rule): conn for conn in connections if conn.rule}
+        for conn in fresh_alerts(self.connection_alerts_reported, alerts):
+            self.update_activity(
+                f"Соединение {conn.local} → {conn.remote or '-'} ({conn.process or conn.pid}): правило {conn.rule}",
+                self.alert_severity(conn.severity)
+            )
+        connections.sort(key=lambda conn: (conn.blocked is None, SEVERITY_ORDER.get(conn.severity, len(SEVERITY_ORDER))))
+        
+        events = self.connection_tracker.take_events()
+        # Новые события сверху
+        self.connection_events.extendleft(events)
+        if self.is_tab_built('network'):
+            self.network_table.set_data(connections)
+            if events:
+                self.connection_events_table.set_data(list(self.connection_events))
+        self.history.record_connections(connections)
+        self.update_history_display()
+        self.update_stats_display()
+    
+    def update_history_display(self):
+        """Сводка истории метрик на дашборде"""
+        history = self.history
+        lines = [f"Замеров процессов: {history.ticks}, рядов: {len(history.series)}", ""]
+        
+        lines.append("Top CPU %:")
+        for pid, value in history.top('cpu', 5):
+            lines.append(f"  {pid:>7}  {history.label('cpu', pid)[:24]:<24} {value:6.1f}")
         
+        lines.append("Top память %:")
+        for pid, value in history.top('memory', 5):
+            lines.append(f"  {pid:>7}  {history.label('memory', pid)[:24]:<24} {value:6.1f}")
+        
+        lines.append("Top удалённые адреса (соединений):")
+        for endpoint, value in history.top('endpoint', 5):
+            lines.append(f"  {endpoint:<32} {value:6.1f}")
+        
+        spikes = history.spikes('cpu')
+        if spikes:
+            lines.append("Всплески CPU:")
+            for pid, latest, mean in spikes[:5]:
+                lines.append(f"  {pid:>7}  {history.label('cpu', pid)[:24]:<24} {latest:6.1f} (обычно {mean:.1f})")
+        
+        self.history_text.config(state='normal')
+        self.history_text.delete('1.0', tk.END)
+        self.history_text.insert('1.0', "\n".join(lines))
+        self.history_text.config(state='disabled')
+    
+    def format_connection_row(self, conn):
+        return (
+            conn.pid if conn.pid is not None else '', conn.process[:20], conn.local, conn.remote,
+            conn.hostname or '', conn.status, conn.blocked or '', conn.rule or ''
+        )
+    
+    def format_connection_event_row(self, event):
+        conn = event.connection
+        status = conn.status if event.previous_status is None else f"{event.previous_status} → {conn.status}"
+        duration = f"{event.lifetime:.1f}" if event.kind != 'NEW' else ''
+        return (
+            datetime.fromtimestamp(event.timestamp).strftime('%H:%M:%S'),
+            event.kind, conn.pid if conn.pid is not None else '', conn.remote, status, duration
+        )
+    
+    def toggle_sampler(self, sampler, var):
+        """Включение/выключение фонового замера"""
+        if var.get():
+            self.apply_sample_interval()
+            sampler.start()
+            self.update_activity(f"Автообновление включено ({sampler.name}, {sampler.interval:g} с)")
+        else:
+            sampler.stop()
+            self.update_activity(f"Автообновление выключено ({sampler.name})")
+    
+    def apply_sample_interval(self):
+        """Применение интервала замеров из поля ввода"""
         try:
-            connections = self.network_monitor.get_connections()
-            self.stats['connections'] = len(connections)
-            
-            # Показываем первые 100 соединений
-            for conn in connections[:100]:
-                self.network_tree.insert('', 'end', values=(
-                    conn.get('pid', ''),
-                    conn.get('local', ''),
-                    conn.get('remote', ''),
-                    conn.get('status', '')
-                ))
-            
-            self.update_stats_display()
-            
-        except Exception as e:
-            self.update_activity(f"Ошибка обновления сети: {e}")
+            interval = max(0.5, float(self.sample_interval_var.get()))
+        except (tk.TclError, ValueError):
+            return
+        self.process_sampler.interval = interval
+        self.network_sampler.interval = interval
+    
+    def poll_samplers(self):
+        """Перенос свежих замеров в таблицы (в потоке интерфейса)"""
+        processes = self.process_sampler.take_latest()
+        if processes is not None:
+            self.show_processes(processes)
+        
+        connections = self.network_sampler.take_latest()
+        if connections is not None:
+            self.show_connections(connections)
+        
+        for sampler, what in ((self.process_sampler, 'процессов'), (self.network_sampler, 'сети')):
+            if sampler.last_error:
+                self.update_activity(f"Ошибка обновления {what}: {sampler.last_error}", 'error')
+                sampler.last_error = None
+        
+        # Ошибки фоновых потоков пишутся в журнал без Tk (см. __init__)
+        self.flush_activity()
+        self.root.after(250, self.poll_samplers)
+    
+    def load_signatures_action(self):
+        """Загрузка базы SHA-256 сигнатур из файла"""
+        path = filedialog.askopenfilename(
+            title="Выберите файл сигнатур",
+            filetypes=[("Текстовые файлы", "*.txt"), ("Все файлы", "*.*")]
+        )
+        if not path:
+            return
+        
+        try:
+            count = self.file_scanner.signatures.load(path)
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("Ошибка", f"Не удалось загрузить сигнатуры: {e}")
+            return
+        
+        self.update_activity(f"Загружено сигнатур: {count} из {path}")
+        messagebox.showinfo("Сигнатуры", f"Загружено сигнатур: {count}")
+    
+    def load_rules_action(self):
+        """Загрузка правил обнаружения (дальше файл перечитывается при изменении)"""
+        path = filedialog.askopenfilename(
+            title="Выберите файл правил",
+            filetypes=[("Правила", "*.json *.toml *.yaml *.yml"), ("Все файлы", "*.*")]
+        )
+        if not path:
+            return
+        
+        try:
+            count = self.rules.load(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Ошибка", f"Не удалось загрузить правила: {e}")
+            return
+        
+        self.process_alerts_reported.clear()
+        self.connection_alerts_reported.clear()
+        counts = ', '.join(f"{target}: {number}" for target, number in self.rules.counts().items())
+        self.update_activity(f"Загружено правил: {count} ({counts}) из {path}")
+        messagebox.showinfo("Правила", f"Загружено правил: {count}")
+    
+    def load_blocklist_action(self):
+        """Загрузка блок-листа IP-адресов и подсетей из файла"""
+        path = filedialog.askopenfilename(
+            title="Выберите блок-лист",
+            filetypes=[("Текстовые файлы", "*.txt"), ("Все файлы", "*.*")]
+        )
+        if not path:
+            return
+        
+        try:
+            count = self.ip_blocklist.load(path)
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("Ошибка", f"Не удалось загрузить блок-лист: {e}")
+            return
+        
+        self.blocked_reported.clear()
+        self.update_activity(f"Загружено записей блок-листа: {count} из {path}")
+        messagebox.showinfo("Блок-лист", f"Загружено записей: {count}")
+    
+    def toggle_metrics(self):
+        """Включение/выключение сбора метрик"""
+        METRICS.enabled = self.metrics_enabled_var.get()
+        self.update_activity(f"Сбор метрик {'включён' if METRICS.enabled else 'выключен'}")
+    
+    def toggle_profiling(self):
+        """Включение/выключение cProfile для выбранной операции"""
+        operation = self.profile_operation_var.get()
+        METRICS.set_profiling(operation, self.profile_var.get())
+        self.update_activity(f"Профилирование {operation}: {'включено' if self.profile_var.get() else 'выключено'}")
+    
+    def show_profile(self):
+        """Отчёт cProfile по выбранной операции"""
+        self.profile_text.delete('1.0', tk.END)
+        self.profile_text.insert('1.0', METRICS.profile_report(self.profile_operation_var.get()))
+    
+    def reset_metrics(self):
+        METRICS.reset()
+        self.refresh_metrics(reschedule=False)
+    
+    def save_metrics_action(self):
+        """Сохранение метрик в JSON или текстовом формате Prometheus"""
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON", "*.json"), ("Prometheus", "*.prom"), ("Все файлы", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            METRICS.dump(path)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить метрики: {e}")
+            return
+        self.update_activity(f"Метрики сохранены в {path}")
+    
+    def refresh_metrics(self, reschedule=True):
+        """Обновление таблицы метрик (раз в секунду, пока открыто окно)"""
+        snapshot = METRICS.snapshot()
+        rows = [
+            (name, timer['calls'], f"{timer['total_ms']:.1f}", f"{timer['avg_ms']:.3f}", f"{timer['max_ms']:.1f}")
+            for name, timer in snapshot['timers'].items()
+        ]
+        rows.extend((name, value, '', '', '') for name, value in snapshot['counters'].items())
+        self.metrics_table.set_data(rows)
+        if reschedule:
+            self.root.after(1000, self.refresh_metrics)
     
     def browse_path(self):
         """Выбор пути для сканирования"""
@@ -720,15 +5783,57 @@ class SecurityMonitor:
         """Обновление всех данных"""
         self.update_processes()
         self.update_network()
-        self.update_stats_display()
-        self.update_activity("Все данные обновлены")
+        self.update_activity("Обновление данных запущено")
+    
+    def update_activity(self, message, severity='info'):
+        """Запись события в журнал; окно обновляется пачкой раз в кадр"""
+        self.activity_log.add(message, severity)
+        if not self.activity_flush_scheduled:
+            self.activity_flush_scheduled = True
+            self.root.after(16, self.flush_activity)
+    
+    def flush_activity(self):
+        """Вставка накопленных событий одной операцией и обрезка старых строк"""
+        self.activity_flush_scheduled = False
+        if not self.is_tab_built('dashboard'):
+            return  # Записи останутся в очереди до построения дашборда
+        pending = self.activity_log.take_pending()
+        rank = SEVERITY_RANK[self.activity_severity_var.get()]
+        lines = [entry.format() for entry in pending if SEVERITY_RANK[entry.severity] >= rank]
+        if not lines:
+            return
+        
+        text = self.activity_text
+        text.insert(tk.END, "\n".join(lines[-self.activity_max_lines:]) + "\n")
+        excess = int(text.index('end-1c').split('.')[0]) - 1 - self.activity_max_lines
+        if excess > 0:
+            text.delete('1.0', f'{excess + 1}.0')
+        text.see(tk.END)
     
-    def update_activity(self, message):
-        """Обновление активности"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.activity_text.insert(tk.END, f"[{timestamp}] {message}\n")
+    def apply_activity_filter(self):
+        """Перерисовка журнала из буфера с новым порогом важности"""
+        entries = self.activity_log.filtered(self.activity_severity_var.get())
+        self.activity_log.take_pending()  # Уже попадут в перерисовку
+        self.activity_text.delete('1.0', tk.END)
+        lines = [entry.format() for entry in entries[-self.activity_max_lines:]]
+        if lines:
+            self.activity_text.insert('1.0', "\n".join(lines) + "\n")
         self.activity_text.see(tk.END)
     
+    def toggle_activity_file(self):
+        """Включение/выключение записи журнала в файл с ротацией"""
+        if not self.activity_file_var.get():
+            self.activity_log.close_file()
+            self.update_activity("Запись журнала в файл выключена")
+            return
+        try:
+            path = self.activity_log.open_file()
+        except OSError as e:
+            self.activity_file_var.set(False)
+            self.update_activity(f"Не удалось открыть файл журнала: {e}", 'error')
+            return
+        self.update_activity(f"Журнал пишется в {path}")
+    
     def update_stats_display(self):
         """Обновление отображения статистики"""
         # Обновляем все метки статистики
@@ -739,17 +5844,954 @@ class SecurityMonitor:
     
     def on_closing(self):
         """Обработка закрытия"""
+        if self.scan_job and self.scan_job.is_running():
+            self.scan_job.cancel()
+        if self.export_job and self.export_job.is_running():
+            self.export_job.cancel()
+        if self.file_watcher is not None:
+            self.file_watcher.stop()
+        self.process_sampler.stop()
+        self.network_sampler.stop()
+        self.dns_cache.close()
+        self.activity_log.close_file()
         self.root.destroy()
 
-def main():
+# ==================== ЗАМЕРЫ ПРОИЗВОДИТЕЛЬНОСТИ ====================
+
+BENCH_SIGNATURE_MARKER = b'SECURITY-MONITOR-BENCH-SIGNATURE'
+BENCH_PATTERN = b'SECURITY-MONITOR-BENCH-PATTERN'
+
+def make_bench_tree(root, files, shape='wide', file_size=4096, seed=0):
+    """Синтетическое дерево файлов для замеров.
+    
+    shape='wide' - каталоги по 1000 файлов, 'deep' - цепочки вложенных
+    каталогов глубиной до 64 по 10 файлов. Каждый сотый файл - .exe,
+    каждый тысячный совпадает с сигнатурой, каждый пятисотый содержит
+    байтовую сигнатуру. Возвращает сводку и хэши «вредоносных» файлов.
+    """
+    import random
+    import hashlib
+    rng = random.Random(seed)
+    block = rng.randbytes(max(file_size, len(BENCH_PATTERN) + 8))[:file_size]
+    bad_content = BENCH_SIGNATURE_MARKER + block[len(BENCH_SIGNATURE_MARKER):]
+    total_bytes = 0
+    last_directory = None
+    
+    for i in range(files):
+        if shape == 'deep':
+            chain, depth = divmod(i // 10, 64)
+            directory = os.path.join(root, f'chain{chain}', *(['d'] * depth))
+        else:
+            directory = os.path.join(root, f'dir{i // 1000}')
+        if directory != last_directory:
+            os.makedirs(directory, exist_ok=True)
+            last_directory = directory
+        
+        if i % 1000 == 999:
+            content = bad_content
+        elif i % 500 == 499:
+            content = i.to_bytes(8, 'little') + BENCH_PATTERN + block[8 + len(BENCH_PATTERN):]
+        else:
+            content = i.to_bytes(8, 'little') + block[8:]
+        name = f'file{i}.exe' if i % 100 == 0 else f'file{i}.bin'
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(content)
+        total_bytes += len(content)
+    
+    return {
+        'files': files,
+        'bytes': total_bytes,
+        'shape': shape,
+        'bad_digests': [hashlib.sha256(bad_content).hexdigest()]
+    }
+
+def make_bench_signatures(path, count, known=(), seed=0):
+    """Файл сигнатур: count случайных хэшей плюс известные"""
+    import random
+    rng = random.Random(f'signatures-{seed}')
+    with open(path, 'w', encoding='utf-8') as f:
+        for digest in known:
+            f.write(f"{digest} Bench.Known\n")
+        for i in range(count):
+            f.write(f"{rng.randbytes(32).hex()} Bench.Random.{i}\n")
+
+def make_bench_patterns(path, count, seed=0):
+    """Файл байтовых сигнатур: count случайных правил и одно совпадающее"""
+    import random
+    # Отдельный поток случайных чисел, иначе правила совпадут с содержимым дерева
+    rng = random.Random(f'patterns-{seed}')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"Bench.Pattern {BENCH_PATTERN.hex()}\n")
+        for i in range(count):
+            f.write(f"Bench.Random.{i} {rng.randbytes(12).hex()}\n")
+
+class FakePsutil:
+    """Подмена модуля psutil с заданным числом процессов и соединений.
+    
+    Между обновлениями часть процессов (churn) завершается и заменяется
+    новыми, чтобы замер учитывал и появление новых PID.
+    """
+    
+    class NoSuchProcess(Exception):
+        pass
+    
+    class ZombieProcess(NoSuchProcess):
+        pass
+    
+    class AccessDenied(Exception):
+        pass
+    
+    MemoryInfo = namedtuple('MemoryInfo', ['rss'])
+    Connection = namedtuple('Connection', ['pid', 'laddr', 'raddr', 'status'])
+    
+    def __init__(self, processes=500, connections=2000, churn=0.05, seed=0):
+        import random
+        self.rng = random.Random(seed)
+        self.churn = churn
+        self.next_pid = 1000
+        self.alive = {}
+        for _ in range(processes):
+            self._spawn()
+        self.connection_count = connections
+        self.exe = sys.executable
+        fake = self
+        
+        class Process:
+            def __init__(self, pid):
+                if pid not in fake.alive:
+                    raise fake.NoSuchProcess(pid)
+                self.pid = pid
+            
+            def oneshot(self):
+                from contextlib import nullcontext
+                return nullcontext()
+            
+            def name(self):
+                return fake.alive[self.pid]
+            
+            def exe(self):
+                return fake.exe
+            
+            def cmdline(self):
+                return [fake.exe, '-m', fake.alive[self.pid]]
+            
+            def cpu_percent(self, interval=None):
+                return fake.rng.random() * 10
+            
+            def memory_info(self):
+                return fake.MemoryInfo(fake.rng.randrange(1 << 20, 1 << 30))
+            
+            def memory_percent(self):
+                return fake.rng.random()
+            
+            def ppid(self):
+                return 1 if self.pid < 1100 else 1000 + self.pid % 100
+        
+        self.Process = Process
+    
+    def _spawn(self):
+        pid = self.next_pid
+        self.next_pid += 1
+        self.alive[pid] = f'worker{pid % 50}'
+    
+    def tick(self):
+        """Завершение части процессов и запуск новых"""
+        for pid in self.rng.sample(list(self.alive), int(len(self.alive) * self.churn)):
+            del self.alive[pid]
+            self._spawn()
+    
+    def pids(self):
+        return list(self.alive)
+    
+    def net_connections(self, kind='inet'):
+        rng = self.rng
+        pids = list(self.alive)
+        connections = []
+        for i in range(self.connection_count):
+            # Большая часть соединений живёт между замерами, часть меняется
+            port = 40000 + (i if rng.random() > self.churn else rng.randrange(20000))
+            connections.append(self.Connection(
+                pids[i % len(pids)],
+                ('10.0.0.2', port),
+                (f'93.184.{i % 250}.{i % 200}', 443),
+                'ESTABLISHED' if rng.random() > self.churn else 'TIME_WAIT'
+            ))
+        return connections
+
+class mocked_psutil:
+    """Контекст, на время которого import psutil возвращает подмену"""
+    
+    def __init__(self, fake):
+        self.fake = fake
+        self._saved = None
+    
+    def __enter__(self):
+        self._saved = sys.modules.get('psutil')
+        sys.modules['psutil'] = self.fake
+        return self.fake
+    
+    def __exit__(self, *exc):
+        if self._saved is None:
+            sys.modules.pop('psutil', None)
+        else:
+            sys.modules['psutil'] = self._saved
+
+def peak_rss_mb():
+    """Пиковый RSS процесса, МБ (максимум за всё время работы)"""
+    try:
+        import resource
+    except ImportError:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / 2 ** 20, 1)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+def latency_stats(samples):
+    """Медиана, p95 и максимум задержек, мс"""
+    samples = sorted(samples)
+    return {
+        'median_ms': round(samples[len(samples) // 2] * 1000, 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        'max_ms': round(samples[-1] * 1000, 3)
+    }
+
+def run_bench_job(job):
+    """Запуск ScanJob и ожидание конца, возвращает время в секундах"""
+    started = time.perf_counter()
+    job.start()
+    while True:
+        message = job.queue.get()
+        if message[0] in ('done', 'error'):
+            break
+    return time.perf_counter() - started
+
+def bench_scan(workdir, tree, tree_info, workers=None):
+    """Холодное и тёплое (по индексу) сканирование ScanJob и quick_scan"""
+    results = {}
+    for name in ('scan_cold', 'scan_warm'):
+        # Новый сканер на каждый проход - как при следующем запуске программы
+        scanner = BasicFileScanner(
+            index_path=os.path.join(workdir, 'index.db'),
+            signatures_path=os.path.join(workdir, 'signatures.txt'),
+            patterns_path=os.path.join(workdir, 'patterns.txt')
+        )
+        job = ScanJob(scanner, [tree], workers=workers)
+        seconds = run_bench_job(job)
+        results[name] = {
+            'seconds': round(seconds, 3),
+            'files_per_s': round(job.files_done / seconds, 1),
+            'mb_per_s': round(tree_info['bytes'] / seconds / 2 ** 20, 2),
+            'files': job.files_done,
+            'unchanged': job.files_unchanged,
+            'threats': len(job.threats),
+            'peak_rss_mb': peak_rss_mb()
+        }
+        if scanner.index is not None:
+            scanner.index.close()
+    
+    scanner = BasicFileScanner(
+        use_index=False,
+        signatures_path=os.path.join(workdir, 'signatures.txt'),
+        patterns_path=os.path.join(workdir, 'patterns.txt')
+    )
+    started = time.perf_counter()
+    threats = scanner.quick_scan(tree)
+    seconds = time.perf_counter() - started
+    results['quick_scan'] = {
+        'seconds': round(seconds, 3),
+        'files_per_s': round(tree_info['files'] / seconds, 1),
+        'mb_per_s': round(tree_info['bytes'] / seconds / 2 ** 20, 2),
+        'threats': len(threats),
+        'match_mb_per_s': round(scanner.match_throughput, 2),
+        'peak_rss_mb': peak_rss_mb()
+    }
+    return results
+
+def shard_process_counts(limit=None):
+    """1, 2, 4, ... до числа ядер (и само число ядер)"""
+    limit = limit or os.cpu_count() or 1
+    counts = []
+    count = 1
+    while count < limit:
+        counts.append(count)
+        count *= 2
+    counts.append(limit)
+    return counts
+
+def bench_shard(workdir, tree, tree_info, process_counts, workers=None):
+    """Холодное сканирование потоками и пулами процессов разного размера.
+    
+    speedup - ускорение относительно одного процесса, efficiency - оно же
+    на процесс (1.0 - линейное ускорение).
+    """
+    results = {}
+    single = None
+    for processes in [0] + list(process_counts):
+        scanner = BasicFileScanner(
+            use_index=False,
+            signatures_path=os.path.join(workdir, 'signatures.txt'),
+            patterns_path=os.path.join(workdir, 'patterns.txt')
+        )
+        job = ScanJob(scanner, [tree], workers=workers, processes=processes)
+        seconds = run_bench_job(job)
+        result = {
+            'seconds': round(seconds, 3),
+            'files_per_s': round(job.files_done / seconds, 1),
+            'mb_per_s': round(tree_info['bytes'] / seconds / 2 ** 20, 2),
+            'threats': len(job.threats)
+        }
+        if job.start_method:
+            result['start_method'] = job.start_method
+        if processes == 1:
+            single = seconds
+        if processes and single:
+            result['speedup'] = round(single / seconds, 2)
+            result['efficiency'] = round(single / seconds / processes, 2)
+        results['shard_threads' if not processes else f'shard_p{processes}'] = result
+    return results
+
+EXECUTABLE_MAGIC = (b'\x7fELF', b'MZ', b'\xcf\xfa\xed\xfe', b'\xca\xfe\xba\xbe')
+
+def bench_executables(size):
+    """Образец настоящего машинного кода: (bytes, [имена файлов]).
+    
+    Читаются исполняемые файлы и библиотеки самого Python (ELF, PE,
+    Mach-O), начиная с самых больших: в случайных байтах не бывает
+    выравнивания нулями и типовых инструкций, на которых и спотыкается
+    поиск сигнатур.
+    """
+    import sysconfig
+    folders = {
+        os.path.dirname(os.path.realpath(sys.executable)),
+        sysconfig.get_config_var('LIBDIR'),
+        sysconfig.get_config_var('DESTSHARED'),
+        os.path.join(sys.base_prefix, 'DLLs')
+    }
+    found = []
+    for folder in folders:
+        if not folder or not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            path = os.path.realpath(os.path.join(folder, name))
+            try:
+                with open(path, 'rb') as f:
+                    if f.read(4).startswith(EXECUTABLE_MAGIC):
+                        found.append((os.path.getsize(path), path))
+            except OSError:
+                continue
+    
+    chunks = []
+    names = []
+    left = size
+    for _, path in sorted(set(found), reverse=True):
+        if left <= 0:
+            break
+        with open(path, 'rb') as f:
+            chunk = f.read(left)
+        chunks.append(chunk)
+        names.append(os.path.basename(path))
+        left -= len(chunk)
+    return b''.join(chunks), names
+
+def bench_patterns(counts, size=4 * 2 ** 20, seed=0):
+    """Скорость поиска байтовых сигнатур в зависимости от числа правил.
+    
+    Ищется по настоящим исполняемым файлам (bench_executables), сигнатуры
+    длиной 16-32 байта вырезаются из другой их части (каждая сотая - из
+    проверяемой, чтобы были и совпадения). Без исполняемых файлов -
+    случайные байты. source - первый файл образца и число остальных.
+    """
+    import random
+    rng = random.Random(f'match-{seed}')
+    sample, names = bench_executables(size * 2)
+    if len(sample) < 2 * 64:
+        sample, names = rng.randbytes(size * 2), []
+    half = len(sample) // 2
+    data, pool = sample[:half], sample[half:]
+    source = f"{names[0]} (+{len(names) - 1})" if names else 'random'
+    results = {}
+    for count in counts:
+        patterns = {}
+        while len(patterns) < count:
+            origin = data if len(patterns) % 100 == 0 else pool
+            length = rng.randint(16, 32)
+            start = rng.randrange(len(origin) - length)
+            pattern = origin[start:start + length]
+            # Как у настоящих сигнатур: не кусок заполнения из нулей и 0xFF
+            if pattern.count(0) + pattern.count(0xFF) <= length // 2:
+                patterns[f'Bench.Code.{len(patterns)}'] = pattern
+        started = time.perf_counter()
+        matcher = PatternMatcher(patterns)
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        hits = sum(1 for _ in matcher.scan(data))
+        seconds = time.perf_counter() - started
+        results[f'patterns_{count}'] = {
+            'build_ms': round(built * 1000, 3),
+            'mb_per_s': round(len(data) / seconds / 2 ** 20, 2),
+            'hits': hits,
+            'source': source
+        }
+    return results
+
+def bench_refresh(sample, fake, refreshes):
+    """Задержка обновлений: первое отдельно, дальше медиана/p95/максимум"""
+    samples = []
+    first = None
+    size = 0
+    with mocked_psutil(fake):
+        for i in range(refreshes + 1):
+            started = time.perf_counter()
+            size = len(sample())
+            elapsed = time.perf_counter() - started
+            if i == 0:
+                first = elapsed
+            else:
+                samples.append(elapsed)
+            fake.tick()
+    result = {'first_ms': round(first * 1000, 3), **latency_stats(samples)}
+    result['rows'] = size
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def run_benchmarks(files=1000, shape='wide', file_size=4096, signatures=10000, patterns=100,
+                   processes=500, connections=2000, refreshes=20, workers=None,
+                   only=None, workdir=None, seed=0, shard_processes=None,
+                   pattern_counts=(1, 10, 100, 1000, 10000)):
+    """Полный набор замеров, результат - словарь для сохранения в JSON"""
+    import tempfile
+    import platform
+    import shutil
+    
+    only = set(only or ('scan', 'patterns', 'procs', 'net', 'records'))
+    params = {
+        'files': files, 'shape': shape, 'file_size': file_size, 'signatures': signatures,
+        'patterns': patterns, 'processes': processes, 'connections': connections,
+        'refreshes': refreshes, 'workers': workers, 'seed': seed
+    }
+    if 'shard' in only:
+        shard_processes = shard_processes or shard_process_counts()
+        params['shard_processes'] = shard_processes
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': params,
+        'results': {}
+    }
+    results = report['results']
+    
+    if only & {'scan', 'shard'}:
+        own_workdir = workdir is None
+        workdir = workdir or tempfile.mkdtemp(prefix='security-bench-')
+        try:
+            tree = os.path.join(workdir, 'tree')
+            started = time.perf_counter()
+            tree_info = make_bench_tree(tree, files, shape, file_size, seed)
+            make_bench_signatures(os.path.join(workdir, 'signatures.txt'), signatures, tree_info['bad_digests'], seed)
+            make_bench_patterns(os.path.join(workdir, 'patterns.txt'), patterns, seed)
+            params['tree_seconds'] = round(time.perf_counter() - started, 3)
+            if 'scan' in only:
+                results.update(bench_scan(workdir, tree, tree_info, workers))
+            if 'shard' in only:
+                results.update(bench_shard(workdir, tree, tree_info, shard_processes, workers))
+        finally:
+            if own_workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+    
+    if 'patterns' in only:
+        params['pattern_counts'] = list(pattern_counts)
+        results.update(bench_patterns(pattern_counts, seed=seed))
+    
+    if 'procs' in only:
+        monitor = BasicProcessMonitor(signatures=SignatureDatabase(os.devnull))
+        results['processes'] = bench_refresh(
+            monitor.get_processes, FakePsutil(processes, 0, seed=seed), refreshes
+        )
+    
+    if 'net' in only:
+        fake = FakePsutil(max(1, processes), connections, seed=seed)
+        monitor = BasicNetworkMonitor()
+        tracker = ConnectionTracker()
+        
+        def sample():
+            snapshot = monitor.get_connections()
+            tracker.update(snapshot)
+            return snapshot
+        
+        results['connections'] = bench_refresh(sample, fake, refreshes)
+    
+    if 'records' in only:
+        memory = measure_record_memory()
+        results['records'] = {'dict_bytes': round(memory['dict'], 1), 'record_bytes': round(memory['record'], 1)}
+    
+    return report
+
+def compare_benchmarks(baseline, current, threshold=0.10):
+    """Сравнение двух отчётов: [(замер, метрика, было, стало, изменение, регрессия)]
+    
+    Для *_per_s больше - лучше, для *_ms, *_mb, *_bytes и seconds - меньше.
+    """
+    rows = []
+    for name, metrics in current['results'].items():
+        old_metrics = baseline.get('results', {}).get(name)
+        if not old_metrics:
+            continue
+        for metric, value in metrics.items():
+            old = old_metrics.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            if metric.endswith('_per_s'):
+                higher_is_better = True
+            elif metric.endswith(('_ms', '_mb', '_bytes')) or metric == 'seconds':
+                higher_is_better = False
+            else:
+                continue
+            change = (value - old) / old
+            regression = change < -threshold if higher_is_better else change > threshold
+            rows.append((name, metric, old, value, round(change * 100, 1), regression))
+    return rows
+
+# ==================== КОНСОЛЬНЫЙ РЕЖИМ ====================
+
+_emit_lock = threading.Lock()
+
+def emit(event, **data):
+    """Одна строка JSON в stdout (можно звать из разных потоков)"""
+    line = json.dumps({'event': event, **data}, ensure_ascii=False, default=str) + "\n"
+    with _emit_lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+def build_scanner(args):
+    """Сканер с настройками из аргументов командной строки"""
+    scanner = BasicFileScanner(
+        use_index=not args.no_index,
+        signatures_path=args.signatures,
+        patterns_path=args.patterns,
+        rules=RuleSet(args.rules)
+    )
+    scanner.walker = FileWalker(
+        exclude=args.exclude,
+        max_depth=args.max_depth,
+        symlinks=args.symlinks,
+        one_filesystem=args.one_filesystem
+    )
+    mb = 2 ** 20
+    scanner.large_files = LargeFilePolicy(
+        full_limit=args.full_limit * mb,
+        exec_limit=args.exec_limit * mb,
+        sample_size=args.sample_size * mb,
+        max_bytes=args.max_bytes * mb if args.max_bytes else None,
+        max_seconds=args.max_seconds
+    )
+    if args.no_archives:
+        scanner.archives = None
+    else:
+        scanner.archives = ArchiveInspector(
+            scanner,
+            max_depth=args.archive_depth,
+            max_members=args.archive_members,
+            max_ratio=args.archive_ratio
+        )
+    return scanner
+
+def cli_export(kind, chunks, path, total=None):
+    """Экспорт в файл вместо вывода записей в stdout"""
+    job = ExportJob(kind, chunks, path, total=total)
+    job.run()
+    if job.error:
+        emit('error', message=f"Не удалось экспортировать: {job.error}")
+        return 1
+    emit('export', kind=kind, path=path, format=job.fmt, records=job.written)
+    return 0
+
+def cli_scan(args):
+    """Сканирование путей с потоковым выводом угроз"""
+    scanner = build_scanner(args)
+    paths = args.paths or [DOWNLOADS_DIR]
+    started = time.perf_counter()
+    
+    job = ScanJob(scanner, paths, workers=args.workers, processes=args.processes)
+    job.start()
+    try:
+        while True:
+            message = job.queue.get()
+            if message[0] == 'progress':
+                for threat in message[2]:
+                    emit('threat', **threat.as_dict())
+            elif message[0] == 'error':
+                emit('error', message=message[1])
+                return 1
+            elif message[0] == 'done':
+                break
+    except KeyboardInterrupt:
+        job.cancel()
+        job.wait()
+    
+    report = scanner.content_report
+    for path, size, action, reason in report.items:
+        emit(action, path=path, size=size, reason=reason)
+    if args.output:
+        store = scanner.scan_results
+        cli_export('threats', store.chunks(ExportJob.CHUNK_SIZE), args.output, len(store))
+    emit(
+        'summary',
+        paths=paths,
+        devices=len(job.devices),
+        files=job.files_done,
+        unchanged=job.files_unchanged,
+        content=report.summary(),
+        threats=len(job.threats),
+        cancelled=job.cancel_event.is_set(),
+        seconds=round(time.perf_counter() - started, 3)
+    )
+    return 0
+
+def cli_procs(args):
+    """Снимок процессов (два замера, чтобы CPU был разницей)"""
+    signatures = SignatureDatabase(args.signatures)
+    monitor = BasicProcessMonitor(signatures=signatures, hash_executables=not args.no_hash, rules=RuleSet(args.rules))
+    monitor.get_processes()
+    time.sleep(args.interval)
+    processes = sorted(monitor.get_processes(), key=lambda p: p.cpu, reverse=True)
+    if args.output:
+        return cli_export('processes', chunked(processes, ExportJob.CHUNK_SIZE), args.output, len(processes))
+    for proc in processes:
+        emit('process', **proc.as_dict())
+    return 0
+
+def cli_net(args):
+    """Снимок сетевых соединений, с --follow - поток событий соединений"""
+    monitor = BasicNetworkMonitor(source=args.source)
+    processes = BasicProcessMonitor(hash_executables=False)
+    processes.get_processes()
+    enricher = ConnectionEnricher(
+        IPBlocklist(args.blocklist),
+        ReverseDNSCache() if args.resolve else None,
+        RuleSet(args.rules)
+    )
+    
+    names = processes.names()
+    connections = monitor.get_connections()
+    enricher.enrich(connections, names)
+    if enricher.dns is not None:
+        # Для разового снимка ждём ответы DNS и присоединяем имена ещё раз
+        enricher.dns.wait(args.resolve_timeout)
+        enricher.enrich(connections, names)
+    if args.output and not args.follow:
+        return cli_export('connections', chunked(connections, ExportJob.CHUNK_SIZE), args.output, len(connections))
+    for conn in connections:
+        emit('connection', **conn.as_dict())
+    if not args.follow:
+        return 0
+    
+    tracker = ConnectionTracker()
+    tracker.update(connections)
+    try:
+        while True:
+            time.sleep(args.interval)
+            connections = monitor.get_connections()
+            # Снимок процессов обновляем, только если появились незнакомые PID
+            if any(conn.pid is not None and conn.pid not in names for conn in connections):
+                processes.get_processes()
+                names = processes.names()
+            enricher.enrich(connections, names)
+            for event in tracker.update(connections):
+                emit('connection_event', **event.as_dict())
+    except KeyboardInterrupt:
+        pass
+    emit('connection_stats', **tracker.stats())
+    if enricher.dns is not None:
+        enricher.dns.close()
+    return 0
+
+def cli_bench(args):
+    """Замеры производительности, сохранение и сравнение с прошлым отчётом"""
+    report = run_benchmarks(
+        files=args.files,
+        shape=args.shape,
+        file_size=args.file_size,
+        signatures=args.signatures,
+        patterns=args.patterns,
+        processes=args.processes,
+        connections=args.connections,
+        refreshes=args.refreshes,
+        workers=args.workers,
+        only=args.only,
+        workdir=args.workdir,
+        shard_processes=args.shard_processes,
+        pattern_counts=args.pattern_counts
+    )
+    if args.label:
+        report['label'] = args.label
+    for name, metrics in report['results'].items():
+        emit('bench', name=name, **metrics)
+    
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        emit('bench_saved', path=args.save)
+    
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = 0
+        for name, metric, old, new, change, regression in compare_benchmarks(baseline, report, args.threshold / 100):
+            regressions += regression
+            emit('bench_compare', name=name, metric=metric, baseline=old, current=new,
+                 change_percent=change, regression=regression)
+        emit('bench_summary', baseline=baseline.get('label', args.compare), regressions=regressions)
+        return 1 if regressions else 0
+    return 0
+
+def cli_rules(args):
+    """Проверка и компиляция файла правил без запуска сканирования"""
+    rules = RuleSet(args.path)
+    try:
+        count = rules.load()
+    except FileNotFoundError:
+        emit('rules', path=rules.path, default=True, rules=len(rules), counts=rules.counts())
+        return 0
+    except (OSError, ValueError) as e:
+        emit('error', message=f"{rules.path}: {e}")
+        return 1
+    emit('rules', path=rules.path, rules=count, counts=rules.counts(), fingerprint=rules.fingerprint)
+    return 0
+
+def cli_watch(args):
+    """Периодические замеры процессов и сети, с --paths - ещё и наблюдение за файлами"""
+    watcher = None
+    if args.paths:
+        scanner = build_scanner(args)
+        
+        def on_files(paths):
+            for threat in scanner.check_paths(paths):
+                emit('threat', **threat.as_dict())
+        
+        watcher = FileWatcher(args.paths, on_files, walker=scanner.walker)
+        watcher.start()
+    
+    rules = scanner.rules if watcher is not None else RuleSet(args.rules)
+    processes = BasicProcessMonitor(rules=rules)
+    network = BasicNetworkMonitor()
+    enricher = ConnectionEnricher(rules=rules)
+    reported = set()  # (вид, ключ записи, правило) выведенные в прошлом замере
+    history = MetricsHistory()
+    if not args.no_metrics:
+        processes.get_processes()
+    
+    tick = 0
+    try:
+        while args.count is None or tick < args.count:
+            time.sleep(args.interval)
+            if watcher is not None and watcher.last_error:
+                emit('watch_error', message=watcher.last_error)
+                watcher.last_error = None
+            if args.no_metrics:
+                tick += 1
+                continue
+            procs = processes.get_processes()
+            conns = network.get_connections()
+            enricher.enrich(conns, processes.names())
+            alerts = {
+                (kind, key, record.rule): (kind, record)
+                for kind, key, record in itertools.chain(
+                    (('process', proc.pid, proc) for proc in procs),
+                    (('connection', conn.key, conn) for conn in conns)
+                )
+                if record.rule
+            }
+            for kind, record in fresh_alerts(reported, alerts):
+                emit('rule_alert', kind=kind, **record.as_dict())
+            history.record_processes(procs)
+            history.record_connections(conns)
+            tick += 1
+            
+            emit(
+                'sample',
+                time=datetime.now().isoformat(timespec='seconds'),
+                processes=len(procs),
+                connections=len(conns),
+                cpu_total=round(history.get('total', 'cpu').latest(), 1),
+                top_cpu=[
+                    {'pid': pid, 'name': history.label('cpu', pid), 'cpu': round(value, 1)}
+                    for pid, value in history.top('cpu', 5, window=1)
+                ],
+                spikes=[
+                    {'pid': pid, 'name': history.label('cpu', pid), 'cpu': latest, 'mean': round(mean, 1)}
+                    for pid, latest, mean in history.spikes('cpu')
+                ]
+            )
+    except KeyboardInterrupt:
+        pass
+    if watcher is not None:
+        watcher.stop()
+        watcher._thread.join(timeout=2)
+    return 0
+
+def add_scanner_arguments(parser):
+    """Общие настройки сканера для команд scan и watch"""
+    parser.add_argument('--no-index', action='store_true', help="не использовать постоянный индекс")
+    parser.add_argument('--signatures', help="файл SHA-256 сигнатур")
+    parser.add_argument('--patterns', help="файл байтовых сигнатур")
+    parser.add_argument('--rules', help="файл правил обнаружения (.json, .toml, .yaml)")
+    parser.add_argument('--exclude', action='append', default=[], help="шаблон исключения (можно несколько)")
+    parser.add_argument('--max-depth', type=int, default=None, help="максимальная глубина обхода")
+    parser.add_argument('--symlinks', choices=FileWalker.SYMLINK_POLICIES, default='files', help="политика ссылок")
+    parser.add_argument('--one-filesystem', action='store_true', help="не выходить за файловую систему корня")
+    parser.add_argument('--full-limit', type=int, default=64, help="файлы крупнее (МБ) проверяются выборочно")
+    parser.add_argument('--exec-limit', type=int, default=512,
+                        help="исполняемые файлы до этого размера (МБ) проверяются целиком")
+    parser.add_argument('--sample-size', type=int, default=1, help="сколько МБ читать с начала и с конца большого файла")
+    parser.add_argument('--max-bytes', type=int, default=None, help="бюджет чтения содержимого на сканирование, МБ")
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help="бюджет времени чтения содержимого, после него файлы пропускаются")
+    parser.add_argument('--no-archives', action='store_true', help="не проверять содержимое архивов")
+    parser.add_argument('--archive-depth', type=int, default=3, help="глубина вложенности архивов")
+    parser.add_argument('--archive-members', type=int, default=10000, help="максимум файлов в одном архиве")
+    parser.add_argument('--archive-ratio', type=int, default=100,
+                        help="предел распакованного объёма относительно размера архива")
+
+def add_instrumentation_arguments(parser):
+    """Метрики и профилирование для любой консольной команды"""
+    parser.add_argument('--metrics', action='store_true', help="собрать метрики и вывести их в конце")
+    parser.add_argument('--metrics-file', help="сохранить метрики в файл (.prom - Prometheus, иначе JSON)")
+    parser.add_argument('--profile', action='append', choices=PROFILE_OPERATIONS, default=[],
+                        help="профилировать операцию cProfile (отчёт в stderr)")
+
+def run_instrumented(args):
+    """Запуск команды с включёнными по аргументам метриками и профилированием"""
+    METRICS.enabled = args.metrics or bool(args.metrics_file)
+    for operation in args.profile:
+        METRICS.set_profiling(operation, True)
+    try:
+        return args.handler(args)
+    finally:
+        if args.metrics:
+            emit('metrics', **METRICS.snapshot())
+        if args.metrics_file:
+            METRICS.dump(args.metrics_file)
+        for operation in args.profile:
+            sys.stderr.write(METRICS.profile_report(operation))
+
+def build_parser():
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        prog='Security.py',
+        description="Монитор безопасности. Без команды запускается графический интерфейс."
+    )
+    commands = parser.add_subparsers(dest='command')
+    
+    scan = commands.add_parser('scan', help="сканирование файлов")
+    scan.add_argument('paths', nargs='*', help="пути (по умолчанию ~/Downloads)")
+    scan.add_argument('--workers', type=int, default=None, help="рабочих потоков на устройство (корни на разных дисках сканируются параллельно)")
+    scan.add_argument('--processes', type=int, default=0,
+                      help="проверять в пуле из N процессов вместо потоков (для многоядерных машин)")
+    scan.add_argument('--output', help="экспорт угроз в файл (.csv, .jsonl или .smc)")
+    add_scanner_arguments(scan)
+    add_instrumentation_arguments(scan)
+    scan.set_defaults(handler=cli_scan)
+    
+    procs = commands.add_parser('procs', help="снимок процессов")
+    procs.add_argument('--interval', type=float, default=0.5, help="пауза между замерами CPU, с")
+    procs.add_argument('--signatures', help="файл SHA-256 сигнатур для проверки исполняемых файлов")
+    procs.add_argument('--no-hash', action='store_true', help="не хэшировать исполняемые файлы")
+    procs.add_argument('--rules', help="файл правил обнаружения (.json, .toml, .yaml)")
+    procs.add_argument('--output', help="записать снимок в файл (.csv, .jsonl или .smc)")
+    add_instrumentation_arguments(procs)
+    procs.set_defaults(handler=cli_procs)
+    
+    net = commands.add_parser('net', help="снимок сетевых соединений")
+    net.add_argument('--follow', action='store_true', help="далее выводить события NEW/CLOSED/STATE_CHANGED")
+    net.add_argument('--interval', type=float, default=1.0, help="интервал замеров для --follow, с")
+    net.add_argument('--source', choices=('psutil', 'proc'), default='psutil', help="источник соединений (proc - /proc/net/tcp, Linux)")
+    net.add_argument('--resolve', action='store_true', help="обратный DNS удалённых адресов")
+    net.add_argument('--resolve-timeout', type=float, default=2.0, help="ожидание ответов DNS для снимка, с")
+    net.add_argument('--blocklist', help="файл блок-листа IP-адресов и подсетей")
+    net.add_argument('--rules', help="файл правил обнаружения (.json, .toml, .yaml)")
+    net.add_argument('--output', help="записать снимок в файл (.csv, .jsonl или .smc, без --follow)")
+    add_instrumentation_arguments(net)
+    net.set_defaults(handler=cli_net)
+    
+    rules = commands.add_parser('rules', help="проверка файла правил обнаружения")
+    rules.add_argument('path', nargs='?', help="файл правил (по умолчанию rules.json в каталоге данных)")
+    add_instrumentation_arguments(rules)
+    rules.set_defaults(handler=cli_rules)
+    
+    bench = commands.add_parser('bench', help="замеры производительности на синтетических данных")
+    bench.add_argument('--files', type=int, default=1000, help="файлов в синтетическом дереве")
+    bench.add_argument('--shape', choices=('wide', 'deep'), default='wide', help="форма дерева")
+    bench.add_argument('--file-size', type=int, default=4096, help="размер файла, байт")
+    bench.add_argument('--signatures', type=int, default=10000, help="число SHA-256 сигнатур")
+    bench.add_argument('--patterns', type=int, default=100, help="число байтовых сигнатур")
+    bench.add_argument('--processes', type=int, default=500, help="процессов в подменённом psutil")
+    bench.add_argument('--connections', type=int, default=2000, help="соединений в подменённом psutil")
+    bench.add_argument('--refreshes', type=int, default=20, help="число обновлений для замера задержки")
+    bench.add_argument('--workers', type=int, default=None, help="рабочих потоков сканирования")
+    bench.add_argument('--only', nargs='+', choices=('scan', 'shard', 'patterns', 'procs', 'net', 'records'),
+                       help="только эти замеры (shard - пул процессов, по умолчанию не запускается)")
+    bench.add_argument('--shard-processes', type=int, nargs='+', default=None,
+                       help="размеры пула процессов для shard (по умолчанию 1, 2, 4... до числа ядер)")
+    bench.add_argument('--pattern-counts', type=int, nargs='+', default=[1, 10, 100, 1000, 10000],
+                       help="числа байтовых сигнатур для замера patterns")
+    bench.add_argument('--workdir', help="каталог для дерева (по умолчанию временный, удаляется)")
+    bench.add_argument('--label', help="метка версии в отчёте")
+    bench.add_argument('--save', help="сохранить отчёт в JSON")
+    bench.add_argument('--compare', help="сравнить с сохранённым отчётом")
+    bench.add_argument('--threshold', type=float, default=10.0, help="порог регрессии, %%")
+    add_instrumentation_arguments(bench)
+    bench.set_defaults(handler=cli_bench)
+    
+    watch = commands.add_parser('watch', help="периодические замеры процессов и сети")
+    watch.add_argument('--interval', type=float, default=2.0, help="интервал замеров, с")
+    watch.add_argument('--count', type=int, default=None, help="число замеров (по умолчанию бесконечно)")
+    watch.add_argument('--paths', nargs='+', default=[], help="каталоги для наблюдения за новыми файлами")
+    watch.add_argument('--no-metrics', action='store_true', help="только наблюдение за файлами")
+    add_scanner_arguments(watch)
+    add_instrumentation_arguments(watch)
+    watch.set_defaults(handler=cli_watch)
+    
+    gui = commands.add_parser('gui', help="графический интерфейс (по умолчанию)")
+    gui.add_argument(
+        '--startup-time', action='store_true',
+        help="вывести время до первого показа окна (мс) и выйти"
+    )
+    return parser
+
+def run_gui(startup_time=False):
+    load_tk()
     root = tk.Tk()
     app = SecurityMonitor(root)
+    app.exit_after_startup = startup_time
     
     # Обработка закрытия
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
     
     # Запуск
     root.mainloop()
+    return 0
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        return run_gui()
+    
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        return run_gui()
+    if args.command == 'gui':
+        return run_gui(startup_time=args.startup_time)
+    set_error_handler(lambda message: emit('error', message=message))
+    try:
+        return run_instrumented(args)
+    except BrokenPipeError:
+        # Вывод закрыт (например, | head) - это не ошибка
+        sys.stdout = None
+        return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,1517 @@
+import os
+import sys
+import threading
+from collections import namedtuple
+
+import pytest
+
+import Security
+
+
+def make_scanner(tmp_path, **kwargs):
+    """Сканер с индексом и правилами во временном каталоге"""
+    rules = Security.RuleSet(str(tmp_path / 'rules.json'))
+    return Security.BasicFileScanner(index_path=str(tmp_path / 'index.db'), rules=rules, **kwargs)
+
+
+def run_job(scanner, paths, **kwargs):
+    """Сканирование ScanJob до конца, возвращает последнее сообщение"""
+    job = Security.ScanJob(scanner, paths, workers=2, **kwargs)
+    job.start()
+    while True:
+        message = job.queue.get(timeout=30)
+        if message[0] != 'progress':
+            return message
+
+
+def write_files(folder, count, prefix='f'):
+    folder.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        (folder / f'{prefix}{i}.txt').write_bytes(b'x' * (i % 7))
+
+
+# ==================== Записи ====================
+
+def test_threat_record_formats_lazily():
+    threat = Security.ThreatRecord('/tmp/a.bin', 'PATTERN', 'Evil', offset=42, timestamp=0.0)
+    assert not hasattr(threat, '__dict__')
+    assert threat.reason == 'Байтовая сигнатура Evil по смещению 42'
+    assert threat.level == 'high'
+    row = threat.as_dict()
+    assert row['reason'] == threat.reason and row['offset'] == 42 and row['severity'] == 'high'
+    assert row['timestamp'] == Security.datetime.fromtimestamp(0.0).isoformat(timespec='seconds')
+    
+    rule = Security.ThreatRecord('/tmp/b.exe', 'RULE', 'exe-in-downloads', severity='low')
+    assert rule.reason == 'Правило exe-in-downloads' and rule.level == 'low'
+    assert rule.as_dict()['offset'] is None
+    assert Security.ThreatRecord('/tmp/c', 'OTHER', 'custom').reason == 'custom'
+    assert Security.ThreatRecord('/tmp/c', 'OTHER', 'custom').level == 'medium'
+
+
+def test_process_and_connection_records_format_on_demand():
+    proc = Security.ProcessRecord(7, 'sshd', 1.5, 0.25, exe_sha256=b'\xab' * 32)
+    assert not hasattr(proc, '__dict__')
+    row = proc.as_dict()
+    assert row['exe_sha256'] == 'ab' * 32 and row['ppid'] is None and row['rss_delta'] == 0
+    assert Security.ProcessRecord(8, 'x', 0.0, 0.0).as_dict()['exe_sha256'] is None
+    
+    conn = Security.ConnectionRecord(7, ('10.0.0.1', 22), ('203.0.113.5', 50000), 'ESTABLISHED', 'sshd')
+    listen = Security.ConnectionRecord(7, ('0.0.0.0', 22), None, 'LISTEN')
+    assert conn.local == '10.0.0.1:22' and conn.remote == '203.0.113.5:50000'
+    assert listen.remote == '' and listen.key == (7, ('0.0.0.0', 22), (), 'LISTEN')
+    assert conn.key == (7, ('10.0.0.1', 22), ('203.0.113.5', 50000), 'ESTABLISHED')
+    assert conn.as_dict() == {
+        'pid': 7, 'process': 'sshd', 'local': '10.0.0.1:22', 'remote': '203.0.113.5:50000',
+        'hostname': None, 'status': 'ESTABLISHED', 'blocked': None, 'rule': None, 'severity': None
+    }
+
+
+def test_records_take_less_memory_than_dicts():
+    sizes = Security.measure_record_memory(2000)
+    assert sizes['record'] < sizes['dict']
+
+
+# ==================== Instrumentation ====================
+
+def test_instrumentation_disabled_is_a_no_op():
+    metrics = Security.Instrumentation()
+    assert metrics.timer('scan') is Security._NULL_CONTEXT
+    assert metrics.profile('scan') is Security._NULL_CONTEXT
+    with metrics.timer('scan'):
+        metrics.count('files', 5)
+    metrics.add_time('scan', 1.0)
+    metrics.merge({'files': 3}, {'scan': [1, 1.0, 1.0]})
+    snapshot = metrics.snapshot()
+    assert snapshot['enabled'] is False and snapshot['timers'] == {} and snapshot['counters'] == {}
+    assert metrics.to_prometheus(prefix='t').splitlines() == [
+        '# HELP t_operation_seconds Время горячих участков',
+        '# TYPE t_operation_seconds summary',
+        '# TYPE t_operation_seconds_max gauge',
+        '# TYPE t_events_total counter',
+    ]
+
+
+def test_instrumentation_prometheus_and_json_output(tmp_path):
+    import json
+    metrics = Security.Instrumentation()
+    metrics.enabled = True
+    metrics.add_time('scan', 0.25)
+    metrics.add_time('scan', 0.5)
+    metrics.merge({'files': 3}, {'scan': [2, 0.25, 0.125], 'hash': [1, 0.001, 0.001]})
+    metrics.count('files', 2)
+    assert metrics.snapshot()['timers']['scan'] == {'calls': 4, 'total_ms': 1000.0, 'avg_ms': 250.0, 'max_ms': 500.0}
+    assert metrics.to_prometheus(prefix='t') == (
+        '# HELP t_operation_seconds Время горячих участков\n'
+        '# TYPE t_operation_seconds summary\n'
+        't_operation_seconds_sum{operation="hash"} 0.001000\n'
+        't_operation_seconds_count{operation="hash"} 1\n'
+        't_operation_seconds_sum{operation="scan"} 1.000000\n'
+        't_operation_seconds_count{operation="scan"} 4\n'
+        '# TYPE t_operation_seconds_max gauge\n'
+        't_operation_seconds_max{operation="hash"} 0.001000\n'
+        't_operation_seconds_max{operation="scan"} 0.500000\n'
+        '# TYPE t_events_total counter\n'
+        't_events_total{name="files"} 5\n'
+    )
+    
+    metrics.dump(str(tmp_path / 'metrics.prom'))
+    metrics.dump(str(tmp_path / 'metrics.json'))
+    assert (tmp_path / 'metrics.prom').read_text(encoding='utf-8') == metrics.to_prometheus()
+    assert json.loads((tmp_path / 'metrics.json').read_text(encoding='utf-8'))['counters'] == {'files': 5}
+    
+    counters, timers = metrics.take()
+    assert counters == {'files': 5} and timers['scan'][0] == 4
+    assert metrics.snapshot()['counters'] == {}
+
+
+def test_instrumentation_profiles_selected_operations():
+    metrics = Security.Instrumentation()
+    metrics.set_profiling('scan', True)
+    assert metrics.profile('render') is Security._NULL_CONTEXT
+    with metrics.profile('scan'):
+        sorted(range(1000))
+    assert 'sorted' in metrics.profile_report('scan')
+    assert metrics.profile_report('render') == 'Профиль операции render пуст'
+    metrics.set_profiling('scan', False)
+    assert metrics.profile('scan') is Security._NULL_CONTEXT
+
+
+# ==================== ScanIndex ====================
+
+def test_index_roundtrip(tmp_path):
+    index = Security.ScanIndex(str(tmp_path / 'index.db'))
+    entry = Security.FileEntry(str(tmp_path / 'a'), 'a', 10, 123, 7, 1)
+    index.record(str(tmp_path), entry, sha256=b'\x01' * 32, patterns='[]')
+    index.flush()
+    assert index.lookup(str(tmp_path), 'a') == (10, 123, 7, b'\x01' * 32, '[]', None, None)
+    assert set(index.lookup_dir(str(tmp_path))) == {'a'}
+    index.forget(str(tmp_path), ['a'])
+    assert index.lookup(str(tmp_path), 'a') is None
+    index.close()
+
+
+def test_index_relative_dirs_are_absolute(tmp_path, monkeypatch):
+    index = Security.ScanIndex(str(tmp_path / 'index.db'))
+    for name in ('one', 'two'):
+        (tmp_path / name).mkdir()
+        monkeypatch.chdir(tmp_path / name)
+        index.record('.', Security.FileEntry('./x', 'x', len(name), 1, 1, 1))
+    index.flush()
+    assert index.lookup(str(tmp_path / 'one'), 'x')[0] == 3
+    assert index.lookup(str(tmp_path / 'two'), 'x')[0] == 3
+    monkeypatch.chdir(tmp_path / 'one')
+    assert set(index.lookup_dir('.')) == {'x'}
+    assert len(index) == 2
+    index.close()
+
+
+def index_names(scanner, folder):
+    scanner.index.flush()
+    return set(scanner.index.lookup_dir(str(folder)))
+
+
+def test_rescan_prunes_large_directory(tmp_path):
+    folder = tmp_path / 'tree' / 'big'
+    write_files(folder, Security.ScanJob.BATCH_SIZE + 50)
+    scanner = make_scanner(tmp_path)
+    assert run_job(scanner, [str(tmp_path / 'tree')]) == ('done', False)
+    assert len(index_names(scanner, folder)) == Security.ScanJob.BATCH_SIZE + 50
+    
+    for i in range(5):
+        (folder / f'f{i}.txt').unlink()
+    scanner = make_scanner(tmp_path)
+    run_job(scanner, [str(tmp_path / 'tree')])
+    names = index_names(scanner, folder)
+    assert len(names) == Security.ScanJob.BATCH_SIZE + 45
+    assert 'f0.txt' not in names
+
+
+def test_warm_rescan_reads_large_directory_once(tmp_path, monkeypatch):
+    count = Security.ScanJob.BATCH_SIZE * 3 + 10
+    folder = tmp_path / 'tree' / 'big'
+    write_files(folder, count)
+    scanner = make_scanner(tmp_path)
+    run_job(scanner, [str(tmp_path / 'tree')])
+    scanner.index.flush()
+    
+    fetched = []
+    for name in ('lookup_dir', 'lookup_names', 'names'):
+        method = getattr(Security.ScanIndex, name)
+        def counted(self, *args, method=method):
+            rows = method(self, *args)
+            fetched.append(len(rows))
+            return rows
+        monkeypatch.setattr(Security.ScanIndex, name, counted)
+    
+    scanner = make_scanner(tmp_path)
+    job = Security.ScanJob(scanner, [str(tmp_path / 'tree')], workers=2)
+    job.start()
+    while job.queue.get(timeout=30)[0] == 'progress':
+        pass
+    assert job.files_unchanged == count
+    # Каждая строка каталога читается один раз плюс один список имён
+    assert sum(fetched) == count * 2
+    assert len(index_names(scanner, folder)) == count
+
+
+def test_rescan_prunes_deferred_and_emptied_directories(tmp_path):
+    tree = tmp_path / 'tree'
+    write_files(tree / 'mixed', 3)
+    (tree / 'mixed' / 'large.bin').write_bytes(b'\0' * 4096)
+    write_files(tree / 'emptied', 2)
+    scanner = make_scanner(tmp_path)
+    scanner.large_files.full_limit = 1024
+    run_job(scanner, [str(tree)])
+    assert index_names(scanner, tree / 'mixed') == {'f0.txt', 'f1.txt', 'f2.txt', 'large.bin'}
+    
+    (tree / 'mixed' / 'f1.txt').unlink()
+    for path in (tree / 'emptied').iterdir():
+        path.unlink()
+    scanner = make_scanner(tmp_path)
+    scanner.large_files.full_limit = 1024
+    run_job(scanner, [str(tree)])
+    assert index_names(scanner, tree / 'mixed') == {'f0.txt', 'f2.txt', 'large.bin'}
+    assert index_names(scanner, tree / 'emptied') == set()
+
+
+# ==================== PatternMatcher ====================
+
+def first_offsets(pairs):
+    hits = {}
+    for rule_id, offset in pairs:
+        hits.setdefault(rule_id, offset)
+    return hits
+
+
+def naive_offsets(data, patterns):
+    return {rule_id: data.find(p) for rule_id, p in patterns.items() if data.find(p) >= 0}
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_matcher_finds_first_offsets(seed):
+    import random
+    rng = random.Random(seed)
+    alphabet = bytes(rng.sample(range(256), 3))
+    data = bytes(rng.choice(alphabet) for _ in range(rng.randint(0, 400)))
+    patterns = {
+        f'p{i}': bytes(rng.choice(alphabet) for _ in range(rng.randint(1, 12)))
+        for i in range(rng.randint(1, 40))
+    }
+    matcher = Security.PatternMatcher(patterns)
+    assert first_offsets(matcher.scan(data)) == naive_offsets(data, patterns)
+
+
+@pytest.mark.parametrize('count', [3, 50])
+def test_stream_matches_across_chunks(count):
+    import random
+    rng = random.Random(count)
+    patterns = {f'r{i}': rng.randbytes(rng.choice((3, 12))) for i in range(count)}
+    data = bytearray(rng.randbytes(5000))
+    for i, pattern in enumerate(patterns.values()):
+        at = 97 * i + 50
+        data[at:at + len(pattern)] = pattern
+    data = bytes(data)
+    expected = naive_offsets(data, patterns)
+    
+    matcher = Security.PatternMatcher(patterns)
+    for chunk in (1, 5, 11, 4096):
+        stream = matcher.stream(max_hits=1000)
+        for start in range(0, len(data), chunk):
+            stream.feed(data[start:start + chunk])
+        assert dict(stream.results()) == expected
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matcher_padding_and_frequent_words(seed, monkeypatch):
+    import random
+    # Частые слова сразу уходят в find, ненужные слова снимаются с прохода
+    monkeypatch.setattr(Security.AnchorGroup, 'HOT_LIMIT', 3)
+    monkeypatch.setattr(Security.AnchorGroup, 'RETIRE_BATCH', 1)
+    rng = random.Random(seed)
+    code = b'\x0f\x1f\x84\x00\x00\x00\x00\x00'
+    data = b''.join(rng.choice((code, b'\0' * rng.randint(1, 24), rng.randbytes(rng.randint(1, 9))))
+                    for _ in range(300))
+    patterns = {}
+    for i in range(60):
+        start = rng.randrange(len(data) - 40)
+        pattern = data[start:start + rng.randint(7, 40)]
+        if i % 3 == 0:
+            pattern = b'\0' * 8 + pattern  # Начало из нулей, как у выровненных секций
+        patterns[f'p{i}'] = pattern
+    patterns['zeros'] = b'\0' * 32
+    patterns['absent'] = code + b'\xee' * 9
+    
+    matcher = Security.PatternMatcher(patterns)
+    expected = naive_offsets(data, patterns)
+    for buffer in (data, memoryview(data)):
+        hits = list(matcher.scan(buffer))
+        assert dict(hits) == expected
+        assert [offset for _, offset in hits] == sorted(offset for _, offset in hits)
+
+
+def test_pattern_database_match_file(tmp_path):
+    rules = tmp_path / 'patterns.txt'
+    rules.write_text('Long 4d5a90000300000004000000\nShort "EVIL"\n# comment\n', encoding='utf-8')
+    database = Security.PatternDatabase(str(rules))
+    assert database.load() == 2
+    sample = tmp_path / 'sample.bin'
+    sample.write_bytes(b'\0' * 1001 + bytes.fromhex('4d5a90000300000004000000') + b'..EVIL')
+    assert sorted(database.match_file(str(sample))) == [['Long', 1001], ['Short', 1015]]
+    assert database.match_ranges(str(sample), [(1000, 8)]) == []
+
+
+# ==================== ConnectionTracker ====================
+
+from collections import namedtuple
+
+Conn = namedtuple('Conn', 'pid laddr raddr status')
+
+
+def test_tracker_diffs_snapshots():
+    tracker = Security.ConnectionTracker()
+    a = Conn(1, ('10.0.0.1', 5000), ('1.1.1.1', 443), 'SYN_SENT')
+    b = Conn(2, ('10.0.0.1', 5001), ('8.8.8.8', 53), 'ESTABLISHED')
+    assert tracker.update([a, b], now=100) == []
+    
+    events = tracker.update([a._replace(status='ESTABLISHED')], now=105)
+    assert [(event.kind, event.connection.pid) for event in events] == [('STATE_CHANGED', 1), ('CLOSED', 2)]
+    assert events[0].previous_status == 'SYN_SENT'
+    assert events[1].lifetime == 5
+    
+    c = Conn(3, ('10.0.0.1', 5002), ('9.9.9.9', 443), 'ESTABLISHED')
+    events = tracker.update([a._replace(status='ESTABLISHED'), c], now=110)
+    assert [event.kind for event in events] == ['NEW']
+    assert tracker.lifetime(a, now=112) == 12
+    assert tracker.lifetime(b) is None
+    assert [event.kind for event in tracker.take_events()] == ['STATE_CHANGED', 'CLOSED', 'NEW']
+    assert tracker.stats() == {
+        'active': 2, 'closed': 1, 'avg_closed_lifetime': 5.0,
+        'events': {'STATE_CHANGED': 1, 'CLOSED': 1, 'NEW': 1}
+    }
+
+
+def test_tracker_stats_while_updating():
+    import threading
+    tracker = Security.ConnectionTracker()
+    stop = threading.Event()
+    
+    def churn():
+        for i in range(2000):
+            tracker.update([Conn(i, ('10.0.0.1', port), ('1.1.1.1', 443), 'ESTABLISHED')
+                            for port in range(i % 50, i % 50 + 200)])
+        stop.set()
+    
+    thread = threading.Thread(target=churn)
+    thread.start()
+    while not stop.is_set():
+        tracker.stats()
+        tracker.lifetime(Conn(0, ('10.0.0.1', 0), ('1.1.1.1', 443), 'ESTABLISHED'))
+    thread.join()
+
+
+def test_fresh_alerts_keep_only_current_snapshot():
+    reported = set()
+    assert Security.fresh_alerts(reported, {(1, 'r'): 'a', (2, 'r'): 'b'}) == ['a', 'b']
+    assert Security.fresh_alerts(reported, {(2, 'r'): 'b', (3, 'r'): 'c'}) == ['c']
+    assert reported == {(2, 'r'), (3, 'r')}
+    assert Security.fresh_alerts(reported, {}) == []
+    assert reported == set()
+
+
+# ==================== ScanJob ====================
+
+def drain(job):
+    """Все сообщения ScanJob до завершающего"""
+    messages = []
+    while not messages or messages[-1][0] == 'progress':
+        messages.append(job.queue.get(timeout=30))
+    return messages
+
+
+def test_scan_job_progress_counts_files_and_threats(tmp_path):
+    tree = tmp_path / 'tree'
+    for i in range(5):
+        write_files(tree / f'd{i}', 30)
+    (tree / 'd0' / 'note.txt').write_bytes(b'...EVILPAYLOAD...')
+    patterns = tmp_path / 'patterns.txt'
+    patterns.write_text('Evil "EVILPAYLOAD"\n', encoding='utf-8')
+    scanner = make_scanner(tmp_path, patterns_path=str(patterns), signatures_path=str(tmp_path / 'none.txt'))
+    job = Security.ScanJob(scanner, [str(tree)], workers=2)
+    job.BATCH_SIZE = 8
+    job.start()
+    messages = drain(job)
+    
+    assert messages[-1] == ('done', False)
+    progress = messages[:-1]
+    counts = [count for _, count, _ in progress]
+    # Счётчик нарастающий, каждая пачка - отдельное сообщение (пустой
+    # корень тоже приходит пачкой: по ней чистится индекс)
+    assert counts == sorted(counts)
+    assert counts[-1] == job.files_done == 151
+    assert len(progress) == 5 * 4 + 1
+    reported = [threat for _, _, threats in progress for threat in threats]
+    assert [threat.file for threat in reported] == [str(tree / 'd0' / 'note.txt')]
+    assert reported == job.threats
+    assert job.wait(10) and not job.is_running()
+
+
+def test_scan_job_cancel_stops_walk_and_reports_done(tmp_path):
+    tree = tmp_path / 'tree'
+    for i in range(40):
+        write_files(tree / f'd{i:02}', 3)
+    scanner = make_scanner(tmp_path)
+    job = Security.ScanJob(scanner, [str(tree)], workers=1)
+    check = scanner.check_directory
+    
+    def check_and_cancel(*args):
+        job.cancel()
+        return check(*args)
+    
+    scanner.check_directory = check_and_cancel
+    job.start()
+    messages = drain(job)
+    assert messages[-1] == ('done', True)
+    assert job.cancel_event.is_set()
+    # Обход остановился: проверены только уже отправленные пачки
+    assert job.files_done < 120
+    assert all(message[0] == 'progress' for message in messages[:-1])
+    
+    # Отмена до запуска: ни одного файла
+    job = Security.ScanJob(make_scanner(tmp_path), [str(tree)], workers=1)
+    job.cancel()
+    job.start()
+    assert drain(job) == [('done', True)]
+    assert job.files_done == 0
+
+
+def test_group_roots_drops_nested_and_missing_roots(tmp_path):
+    tree = tmp_path / 'tree'
+    (tree / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'tree2').mkdir()
+    (tmp_path / 'link').symlink_to(tree / 'a')
+    devices = Security.ScanJob.group_roots([
+        str(tree / 'a' / 'b'), str(tmp_path / 'tree2'), str(tree), str(tmp_path / 'link'),
+        str(tree) + os.sep, str(tmp_path / 'missing')
+    ])
+    # Вложенные (в том числе через символическую ссылку) и повторные корни
+    # отброшены, соседний каталог с общим префиксом имени - нет
+    assert devices == {os.stat(tree).st_dev: [str(tree), str(tmp_path / 'tree2')]}
+
+
+def test_group_roots_groups_by_device(tmp_path, monkeypatch):
+    for name in ('disk1', 'disk2', 'disk3'):
+        (tmp_path / name / 'inner').mkdir(parents=True)
+    real_stat = os.stat
+    
+    def fake_stat(path, *args, **kwargs):
+        st = real_stat(path, *args, **kwargs)
+        dev = 2 if 'disk2' in str(path) else 1
+        return os.stat_result((st.st_mode, st.st_ino, dev) + tuple(st)[3:])
+    
+    monkeypatch.setattr(os, 'stat', fake_stat)
+    devices = Security.ScanJob.group_roots([
+        str(tmp_path / 'disk1'), str(tmp_path / 'disk2' / 'inner'), str(tmp_path / 'disk3'),
+        str(tmp_path / 'disk2'), str(tmp_path / 'disk1' / 'inner')
+    ])
+    assert devices == {1: [str(tmp_path / 'disk1'), str(tmp_path / 'disk3')], 2: [str(tmp_path / 'disk2')]}
+
+
+def test_scan_job_reports_pool_start_failure(tmp_path, monkeypatch):
+    job = Security.ScanJob(make_scanner(tmp_path), [str(tmp_path)], processes=2)
+    
+    def broken_pool():
+        raise OSError('no semaphores')
+    
+    monkeypatch.setattr(job, '_start_pool', broken_pool)
+    job.start()
+    assert job.queue.get(timeout=5) == ('error', 'Пул процессов не запущен: no semaphores')
+    assert not job.is_running() and job.wait(0)
+
+
+# ==================== ScanJob с пулом процессов ====================
+
+def make_threat_tree(tree):
+    write_files(tree / 'plain', 20)
+    (tree / 'bad').mkdir(parents=True)
+    (tree / 'bad' / 'run.exe').write_bytes(b'MZ')
+    (tree / 'bad' / 'note.txt').write_bytes(b'...EVILPAYLOAD...')
+
+
+def scan_threats(tmp_path, name, processes):
+    patterns = tmp_path / 'patterns.txt'
+    patterns.write_text('Evil "EVILPAYLOAD"\n', encoding='utf-8')
+    scanner = Security.BasicFileScanner(
+        index_path=str(tmp_path / f'{name}.db'), patterns_path=str(patterns),
+        signatures_path=str(tmp_path / 'none.txt'), rules=Security.RuleSet(str(tmp_path / 'rules.json'))
+    )
+    job = Security.ScanJob(scanner, [str(tmp_path / 'tree')], workers=2, processes=processes)
+    job.start()
+    while True:
+        message = job.queue.get(timeout=120)
+        if message[0] != 'progress':
+            break
+    assert message == ('done', False)
+    return job, sorted((t.file, t.type, t.detail) for t in job.threats)
+
+
+def test_process_pool_matches_threads(tmp_path):
+    make_threat_tree(tmp_path / 'tree')
+    _, expected = scan_threats(tmp_path, 'threads', 0)
+    assert sorted(kind for _, kind, _ in expected) == ['PATTERN', 'RULE']
+    job, threats = scan_threats(tmp_path, 'pool', 2)
+    assert threats == expected
+    assert job.start_method is not None
+
+
+def test_process_pool_does_not_fork_beside_other_threads(tmp_path):
+    import threading
+    make_threat_tree(tmp_path / 'tree')
+    stop = threading.Event()
+    other = threading.Thread(target=stop.wait)
+    other.start()
+    try:
+        job, threats = scan_threats(tmp_path, 'pool', 1)
+    finally:
+        stop.set()
+        other.join()
+    assert job.start_method in ('forkserver', 'spawn')
+    assert len(threats) == 2
+
+
+# ==================== Правила ====================
+
+def test_range_index_bounds_are_inclusive():
+    index = Security.RangeIndex()
+    index.add(10, 20, 'a')
+    index.add(20, None, 'b')
+    index.add(None, 5, 'c')
+    index.compile()
+    assert index.lookup(9.9) == ()
+    assert index.lookup(10) == ('a',)
+    assert set(index.lookup(20)) == {'a', 'b'}
+    assert index.lookup(21) == ('b',)
+    assert index.lookup(-100) == ('c',)
+    assert index.lookup(5) == ('c',)
+
+
+def test_path_trie_returns_all_prefixes():
+    trie = Security.PathTrie()
+    trie.insert(Security.split_path('/tmp'), 'tmp')
+    trie.insert(Security.split_path('/tmp/a/b'), 'deep')
+    trie.insert(Security.split_path('/var'), 'var')
+    assert trie.lookup(Security.split_path('/tmp/a/b/c.exe')) == ['tmp', 'deep']
+    assert trie.lookup(Security.split_path('/tmp/ab')) == ['tmp']
+    assert trie.lookup(Security.split_path('/home/x')) == []
+
+
+def write_rules(path, rules):
+    import json
+    path.write_text(json.dumps({'rules': rules}), encoding='utf-8')
+
+
+def test_rules_match_files_processes_and_connections(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, [
+        {'id': 'big-tmp', 'target': 'file', 'severity': 'high', 'paths': [str(tmp_path)], 'size': {'min': 100}},
+        {'id': 'scripts', 'target': 'file', 'severity': 'low', 'extensions': ['ps1'], 'names': ['run*']},
+        {'id': 'miner', 'target': 'process', 'severity': 'critical', 'names': ['xmrig'], 'cpu': {'min': 50}},
+        {'id': 'smtp', 'target': 'network', 'remote_ports': [25, {'min': 465, 'max': 465}], 'remote': '10.0.0.0/8'},
+    ])
+    rules = Security.RuleSet(str(path))
+    assert rules.load() == 4
+    assert [r.id for r in rules.match_file(str(tmp_path / 'x.bin'), 'x.bin', 100)] == ['big-tmp']
+    assert rules.match_file(str(tmp_path / 'x.bin'), 'x.bin', 99) == []
+    assert [r.id for r in rules.match_file('/elsewhere/RUN.PS1', 'RUN.PS1', 1)] == ['scripts']
+    assert rules.match_file('/elsewhere/go.ps1', 'go.ps1', 1) == []
+    
+    proc = Security.ProcessRecord(1, 'xmrig', 80.0, 1.0)
+    assert [r.id for r in rules.match_process(proc)] == ['miner']
+    assert rules.match_process(Security.ProcessRecord(1, 'xmrig', 10.0, 1.0)) == []
+    
+    conn = Security.ConnectionRecord(1, ('10.0.0.2', 4000), ('10.1.2.3', 465), 'ESTABLISHED')
+    assert [r.id for r in rules.match_connection(conn)] == ['smtp']
+    conn = Security.ConnectionRecord(1, ('10.0.0.2', 4000), ('8.8.8.8', 25), 'ESTABLISHED')
+    assert rules.match_connection(conn) == []
+
+
+def test_rule_index_indexes_networks_and_literal_names():
+    compile_rule = Security.RuleSet.compile_rule
+    network = Security.RuleIndex()
+    for i in range(200):
+        network.add(compile_rule({'id': f'net{i}', 'target': 'network', 'remote': f'10.{i}.0.0/16'}))
+    network.add(compile_rule({'id': 'wide', 'target': 'network', 'remote': ['10.0.0.0/8', '2001:db8::/32']}))
+    network.add(compile_rule({'id': 'host', 'target': 'network', 'remote': '10.7.1.1'}))
+    network.compile()
+    assert network.always == []
+    
+    def hits(ip):
+        return sorted(rule.id for rule in network.match({'remote_ip': Security.IPBlocklist.parse_ip(ip)}))
+    assert hits('10.7.1.1') == ['host', 'net7', 'wide']
+    assert hits('10.250.0.1') == ['wide']
+    assert hits('2001:db8::1') == ['wide']
+    assert hits('192.0.2.1') == []
+    
+    files = Security.RuleIndex()
+    files.add(compile_rule({'id': 'literal', 'target': 'file', 'names': ['payload.exe', 'Dropper.dll']}))
+    files.add(compile_rule({'id': 'mask', 'target': 'file', 'names': ['run*.ps1']}))
+    files.compile()
+    assert [rule.id for rule in files.always] == ['mask']
+    assert set(files.exact['name']) == {'payload.exe', 'dropper.dll'}
+    record = {'name': 'dropper.dll', 'ext': '.dll', 'path': (), 'size': 1}
+    assert [rule.id for rule in files.match(record)] == ['literal']
+    assert [rule.id for rule in files.match(dict(record, name='run-me.ps1'))] == ['mask']
+
+
+@pytest.mark.parametrize('bad', [
+    {'min': '10'},
+    {'min': 10, 'max': 5},
+    {'min': True},
+    {'low': 1},
+    'big',
+    None,
+])
+def test_malformed_range_is_a_value_error(bad):
+    with pytest.raises(ValueError):
+        Security.RuleSet.compile_rule({'id': 'x', 'target': 'file', 'size': bad})
+
+
+def test_reload_keeps_previous_rules_on_error(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, [{'id': 'one', 'target': 'file', 'extensions': ['.one']}])
+    rules = Security.RuleSet(str(path))
+    rules.CHECK_INTERVAL = 0
+    assert rules.load_if_exists() == 1
+    
+    write_rules(path, [{'id': 'two', 'target': 'file', 'size': {'min': '10'}}])
+    os.utime(path, ns=(1, rules.mtime_ns + 10 ** 9))
+    assert rules.refresh() is False
+    assert 'size' in rules.error
+    assert [r.id for r in rules.match_file('/a.one', 'a.one', 1)] == ['one']
+    
+    write_rules(path, [{'id': 'two', 'target': 'file', 'size': {'min': 10}}])
+    os.utime(path, ns=(1, rules.mtime_ns + 10 ** 9))
+    assert rules.refresh() is True
+    assert rules.error is None
+    assert [r.id for r in rules.match_file('/a.one', 'a.one', 10)] == ['two']
+
+
+def test_cli_rules_reports_malformed_file(tmp_path, capsys):
+    import json
+    path = tmp_path / 'rules.json'
+    write_rules(path, [{'id': 'x', 'target': 'file', 'size': {'min': '10'}}])
+    assert Security.main(['rules', str(path)]) == 1
+    event = json.loads(capsys.readouterr().out)
+    assert event['event'] == 'error' and 'min' in event['message']
+
+
+# ==================== Ошибки в консольном режиме ====================
+
+def test_cli_errors_stay_json_lines(tmp_path, capsys):
+    import json
+    write_files(tmp_path / 'tree', 2)
+    rules = tmp_path / 'rules.json'
+    rules.write_text('{"rules": [', encoding='utf-8')
+    signatures = tmp_path / 'signatures'
+    signatures.mkdir()  # Каталог вместо файла - ошибка чтения
+    code = Security.main([
+        'scan', str(tmp_path / 'tree'), '--no-index',
+        '--rules', str(rules), '--signatures', str(signatures)
+    ])
+    assert code == 0
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    errors = [event['message'] for event in events if event['event'] == 'error']
+    assert any('сигнатуры' in message for message in errors)
+    assert any('правила' in message for message in errors)
+    assert events[-1]['event'] == 'summary'
+
+
+# ==================== Консольный режим ====================
+
+def cli_events(capsys):
+    import json
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_cli_scan_streams_threats_and_summary(tmp_path, capsys):
+    make_threat_tree(tmp_path / 'tree')
+    patterns = tmp_path / 'patterns.txt'
+    patterns.write_text('Evil "EVILPAYLOAD"\n', encoding='utf-8')
+    output = tmp_path / 'threats.jsonl'
+    code = Security.main([
+        'scan', str(tmp_path / 'tree'), '--no-index', '--patterns', str(patterns),
+        '--signatures', str(tmp_path / 'none.txt'), '--rules', str(tmp_path / 'rules.json'),
+        '--output', str(output)
+    ])
+    assert code == 0
+    events = cli_events(capsys)
+    threats = [event for event in events if event['event'] == 'threat']
+    assert sorted(event['type'] for event in threats) == ['PATTERN', 'RULE']
+    pattern = next(event for event in threats if event['type'] == 'PATTERN')
+    assert pattern['file'].endswith('note.txt') and pattern['offset'] == 3 and pattern['severity'] == 'high'
+    
+    export = next(event for event in events if event['event'] == 'export')
+    assert export['format'] == 'jsonl' and export['records'] == 2
+    assert len(output.read_text(encoding='utf-8').splitlines()) == 2
+    summary = events[-1]
+    assert summary['event'] == 'summary'
+    assert summary['files'] == 22 and summary['threats'] == 2 and summary['devices'] == 1
+    assert summary['cancelled'] is False and summary['paths'] == [str(tmp_path / 'tree')]
+
+
+def test_cli_scan_error_exits_with_1(tmp_path, capsys, monkeypatch):
+    def broken_pool(self):
+        raise OSError('no semaphores')
+    
+    monkeypatch.setattr(Security.ScanJob, '_start_pool', broken_pool)
+    code = Security.main(['scan', str(tmp_path), '--no-index', '--processes', '2'])
+    assert code == 1
+    events = cli_events(capsys)
+    assert [event['event'] for event in events] == ['error']
+    assert events[0]['message'] == 'Пул процессов не запущен: no semaphores'
+
+
+def test_cli_scan_interrupt_before_thread_started(tmp_path, capsys, monkeypatch):
+    class Interrupted:
+        def get(self, *args):
+            raise KeyboardInterrupt
+    
+    def start(job):
+        job.queue = Interrupted()
+    
+    monkeypatch.setattr(Security.ScanJob, 'start', start)
+    assert Security.main(['scan', str(tmp_path), '--no-index']) == 0
+    summary = cli_events(capsys)[-1]
+    assert summary['event'] == 'summary'
+    assert summary['cancelled'] is True and summary['files'] == 0
+
+
+def test_cli_procs_sorted_json_and_export(tmp_path, capsys, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'psutil', Security.FakePsutil(20, 0))
+    code = Security.main(['procs', '--interval', '0', '--no-hash', '--rules', str(tmp_path / 'rules.json')])
+    assert code == 0
+    events = cli_events(capsys)
+    assert len(events) == 20 and {event['event'] for event in events} == {'process'}
+    cpu = [event['cpu'] for event in events]
+    assert cpu == sorted(cpu, reverse=True)
+    assert all(event['exe_sha256'] is None and event['name'].startswith('worker') for event in events)
+    
+    output = tmp_path / 'procs.csv'
+    code = Security.main([
+        'procs', '--interval', '0', '--no-hash', '--rules', str(tmp_path / 'rules.json'), '--output', str(output)
+    ])
+    assert code == 0
+    assert cli_events(capsys) == [
+        {'event': 'export', 'kind': 'processes', 'path': str(output), 'format': 'csv', 'records': 20}
+    ]
+    assert len(output.read_text(encoding='utf-8').splitlines()) == 21
+
+
+# ==================== FileWalker ====================
+
+def walked(walker, root):
+    return sorted(os.path.relpath(entry.path, root) for entry in walker.walk(str(root)))
+
+
+def test_walker_entries_exclude_and_depth(tmp_path):
+    write_files(tmp_path / 'a' / 'b' / 'c', 1)
+    write_files(tmp_path / 'a', 2)
+    write_files(tmp_path / 'node_modules', 3)
+    (tmp_path / 'top.log').write_bytes(b'12345')
+    
+    entries = {entry.name: entry for entry in Security.FileWalker().walk(str(tmp_path))}
+    assert entries['top.log'].size == 5
+    assert entries['top.log'].inode == os.stat(tmp_path / 'top.log').st_ino
+    assert len(walked(Security.FileWalker(), tmp_path)) == 7
+    
+    walker = Security.FileWalker(exclude=['node_modules', '*.log'])
+    assert walked(walker, tmp_path) == ['a/b/c/f0.txt', 'a/f0.txt', 'a/f1.txt']
+    assert walked(Security.FileWalker(max_depth=1), tmp_path) == [
+        'a/f0.txt', 'a/f1.txt', 'node_modules/f0.txt', 'node_modules/f1.txt', 'node_modules/f2.txt', 'top.log'
+    ]
+
+
+def test_walker_symlink_policies(tmp_path):
+    write_files(tmp_path / 'real', 1)
+    os.symlink(tmp_path / 'real' / 'f0.txt', tmp_path / 'link.txt')
+    os.symlink(tmp_path, tmp_path / 'real' / 'loop')
+    assert walked(Security.FileWalker(symlinks='skip'), tmp_path) == ['real/f0.txt']
+    assert walked(Security.FileWalker(symlinks='files'), tmp_path) == ['link.txt', 'real/f0.txt']
+    # Цикл через ссылку на корень обходится один раз
+    assert walked(Security.FileWalker(symlinks='follow'), tmp_path) == ['link.txt', 'real/f0.txt']
+    with pytest.raises(ValueError):
+        Security.FileWalker(symlinks='maybe')
+
+
+# ==================== FileWatcher ====================
+
+class ScriptedStop:
+    """Событие остановки, которое вместо паузы между опросами делает шаг теста"""
+    
+    def __init__(self, *steps):
+        self.steps = list(steps)
+    
+    def is_set(self):
+        return False
+    
+    def wait(self, timeout):
+        if not self.steps:
+            return True
+        self.steps.pop(0)()
+        return False
+
+
+def test_polling_watcher_batches_changes_per_poll(tmp_path):
+    old = tmp_path / 'old.txt'
+    old.write_bytes(b'1')
+    (tmp_path / 'gone.txt').write_bytes(b'1')
+    batches = []
+    watcher = Security.FileWatcher([str(tmp_path)], batches.append, use_inotify=False)
+    
+    def create_and_modify():
+        (tmp_path / 'a.txt').write_bytes(b'a')
+        (tmp_path / 'sub').mkdir()
+        (tmp_path / 'sub' / 'b.txt').write_bytes(b'b')
+        old.write_bytes(b'22')
+    
+    def touch_and_delete():
+        st = old.stat()
+        os.utime(old, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        (tmp_path / 'gone.txt').unlink()
+    
+    watcher._run_polling(ScriptedStop(create_and_modify, lambda: None, touch_and_delete))
+    assert watcher.backend == 'polling'
+    # Один опрос - одна пачка; опрос без изменений и удаление пачек не дают
+    assert [sorted(batch) for batch in batches] == [
+        sorted([str(tmp_path / 'a.txt'), str(tmp_path / 'sub' / 'b.txt'), str(old)]),
+        [str(old)],
+    ]
+
+
+def test_watcher_flush_waits_for_quiet_or_full_batch():
+    batches = []
+    watcher = Security.FileWatcher([], batches.append, debounce=60, max_batch=3)
+    watcher._add('/a')
+    watcher._add('/b')
+    watcher._add('/a')
+    watcher._flush()
+    assert batches == []
+    watcher._add('/c')
+    watcher._flush()
+    assert batches == [['/a', '/b', '/c']]
+    
+    watcher._add('/d')
+    watcher.debounce = 0
+    watcher._flush()
+    watcher._flush(force=True)
+    assert batches[1:] == [['/d']]
+    
+    def broken(batch):
+        raise RuntimeError('callback failed')
+    
+    watcher.callback = broken
+    watcher._add('/e')
+    watcher._flush(force=True)
+    assert watcher.last_error == 'callback failed' and watcher._pending == {}
+
+
+def test_polling_watcher_thread_reports_new_file(tmp_path):
+    import queue
+    batches = queue.Queue()
+    watcher = Security.FileWatcher([str(tmp_path)], batches.put, poll_interval=0.05, use_inotify=False)
+    watcher.start()
+    try:
+        deadline = Security.time.monotonic() + 5
+        while watcher.backend is None and Security.time.monotonic() < deadline:
+            Security.time.sleep(0.01)
+        Security.time.sleep(0.1)  # Первый снимок снят
+        (tmp_path / 'new.txt').write_bytes(b'x')
+        assert batches.get(timeout=5) == [str(tmp_path / 'new.txt')]
+    finally:
+        watcher.stop()
+        watcher._thread.join(5)
+    assert not watcher.is_running()
+
+
+# ==================== Сигнатуры SHA-256 ====================
+
+def sha256_hex(data):
+    import hashlib
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_signature_database_parsing(tmp_path):
+    path = tmp_path / 'signatures.txt'
+    path.write_text(
+        f"# comment\n{sha256_hex(b'bad')} Trojan.Bad\n{sha256_hex(b'other').upper()}\n"
+        f"partial:{'ab' * 32} Big.Sample\nnot-hex\n{'ab' * 16}\n",
+        encoding='utf-8'
+    )
+    database = Security.SignatureDatabase(str(path))
+    assert database.load() == 3
+    assert database.match(bytes.fromhex(sha256_hex(b'bad'))) == 'Trojan.Bad'
+    assert database.match(bytes.fromhex(sha256_hex(b'other'))) == sha256_hex(b'other')
+    assert database.match(bytes.fromhex(sha256_hex(b'good'))) is None
+    assert database.match_partial(bytes.fromhex('ab' * 32)) == 'Big.Sample'
+    assert bytes.fromhex('ab' * 32) not in database
+
+
+def test_scanner_hash_detection_and_warm_index(tmp_path):
+    tree = tmp_path / 'tree'
+    write_files(tree, 5)
+    (tree / 'bad.bin').write_bytes(b'malicious')
+    signatures = tmp_path / 'signatures.txt'
+    signatures.write_text(f"{sha256_hex(b'malicious')} Test.Bad\n", encoding='utf-8')
+    
+    def scan():
+        scanner = make_scanner(tmp_path, signatures_path=str(signatures))
+        job = Security.ScanJob(scanner, [str(tree)], workers=2)
+        job.start()
+        while job.queue.get(timeout=30)[0] == 'progress':
+            pass
+        return job
+    
+    cold = scan()
+    assert [(t.type, t.detail) for t in cold.threats] == [('HASH', 'Test.Bad')]
+    assert cold.files_unchanged == 0
+    warm = scan()
+    assert [(t.type, t.detail) for t in warm.threats] == [('HASH', 'Test.Bad')]
+    assert warm.files_unchanged == 6
+    
+    (tree / 'bad.bin').write_bytes(b'cleaned up')
+    assert scan().threats == []
+
+
+# ==================== ScanResultStore ====================
+
+def test_result_store_deduplicates_and_filters():
+    store = Security.ScanResultStore()
+    first = Security.ThreatRecord('/a.exe', 'RULE', 'ext', severity='medium', timestamp=100.0)
+    assert store.add(first) is True
+    assert store.add(Security.ThreatRecord('/a.exe', 'RULE', 'ext', timestamp=200.0)) is False
+    store.add(Security.ThreatRecord('/a.exe', 'HASH', 'Bad', timestamp=150.0))
+    store.add(Security.ThreatRecord('/b.bin', 'PATTERN', 'Evil', 12, timestamp=300.0))
+    
+    assert len(store) == 3
+    assert '/a.exe' in store and '/c' not in store
+    assert [t.detail for t in store.for_file('/a.exe')] == ['ext', 'Bad']
+    assert [t.detail for t in store.filter(threat_type='HASH')] == ['Bad']
+    assert [t.detail for t in store.filter(since=120, until=250)] == ['Bad']
+    assert [t.detail for t in store.filter(reason='Evil')] == ['Evil']
+    assert [t.detail for t in store.recent(2)] == ['Bad', 'Evil']
+    assert [t.detail for t in store.page(1, 5)] == ['Bad', 'Evil']
+    assert [len(chunk) for chunk in store.chunks(2)] == [2, 1]
+
+
+# ==================== Экспорт ====================
+
+def export(kind, records, path, chunk=2):
+    job = Security.ExportJob(kind, Security.chunked(records, chunk), str(path), total=len(records))
+    job.run()
+    assert job.queue.queue[-1] == ('done', len(records), False)
+    assert not os.path.exists(str(path) + '.part')
+
+
+def test_columnar_roundtrip(tmp_path):
+    records = [
+        Security.ProcessRecord(1, 'init', 0.5, 1.25, exe='/sbin/init', ppid=None),
+        Security.ProcessRecord(2, 'процесс', 99.0, 0.0, rule='miner', severity='critical'),
+        Security.ProcessRecord(3, 'init', 0.0, 2.5, rss=2 ** 40),
+    ]
+    path = tmp_path / 'processes.smc'
+    export('processes', records, path)
+    header, rows = Security.read_columnar(str(path))
+    assert header['kind'] == 'processes'
+    names = [name for name, _ in Security.EXPORT_SCHEMAS['processes']]
+    expected = [{name: record.as_dict().get(name) for name in names} for record in records]
+    assert list(rows) == expected
+    
+    (tmp_path / 'bad.smc').write_bytes(b'nope')
+    with pytest.raises(ValueError):
+        Security.read_columnar(str(tmp_path / 'bad.smc'))
+
+
+def test_read_columnar_closes_file_on_errors(tmp_path, monkeypatch):
+    import builtins
+    import struct
+    opened = []
+    
+    def tracking_open(*args, **kwargs):
+        f = builtins.open(*args, **kwargs)
+        opened.append(f)
+        return f
+    
+    monkeypatch.setattr(Security, 'open', tracking_open, raising=False)
+    (tmp_path / 'bad.smc').write_bytes(b'nope')
+    (tmp_path / 'short.smc').write_bytes(Security.ColumnarWriter.MAGIC + struct.pack('<I', 100) + b'{"kind"')
+    (tmp_path / 'empty.smc').write_bytes(Security.ColumnarWriter.MAGIC)
+    for name in ('bad.smc', 'short.smc', 'empty.smc'):
+        with pytest.raises((ValueError, struct.error)):
+            Security.read_columnar(str(tmp_path / name))
+    assert len(opened) == 3 and all(f.closed for f in opened)
+    
+    path = tmp_path / 'threats.smc'
+    export('threats', [Security.ThreatRecord('/a', 'RULE', 'r')], path)
+    opened.clear()
+    header, rows = Security.read_columnar(str(path))
+    assert header['kind'] == 'threats' and all(f.closed for f in opened)
+    assert [row['file'] for row in rows] == ['/a']
+    assert len(opened) == 2 and all(f.closed for f in opened)
+
+
+def test_text_exports(tmp_path):
+    import csv
+    import json
+    store = Security.ScanResultStore()
+    for i in range(5):
+        store.add(Security.ThreatRecord(f'/f{i}', 'PATTERN', 'Evil', i))
+    export('threats', list(store), tmp_path / 'threats.jsonl')
+    lines = [json.loads(line) for line in (tmp_path / 'threats.jsonl').read_text(encoding='utf-8').splitlines()]
+    assert [line['offset'] for line in lines] == [0, 1, 2, 3, 4]
+    
+    export('threats', list(store), tmp_path / 'threats.csv')
+    with open(tmp_path / 'threats.csv', newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['file'] for row in rows] == [f'/f{i}' for i in range(5)]
+    assert rows[0]['severity'] == 'high'
+
+
+# ==================== Блок-лист и обогащение соединений ====================
+
+def test_prefix_trie_longest_match():
+    trie = Security.PrefixTrie(32)
+    trie.insert(0x0A000000, 8, 1)   # 10.0.0.0/8
+    trie.insert(0x0A010000, 16, 2)  # 10.1.0.0/16
+    assert trie.longest(0x0A010203) == 2
+    assert trie.longest(0x0A020304) == 1
+    assert trie.longest(0x0B000000) == -1
+    trie.insert(0, 0, 0)  # 0.0.0.0/0
+    assert trie.longest(0x0B000000) == 0
+
+
+def test_blocklist_addresses_and_networks(tmp_path):
+    path = tmp_path / 'blocklist.txt'
+    path.write_text(
+        "# comment\n203.0.113.7 c2-server\n198.51.100.0/24 bad-net\n"
+        "2001:db8::/32 doc-v6\n10.1.2.3/8\nnot-an-ip\n",
+        encoding='utf-8'
+    )
+    blocklist = Security.IPBlocklist(str(path))
+    assert blocklist.load() == 4
+    assert blocklist.match('203.0.113.7') == 'c2-server'
+    assert blocklist.match('203.0.113.8') is None
+    assert blocklist.match('198.51.100.200') == 'bad-net'
+    assert blocklist.match('2001:db8:1::5') == 'doc-v6'
+    assert blocklist.match('10.200.0.1') == '10.1.2.3/8'  # Биты хоста отбрасываются
+    assert blocklist.match('garbage') is None
+
+
+def test_blocklist_unwraps_mapped_ipv4_and_scope(tmp_path):
+    assert Security.IPBlocklist.parse_ip('::ffff:203.0.113.7') == (4, 0xCB007107)
+    assert Security.IPBlocklist.parse_ip('::ffff:cb00:7107') == (4, 0xCB007107)
+    assert Security.IPBlocklist.parse_ip('fe80::1%eth0') == (6, 0xFE80 << 112 | 1)
+    assert Security.IPBlocklist.parse_ip('::1') == (6, 1)
+    assert Security.IPBlocklist.parse_ip('1.2.3.4%eth0') is None
+    
+    path = tmp_path / 'blocklist.txt'
+    path.write_text(
+        "203.0.113.7 c2-server\n::ffff:198.51.100.0/120 mapped-net\nfe80::/10 link-local\n",
+        encoding='utf-8'
+    )
+    blocklist = Security.IPBlocklist(str(path))
+    assert blocklist.load() == 3
+    assert blocklist.match('::ffff:203.0.113.7') == 'c2-server'
+    assert blocklist.match('198.51.100.9') == 'mapped-net'
+    assert blocklist.match('::ffff:198.51.100.9') == 'mapped-net'
+    assert blocklist.match('fe80::1%eth0') == 'link-local'
+    assert blocklist.match('::ffff:8.8.8.8') is None
+
+
+def test_enricher_joins_names_blocklist_and_rules(tmp_path):
+    path = tmp_path / 'blocklist.txt'
+    path.write_text("198.51.100.0/24 bad-net\n", encoding='utf-8')
+    rules = tmp_path / 'rules.json'
+    write_rules(rules, [{'id': 'curl-out', 'target': 'network', 'severity': 'high', 'processes': ['curl']}])
+    enricher = Security.ConnectionEnricher(Security.IPBlocklist(str(path)), rules=Security.RuleSet(str(rules)))
+    enricher.rules.load()
+    connections = [
+        Security.ConnectionRecord(10, ('10.0.0.2', 5000), ('198.51.100.9', 443), 'ESTABLISHED'),
+        Security.ConnectionRecord(11, ('10.0.0.2', 5001), ('8.8.8.8', 53), 'ESTABLISHED'),
+        Security.ConnectionRecord(12, ('0.0.0.0', 22), None, 'LISTEN'),
+    ]
+    blocked = enricher.enrich(connections, {10: 'curl', 11: 'dns'})
+    assert blocked == [connections[0]]
+    assert [conn.process for conn in connections] == ['curl', 'dns', '']
+    assert [conn.blocked for conn in connections] == ['bad-net', None, None]
+    assert [conn.rule for conn in connections] == ['curl-out', None, None]
+
+
+# ==================== Монитор процессов ====================
+
+def test_exe_hash_cache_keys_on_inode_and_mtime(tmp_path):
+    import hashlib
+    cache = Security.ExeHashCache()
+    exe = tmp_path / 'app'
+    exe.write_bytes(b'v1')
+    assert cache.digest(str(exe)) == hashlib.sha256(b'v1').digest()
+    assert cache.digest(str(exe)) == hashlib.sha256(b'v1').digest()
+    assert (cache.hits, cache.misses) == (1, 1)
+    
+    # Переписанный на месте файл (новый mtime) хэшируется заново
+    exe.write_bytes(b'v2')
+    st = exe.stat()
+    os.utime(exe, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert cache.digest(str(exe)) == hashlib.sha256(b'v2').digest()
+    # Подмена через rename: другой inode при том же mtime
+    other = tmp_path / 'app.new'
+    other.write_bytes(b'v3')
+    os.utime(other, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    other.replace(exe)
+    assert cache.digest(str(exe)) == hashlib.sha256(b'v3').digest()
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert cache.digest(str(tmp_path / 'missing')) is None
+
+
+def test_exe_hash_cache_evicts_least_recently_used(tmp_path):
+    cache = Security.ExeHashCache(maxsize=2)
+    paths = []
+    for name in 'abc':
+        (tmp_path / name).write_bytes(name.encode())
+        paths.append(str(tmp_path / name))
+    a, b, c = paths
+    cache.digest(a)
+    cache.digest(b)
+    cache.digest(a)  # a становится самым свежим
+    cache.digest(c)  # вытесняет b
+    assert len(cache) == 2 and (cache.hits, cache.misses) == (1, 3)
+    cache.digest(a)
+    assert cache.hits == 2
+    cache.digest(b)
+    assert cache.misses == 4 and len(cache) == 2
+
+
+class SlowHashCache(Security.ExeHashCache):
+    """Кэш хэшей, который держит хэширование до сигнала теста"""
+    
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+    
+    def digest(self, path):
+        self.started.set()
+        assert self.release.wait(10)
+        return b'\x02' * 32
+
+
+def test_process_monitor_hashes_outside_lock(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'psutil', Security.FakePsutil(3, 0))
+    cache = SlowHashCache()
+    monitor = Security.BasicProcessMonitor(exe_cache=cache)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(monitor.get_processes()))
+    thread.start()
+    assert cache.started.wait(10)
+    # Пока идёт хэширование, имена процессов уже доступны
+    names = []
+    reader = threading.Thread(target=lambda: names.append(monitor.names()))
+    reader.start()
+    reader.join(2)
+    cache.release.set()
+    thread.join(10)
+    assert len(names) == 1 and len(names[0]) == 3
+    assert [proc.exe_sha256 for proc in result[0]] == [b'\x02' * 32] * 3
+    # Посчитанный хэш запоминается в ручке процесса
+    cache.started.clear()
+    assert all(proc.exe_sha256 == b'\x02' * 32 for proc in monitor.get_processes())
+    assert not cache.started.is_set()
+
+
+def test_sampler_run_once_skips_while_busy():
+    release = threading.Event()
+    sampler = Security.PeriodicSampler(lambda: release.wait(10) and 'done')
+    assert sampler.run_once()
+    assert not sampler.run_once()
+    release.set()
+    sampler._once.join(10)
+    assert sampler.take_latest() == 'done'
+    
+    sampler = Security.PeriodicSampler(lambda: 1 / 0)
+    assert sampler.run_once()
+    sampler._once.join(10)
+    assert sampler.take_latest() is None and 'division' in sampler.last_error
+
+
+# ==================== История метрик ====================
+
+def test_ring_buffer_wraps():
+    buffer = Security.RingBuffer(3)
+    assert list(buffer.values()) == [] and buffer.latest() == 0.0
+    for value in range(1, 6):
+        buffer.append(value)
+    assert list(buffer.values()) == [3.0, 4.0, 5.0]
+    assert list(buffer.values(2)) == [4.0, 5.0]
+    assert buffer.latest() == 5.0 and buffer.mean() == 4.0 and buffer.max(2) == 5.0
+    assert len(buffer) == 3
+
+
+Sample = namedtuple('Sample', ['pid', 'name', 'cpu', 'memory'])
+
+
+def test_metrics_history_evicts_stale_series():
+    history = Security.MetricsHistory(capacity=10, max_series=6, stale_ticks=3)
+    history.record_processes([Sample(pid, f'p{pid}', float(pid), 1.0) for pid in range(10)])
+    # Сверх max_series обновлённые в этом замере ряды не вытесняются
+    assert len(history.get('cpu', 0)) == 1
+    for _ in range(2):
+        history.record_processes([Sample(pid, f'p{pid}', float(pid), 1.0) for pid in (8, 9)])
+    # Завершённые процессы уходят сверх лимита, оставшиеся копят историю
+    assert history.get('cpu', 0) is None
+    assert history.label('cpu', 0) == '0'
+    assert history.label('cpu', 9) == 'p9'
+    assert len(history.get('cpu', 9)) == 3
+    assert [key for key, _ in history.top('cpu', 2)] == [9, 8]
+    
+    roomy = Security.MetricsHistory(max_series=100, stale_ticks=2)
+    roomy.record_processes([Sample(1, 'a', 1.0, 1.0), Sample(2, 'b', 1.0, 1.0)])
+    for _ in range(3):
+        roomy.record_processes([Sample(2, 'b', 1.0, 1.0)])
+    assert roomy.get('cpu', 1) is None and len(roomy.get('cpu', 2)) == 4
+
+
+def test_metrics_history_keeps_thousands_of_live_processes():
+    history = Security.MetricsHistory()
+    processes = [Sample(pid, f'worker-{pid}', float(pid % 7), 10.0) for pid in range(3000)]
+    for _ in range(10):
+        history.record_processes(processes)
+    assert len(history.series) == 6002
+    assert all(len(buffer) == 10 for buffer in history.series.values())
+    assert history.top('cpu', 1)[0][1] == 6.0
+
+
+def test_metrics_history_spikes():
+    history = Security.MetricsHistory()
+    for i in range(20):
+        history.add('cpu', 1, 10.0)
+        history.add('cpu', 2, 8.0 if i % 2 else 12.0)
+    history.add('cpu', 1, 90.0)
+    history.add('cpu', 2, 11.0)
+    assert [key for key, *_ in history.spikes('cpu')] == [1]
+
+
+# ==================== VirtualTable ====================
+
+class FakeTreeview:
+    """Подмена ttk.Treeview: строки по порядку и счётчики операций"""
+    
+    def __init__(self, parent, columns, show, height):
+        self.order = []
+        self.items = {}
+        self.calls = {'insert': 0, 'item': 0, 'delete': 0, 'move': 0}
+    
+    def heading(self, *args, **kwargs):
+        pass
+    
+    column = pack = bind = tag_configure = heading
+    
+    def get_children(self):
+        return tuple(self.order)
+    
+    def insert(self, parent, index, iid, values, tags=()):
+        self.calls['insert'] += 1
+        self.order.insert(index, iid)
+        self.items[iid] = (values, tags)
+    
+    def item(self, iid, values, tags=()):
+        self.calls['item'] += 1
+        self.items[iid] = (values, tags)
+    
+    def delete(self, iid):
+        self.calls['delete'] += 1
+        self.order.remove(iid)
+        del self.items[iid]
+    
+    def move(self, iid, parent, index):
+        self.calls['move'] += 1
+        self.order.remove(iid)
+        self.order.insert(index, iid)
+    
+    def values(self):
+        return [self.items[iid][0] for iid in self.order]
+
+
+class FakeScrollbar:
+    def __init__(self, parent, orient, command):
+        self.position = None
+    
+    def set(self, first, last):
+        self.position = (first, last)
+    
+    def pack(self, **kwargs):
+        pass
+
+
+@pytest.fixture
+def fake_ttk(monkeypatch):
+    monkeypatch.setattr(Security, 'ttk', type('ttk', (), {'Treeview': FakeTreeview, 'Scrollbar': FakeScrollbar}))
+
+
+def make_table(height=5):
+    return Security.VirtualTable(
+        None, ('pid', 'name'), lambda proc: (proc.pid, proc.name), key=lambda proc: proc.pid,
+        height=height, tagger=lambda proc: 'high' if proc.cpu > 50 else ''
+    )
+
+
+def test_virtual_table_materializes_only_visible_rows(fake_ttk):
+    table = make_table()
+    table.set_data([Sample(pid, f'p{pid}', 1.0, 0.0) for pid in range(3000)])
+    tree = table.tree
+    assert len(table) == 3000
+    assert tree.values() == [(pid, f'p{pid}') for pid in range(5)]
+    assert tree.calls['insert'] == 5
+    assert table.scrollbar.position == (0.0, 5 / 3000)
+    
+    # Новый снимок: меняется одна видимая строка, остальные не трогаются
+    snapshot = [Sample(pid, f'p{pid}', 90.0 if pid == 2 else 1.0, 0.0) for pid in range(3000)]
+    tree.calls = dict.fromkeys(tree.calls, 0)
+    table.set_data(snapshot)
+    assert tree.calls == {'insert': 0, 'item': 1, 'delete': 0, 'move': 0}
+    assert tree.items['2'] == ((2, 'p2'), ('high',))
+    
+    # Прокрутка на 3 строки: 3 удаления и 3 вставки
+    tree.calls = dict.fromkeys(tree.calls, 0)
+    table.scroll_by(3)
+    assert tree.values() == [(pid, f'p{pid}') for pid in range(3, 8)]
+    assert tree.calls['insert'] == 3 and tree.calls['delete'] == 3 and tree.calls['item'] == 0
+    
+    # Смена порядка в модели переставляет уже показанные строки
+    table.set_data(sorted(snapshot[:10], key=lambda proc: -proc.pid))
+    assert table.offset == 3
+    assert tree.values() == [(pid, f'p{pid}') for pid in (6, 5, 4, 3, 2)]
+    assert len(tree.items) == 5
+
+
+def test_virtual_table_paging_clamps_and_follows_tail(fake_ttk):
+    table = make_table()
+    table.set_data([Sample(pid, '', 0.0, 0.0) for pid in range(20)])
+    table.scroll_by(100)
+    assert table.offset == 15
+    table.on_scroll('moveto', '0.5')
+    assert table.offset == 10
+    table.on_scroll('scroll', '-1', 'pages')
+    assert table.offset == 5
+    table.on_scroll('scroll', '-10', 'units')
+    assert table.offset == 0
+    
+    # Показано начало - добавление не сдвигает окно
+    table.append([Sample(pid, '', 0.0, 0.0) for pid in range(20, 25)])
+    assert table.offset == 0 and len(table) == 25
+    # Показан хвост - окно следует за новыми строками, дубликаты не копятся
+    table.scroll_by(100)
+    table.append([Sample(pid, '', 0.0, 0.0) for pid in (24, 25, 26)])
+    assert len(table) == 27 and table.offset == 22
+    assert [proc.pid for proc in table.visible_records()] == list(range(22, 27))
+    
+    table.on_resize(type('Event', (), {'height': table.HEADER_HEIGHT + 10 * table.ROW_HEIGHT}))
+    assert table.page_size == 10 and table.offset == 17 and len(table.tree.items) == 10
+    table.clear()
+    assert len(table) == 0 and table.tree.items == {} and table.scrollbar.position == (0.0, 1.0)
+
+
+# ==================== Большие файлы ====================
+
+def sparse_file(path, size, head=b'', tail=b''):
+    with open(path, 'wb') as f:
+        f.write(head)
+        f.truncate(size)
+        if tail:
+            f.seek(size - len(tail))
+            f.write(tail)
+
+
+def test_large_file_classification(tmp_path):
+    policy = Security.LargeFilePolicy(full_limit=1000, exec_limit=5000, sample_size=100)
+    sparse_file(tmp_path / 'small', 1000)
+    sparse_file(tmp_path / 'tool', 4000, b'\x7fELF')
+    sparse_file(tmp_path / 'huge-tool', 6000, b'MZ')
+    sparse_file(tmp_path / 'movie', 4000, b'\0\0\0\x20ftypisom')
+    sparse_file(tmp_path / 'data', 4000)
+    assert policy.classify(str(tmp_path / 'small'), 1000) == ('full', None)
+    assert policy.classify(str(tmp_path / 'tool'), 4000) == ('full', 'executable')
+    assert policy.classify(str(tmp_path / 'huge-tool'), 6000) == ('sampled', 'executable')
+    assert policy.classify(str(tmp_path / 'movie'), 4000) == ('skipped', 'media')
+    assert policy.classify(str(tmp_path / 'data'), 4000) == ('sampled', None)
+    assert policy.read_cost('sampled', 4000) == 200
+    assert Security.sample_ranges(150, 100) == [(0, 150)]
+    assert Security.sample_ranges(4000, 100) == [(0, 100), (3900, 100)]
+
+
+def test_partial_fingerprint_ignores_the_middle(tmp_path):
+    sparse_file(tmp_path / 'a', 10000, b'head', b'tail')
+    sparse_file(tmp_path / 'b', 10000, b'head', b'tail')
+    with open(tmp_path / 'b', 'r+b') as f:
+        f.seek(5000)
+        f.write(b'changed')
+    sparse_file(tmp_path / 'c', 10001, b'head', b'tail')
+    fingerprint = lambda name, size: Security.partial_fingerprint(str(tmp_path / name), size, 100)
+    assert fingerprint('a', 10000) == fingerprint('b', 10000)
+    assert fingerprint('a', 10000) != fingerprint('c', 10001)
+
+
+def test_scan_budget():
+    budget = Security.ScanBudget(max_bytes=100)
+    assert budget.consume(60) and not budget.consume(60) and budget.consume(40)
+    assert not Security.ScanBudget(max_seconds=-1).consume(1)
+
+
+def test_scanner_samples_skips_and_reports(tmp_path):
+    tree = tmp_path / 'tree'
+    tree.mkdir()
+    sparse_file(tree / 'big.dat', 50000, b'EVILPAYLOAD', b'')
+    sparse_file(tree / 'middle.dat', 50000, b'', b'')
+    with open(tree / 'middle.dat', 'r+b') as f:
+        f.seek(25000)
+        f.write(b'EVILPAYLOAD')
+    sparse_file(tree / 'disk.iso', 50000)
+    with open(tree / 'disk.iso', 'r+b') as f:
+        f.seek(0x8001)
+        f.write(b'CD001')
+    patterns = tmp_path / 'patterns.txt'
+    patterns.write_text('Evil "EVILPAYLOAD"\n', encoding='utf-8')
+    scanner = make_scanner(tmp_path, patterns_path=str(patterns))
+    scanner.large_files = Security.LargeFilePolicy(full_limit=10000, sample_size=1000)
+    assert run_job(scanner, [str(tree)]) == ('done', False)
+    assert [(t.file, t.type) for t in scanner.scan_results] == [(str(tree / 'big.dat'), 'PATTERN')]
+    assert scanner.content_report.summary() == {
+        'sampled': {'files': 2, 'bytes': 100000},
+        'skipped': {'files': 1, 'bytes': 50000},
+    }
+
+
+# ==================== Архивы ====================
+
+def zip_bytes(members, compression=None):
+    import io
+    import zipfile
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression or zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def archive_scanner(tmp_path, **limits):
+    patterns = tmp_path / 'patterns.txt'
+    patterns.write_text('Evil "EVILPAYLOAD"\n', encoding='utf-8')
+    scanner = make_scanner(tmp_path, use_index=False, patterns_path=str(patterns))
+    scanner.archives = Security.ArchiveInspector(scanner, **limits)
+    scanner.prepare()
+    return scanner
+
+
+def inspect_archive(scanner, path):
+    kind, threats = scanner.archives.inspect(Security.FileWalker.entry_for(str(path)))
+    return kind, sorted((t.file.split('!', 1)[1], t.type) for t in threats or ())
+
+
+def test_nested_archives_and_depth_limit(tmp_path):
+    inner = zip_bytes({'deep.vbs': b'x', 'note.txt': b'..EVILPAYLOAD..'})
+    (tmp_path / 'outer.zip').write_bytes(zip_bytes({'inner.zip': inner, 'readme.txt': b'ok'}))
+    
+    kind, threats = inspect_archive(archive_scanner(tmp_path), tmp_path / 'outer.zip')
+    assert kind == 'zip'
+    assert threats == [('inner.zip!deep.vbs', 'RULE'), ('inner.zip!note.txt', 'PATTERN')]
+    
+    scanner = archive_scanner(tmp_path, max_depth=1)
+    assert inspect_archive(scanner, tmp_path / 'outer.zip') == ('zip', [])
+    assert [item[3] for item in scanner.content_report.items] == ['archive depth']
+
+
+def test_tar_gz_match_across_chunk_boundary(tmp_path):
+    import io
+    import tarfile
+    data = os.urandom(Security.HASH_CHUNK_SIZE - 4) + b'EVILPAYLOAD'  # Нули сжались бы выше max_ratio
+    with tarfile.open(tmp_path / 'data.tar.gz', 'w:gz') as archive:
+        info = tarfile.TarInfo('x/data.bin')
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+    scanner = archive_scanner(tmp_path)
+    kind, threats = scanner.archives.inspect(Security.FileWalker.entry_for(str(tmp_path / 'data.tar.gz')))
+    assert kind == 'gzip'
+    assert [(t.file.split('!')[-1], t.offset) for t in threats] == [('x/data.bin', Security.HASH_CHUNK_SIZE - 4)]
+
+
+def test_archive_limits(tmp_path):
+    (tmp_path / 'bomb.zip').write_bytes(zip_bytes({'zeros.bin': b'\0' * (4 * 2 ** 20)}))
+    (tmp_path / 'many.zip').write_bytes(zip_bytes({f'f{i}.txt': b'x' for i in range(20)}))
+    (tmp_path / 'broken.zip').write_bytes(b'PK\x03\x04 broken')
+    (tmp_path / 'plain.txt').write_bytes(b'not an archive')
+    
+    scanner = archive_scanner(tmp_path, max_members=10)
+    assert inspect_archive(scanner, tmp_path / 'bomb.zip') == ('zip', [])
+    assert inspect_archive(scanner, tmp_path / 'many.zip') == ('zip', [])
+    assert inspect_archive(scanner, tmp_path / 'broken.zip') == ('zip', [])
+    assert inspect_archive(scanner, tmp_path / 'plain.txt') == (None, [])
+    reasons = [item[3] for item in scanner.content_report.items]
+    assert reasons[:2] == ['archive ratio', 'archive members']
+    assert reasons[2].startswith('archive damaged')